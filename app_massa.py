@@ -24,8 +24,19 @@ from tkinter import ttk
 import shutil
 import logging
 import pandas as pd
+import numpy as np
 import re
 import csv
+import codecs
+import json
+import sqlite3
+import zlib
+import hashlib
+import multiprocessing
+import multiprocessing.connection
+import string
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
 
@@ -36,13 +47,23 @@ ctk.set_default_color_theme("blue")
 class ProcessadorMassa:
     """Classe responsável pelo processamento em massa de arquivos XML de NF-e"""
     
+    COLUNAS_RELATORIO = [
+        'Chave de Acesso', 'Nota Fiscal', 'Sucesso de Conversão', 'Arquivo XML',
+        'Data/Hora Processamento', 'Pasta Origem', 'Tamanho Arquivo (KB)', 'Erro Detalhado',
+        'Tipo de Documento', 'Cancelada', 'Tamanho PDF (KB)'
+    ]
+    
+    # Situação dos arquivos que não passam pela conversão (eventos, CT-e, outros XMLs)
+    SITUACAO_IGNORADO = 'Ignorado'
+
+    
     def __init__(self):
         self.pasta_xmls = None
         self.pasta_saida = None
         self.template_path = None
         
-        # Cache para otimização
-        self.template_cache = None
+        # Cache para otimização: templates compilados, recompilados só quando o arquivo muda
+        self.template_cache = CacheTemplates()
         
         # Estatísticas
         self.total_arquivos = 0
@@ -53,8 +74,14 @@ class ProcessadorMassa:
         self.processando = False
         self.parar_solicitado = False
         
-        # Dados para relatório Excel
+        # Dados para relatório Excel (uma tupla por XML, na ordem de COLUNAS_RELATORIO)
         self.dados_relatorio = []
+        
+        # Catálogo SQLite das notas processadas (aberto durante a conversão)
+        self.catalogo = None
+        
+        # Fatia (i, N) do lote quando várias máquinas convertem a mesma pasta; None = todos os XMLs
+        self.fatia = None
     
     def descobrir_xmls(self, pasta_xmls: str) -> List[str]:
         """Descobrir todos os XMLs na pasta"""
@@ -73,113 +100,287 @@ class ProcessadorMassa:
         
         # Filtrar apenas arquivos válidos
         xmls_validos = [xml for xml in xmls_encontrados if os.path.isfile(xml)]
+        if self.fatia:
+            xmls_validos = self.filtrar_fatia(xmls_validos, pasta_xmls)
         return sorted(xmls_validos)
     
-    def processar_xml_nfe(self, xml_path: str, template_content: str, output_dir: str, pdf_filename: str) -> Dict[str, Any]:
-        """Processar um único XML de NF-e e gerar PDF"""
+    # Divisão determinística do lote entre máquinas (modo i/N)
+    # Eventos (Id="ID<tpEvento><chave><nSeq>") caem na mesma fatia da nota a que se referem
+    PADRAO_CHAVE_NOME = re.compile(r'(?<!\d)\d{44}(?!\d)')
+    PADRAO_CHAVE_CONTEUDO = re.compile(rb'Id="(?:NFe|ID\d{6})(\d{44})')
+    PADRAO_RELATORIO_FATIA = re.compile(r'^Relatorio_Conversao_NFe_(\d{8}_\d{6})_fatia_(\d+)de(\d+)\.xlsx$')
+    
+    @staticmethod
+    def interpretar_fatia(texto: str):
+        """'i/N' (1 ≤ i ≤ N) -> (i, N); texto vazio -> None"""
+        texto = (texto or '').strip()
+        if not texto:
+            return None
         try:
-            # Ler e parsear o XML
-            with open(xml_path, 'r', encoding='utf-8') as f:
-                xml_content = f.read()
-            
-            # Parse do XML
-            root = etree.fromstring(xml_content.encode('utf-8'))
+            indice, total = (int(parte) for parte in texto.split('/'))
+        except ValueError:
+            raise ValueError(f"Fatia inválida: '{texto}' (use i/N, por exemplo 2/4)")
+        if total < 1 or not 1 <= indice <= total:
+            raise ValueError(f"Fatia inválida: '{texto}' (i deve estar entre 1 e N)")
+        return indice, total
+    
+    @staticmethod
+    def identificador_fatia(xml_path: str, pasta_xmls: str) -> str:
+        """Chave de acesso do XML (pelo nome ou pelo atributo Id no início do arquivo); sem chave,
+        o caminho relativo à pasta. Igual em todas as máquinas que enxergam a mesma pasta"""
+        chave = ProcessadorMassa.PADRAO_CHAVE_NOME.search(os.path.basename(xml_path))
+        if chave:
+            return chave.group(0)
+        try:
+            with open(xml_path, 'rb') as f:
+                chave = ProcessadorMassa.PADRAO_CHAVE_CONTEUDO.search(f.read(ProcessadorMassa.TAMANHO_LEITURA))
+            if chave:
+                return chave.group(1).decode('ascii')
+        except OSError:
+            pass
+        return os.path.relpath(xml_path, pasta_xmls).replace(os.sep, '/')
+    
+    def filtrar_fatia(self, xmls: List[str], pasta_xmls: str) -> List[str]:
+        """Manter só os XMLs cuja chave cai nesta fatia (CRC32 da chave módulo N)"""
+        indice, total = self.fatia
+        return [
+            xml for xml in xmls
+            if zlib.crc32(self.identificador_fatia(xml, pasta_xmls).encode('utf-8')) % total == indice - 1
+        ]
+    
+    @property
+    def sufixo_fatia(self) -> str:
+        return f"_fatia_{self.fatia[0]}de{self.fatia[1]}" if self.fatia else ''
+    
+    @staticmethod
+    def mesclar_relatorios(pasta: str, excel_path: str = None) -> Dict[str, Any]:
+        """Combinar os relatórios das fatias (Relatorio_Conversao_NFe_<data>_fatia_<i>de<N>.xlsx) da
+        pasta no relatório padrão: conversão, estatísticas, exceções fiscais e numeração (recalculada
+        pelas chaves, já que as lacunas de uma fatia isolada não valem para o lote)"""
+        relatorios = {}
+        for nome in sorted(os.listdir(pasta)):
+            encontrado = ProcessadorMassa.PADRAO_RELATORIO_FATIA.match(nome)
+            if encontrado:
+                # Se uma fatia foi reprocessada, vale o relatório mais recente
+                indice, total = int(encontrado.group(2)), int(encontrado.group(3))
+                relatorios[(total, indice)] = os.path.join(pasta, nome)
+        if not relatorios:
+            raise FileNotFoundError(f"Nenhum relatório de fatia em {pasta}")
+        totais = {total for total, _ in relatorios}
+        if len(totais) > 1:
+            raise ValueError(f"Relatórios de divisões diferentes na mesma pasta: {sorted(totais)} fatias")
+        total = totais.pop()
+        
+        partes, excecoes, inicios, fins = [], [], [], []
+        contadores = {'Tempo Limite Excedido': 0, 'Limite de Memória Excedido': 0}
+        for (_, indice), caminho in sorted(relatorios.items()):
+            abas = pd.read_excel(caminho, sheet_name=None, dtype={'Chave de Acesso': str, 'Nota Fiscal': str})
+            partes.append(abas['Relatório Conversão'])
+            if 'Exceções Fiscais' in abas:
+                excecoes.append(abas['Exceções Fiscais'])
+            estatisticas = dict(zip(abas['Estatísticas']['Estatística'], abas['Estatísticas']['Valor']))
+            inicios.append(datetime.strptime(str(estatisticas['Data/Hora Início']), '%d/%m/%Y %H:%M:%S'))
+            fins.append(datetime.strptime(str(estatisticas['Data/Hora Fim']), '%d/%m/%Y %H:%M:%S'))
+            for rotulo in contadores:
+                contadores[rotulo] += int(estatisticas.get(rotulo) or 0)
+        
+        df = pd.concat(partes, ignore_index=True)
+        textos = ['Chave de Acesso', 'Nota Fiscal', 'Erro Detalhado', 'Tipo de Documento', 'Cancelada']
+        df[textos] = df[textos].fillna('')
+        df = df.sort_values(['Pasta Origem', 'Arquivo XML'], kind='stable', ignore_index=True)
+        excecoes_df = pd.concat(excecoes, ignore_index=True) if excecoes else None
+        
+        numeracao = AnaliseNumeracao()
+        for chave in df['Chave de Acesso']:
+            if len(chave) == 44:
+                numeracao.adicionar({'emit_CNPJ': chave[6:20], 'mod': chave[20:22], 'serie': chave[22:25], 'nNF': chave[25:34]})
+        numeracao_df = numeracao.apurar()
+        
+        stats_df = ProcessadorMassa.estatisticas_relatorio(
+            df, min(inicios).timestamp(), max(fins).timestamp(),
+            excecoes=len(excecoes_df) if excecoes_df is not None else None,
+            tempo_esgotado=contadores['Tempo Limite Excedido'],
+            memoria_excedida=contadores['Limite de Memória Excedido']
+        )
+        if excel_path is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            excel_path = os.path.join(pasta, f"Relatorio_Conversao_NFe_{timestamp}.xlsx")
+        ProcessadorMassa.salvar_relatorio_excel(excel_path, df, stats_df, excecoes_df, numeracao_df)
+        
+        return {
+            'excel_path': excel_path,
+            'fatias': sorted(indice for _, indice in relatorios),
+            'total_fatias': total,
+            'ausentes': sorted(set(range(1, total + 1)) - {indice for _, indice in relatorios}),
+            'arquivos': len(df),
+        }
+    
+    @staticmethod
+    def custo_estimado(xml_path: str) -> float:
+        """Custo relativo de conversão de um XML: o tamanho do arquivo acompanha a quantidade de
+        itens (det) e sai de um stat, sem ler o conteúdo"""
+        try:
+            return float(os.path.getsize(xml_path))
+        except OSError:
+            return 0.0
+    
+    @staticmethod
+    def ordenar_por_custo(xmls: List[str], custo=None) -> List[str]:
+        """Ordenar do mais caro para o mais barato (LPT): as notas enormes começam primeiro e as
+        pequenas preenchem os processos que forem ficando livres no fim do lote"""
+        custo = custo or ProcessadorMassa.custo_estimado
+        custos = np.fromiter((custo(xml) for xml in xmls), dtype=np.float64, count=len(xmls))
+        ordem = np.argsort(-custos, kind='stable')
+        return [xmls[i] for i in ordem]
+    
+    def extrair_dados_nfe(self, xml_path: str) -> Dict[str, Any]:
+        """Ler um XML de NF-e e extrair todos os dados usados pelo template (sem gerar PDF)"""
+        # Ler e parsear o XML
+        with open(xml_path, 'r', encoding='utf-8') as f:
+            xml_content = f.read()
+        
+        # Parse do XML
+        root = etree.fromstring(xml_content.encode('utf-8'))
+        
+        # Namespace da NFe
+        ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+        
+        # Extrair dados principais da NFe
+        inf_nfe = root.xpath('.//nfe:infNFe', namespaces=ns)[0]
+        
+        # Dados do emitente
+        emit = inf_nfe.xpath('.//nfe:emit', namespaces=ns)[0]
+        
+        # Dados do destinatário
+        dest = inf_nfe.xpath('.//nfe:dest', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:dest', namespaces=ns) else None
+        
+        # Dados da NFe
+        ide = inf_nfe.xpath('.//nfe:ide', namespaces=ns)[0]
+        
+        # Dados dos produtos
+        produtos = inf_nfe.xpath('.//nfe:det', namespaces=ns)
+        
+        # Totais
+        total = inf_nfe.xpath('.//nfe:total/nfe:ICMSTot', namespaces=ns)[0]
+        
+        # Dados de transporte
+        transp = inf_nfe.xpath('.//nfe:transp', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:transp', namespaces=ns) else None
+        
+        # Informações adicionais
+        inf_adic = inf_nfe.xpath('.//nfe:infAdic', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:infAdic', namespaces=ns) else None
+        
+        # Dados de cobrança
+        cobr = inf_nfe.xpath('.//nfe:cobr', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:cobr', namespaces=ns) else None
+        
+        # Dados para o template
+        dados_nfe = {
+            # Dados da NFe
+            'numero': self._get_text(ide, 'nfe:nNF', ns),
+            'serie': self._get_text(ide, 'nfe:serie', ns),
+            'dhEmi': self._get_text(ide, 'nfe:dhEmi', ns),
+            'chave': inf_nfe.get('Id', '').replace('NFe', ''),
+            'natOp': self._get_text(ide, 'nfe:natOp', ns),
+            'tpNF': self._get_text(ide, 'nfe:tpNF', ns),
             
-            # Namespace da NFe
-            ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+            # Emitente
+            'emit_nome': self._get_text(emit, 'nfe:xNome', ns),
+            'emit_cnpj': self._get_text(emit, 'nfe:CNPJ', ns),
+            'emit_ie': self._get_text(emit, 'nfe:IE', ns),
+            'emit_iest': self._get_text(emit, 'nfe:IEST', ns),
+            'emit_endereco': self._get_endereco(emit, ns),
             
-            # Extrair dados principais da NFe
-            inf_nfe = root.xpath('.//nfe:infNFe', namespaces=ns)[0]
+            # Destinatário
+            'dest_nome': self._get_text(dest, 'nfe:xNome', ns) if dest is not None else '',
+            'dest_cnpj': self._get_text(dest, 'nfe:CNPJ', ns) if dest is not None else '',
+            'dest_cpf': self._get_text(dest, 'nfe:CPF', ns) if dest is not None else '',
+            'dest_ie': self._get_text(dest, 'nfe:IE', ns) if dest is not None else '',
+            'dest_endereco': self._get_endereco(dest, ns) if dest is not None else {},
             
-            # Dados do emitente
-            emit = inf_nfe.xpath('.//nfe:emit', namespaces=ns)[0]
+            # Produtos
+            'produtos': self._processar_produtos(produtos, ns),
             
-            # Dados do destinatário
-            dest = inf_nfe.xpath('.//nfe:dest', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:dest', namespaces=ns) else None
+            # Totais
+            'vBC': self._get_text(total, 'nfe:vBC', ns),
+            'vICMS': self._get_text(total, 'nfe:vICMS', ns),
+            'vBCST': self._get_text(total, 'nfe:vBCST', ns),
+            'vST': self._get_text(total, 'nfe:vST', ns),
+            'vProd': self._get_text(total, 'nfe:vProd', ns),
+            'vFrete': self._get_text(total, 'nfe:vFrete', ns),
+            'vSeg': self._get_text(total, 'nfe:vSeg', ns),
+            'vDesc': self._get_text(total, 'nfe:vDesc', ns),
+            'vOutro': self._get_text(total, 'nfe:vOutro', ns),
+            'vIPI': self._get_text(total, 'nfe:vIPI', ns),
+            'vNF': self._get_text(total, 'nfe:vNF', ns),
+            'vFCP': self._get_text(total, 'nfe:vFCP', ns),
+            'vTotTrib': self._get_text(total, 'nfe:vTotTrib', ns),
             
-            # Dados da NFe
-            ide = inf_nfe.xpath('.//nfe:ide', namespaces=ns)[0]
+            # Transporte
+            'transp_dados': self._extrair_transporte(transp, ns) if transp is not None else {},
             
-            # Dados dos produtos
-            produtos = inf_nfe.xpath('.//nfe:det', namespaces=ns)
+            # Informações adicionais
+            'inf_compl': self._get_text(inf_adic, 'nfe:infCpl', ns) if inf_adic is not None else '',
             
-            # Totais
-            total = inf_nfe.xpath('.//nfe:total/nfe:ICMSTot', namespaces=ns)[0]
+            # Duplicatas/Fatura
+            'duplicatas': self._extrair_duplicatas(cobr, ns) if cobr is not None else [],
             
-            # Dados de transporte
-            transp = inf_nfe.xpath('.//nfe:transp', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:transp', namespaces=ns) else None
+            # Protocolo (se existir)
+            'protocolo': self._extrair_protocolo(root, ns),
+        }
+        return dados_nfe
+    
+    # Tamanho dos PDFs: níveis de compressão e perfis PDF/A (opções de write_pdf do weasyprint).
+    # O zlib dos streams não tem nível configurável; "Máxima" recomprime as imagens (JPEG e resolução)
+    COMPRESSAO_NENHUMA = "Nenhuma"
+    COMPRESSAO_PADRAO = "Padrão"
+    COMPRESSAO_MAXIMA = "Máxima"
+    NIVEIS_COMPRESSAO = {
+        COMPRESSAO_NENHUMA: {'uncompressed_pdf': True},
+        COMPRESSAO_PADRAO: {},
+        COMPRESSAO_MAXIMA: {'optimize_images': True, 'jpeg_quality': 75, 'dpi': 150},
+    }
+    PERFIS_PDFA = {'PDF/A-1b': 'pdf/a-1b', 'PDF/A-2b': 'pdf/a-2b', 'PDF/A-3b': 'pdf/a-3b'}
+    
+    @staticmethod
+    def opcoes_pdf(compressao: str = COMPRESSAO_PADRAO, subconjunto_fontes: bool = True, pdfa: str = '') -> Dict[str, Any]:
+        """Opções de write_pdf para o tamanho da saída: só os glifos usados das fontes (subconjunto),
+        nível de compressão e, opcionalmente, um perfil PDF/A (nome de PERFIS_PDFA)"""
+        if compressao not in ProcessadorMassa.NIVEIS_COMPRESSAO:
+            raise ValueError(f"Compressão inválida: '{compressao}' (use {', '.join(ProcessadorMassa.NIVEIS_COMPRESSAO)})")
+        if pdfa and pdfa not in ProcessadorMassa.PERFIS_PDFA:
+            raise ValueError(f"Perfil PDF/A inválido: '{pdfa}' (use {', '.join(ProcessadorMassa.PERFIS_PDFA)})")
+        opcoes = dict(ProcessadorMassa.NIVEIS_COMPRESSAO[compressao], full_fonts=not subconjunto_fontes)
+        if pdfa:
+            opcoes['pdf_variant'] = ProcessadorMassa.PERFIS_PDFA[pdfa]
+        return opcoes
+    
+    def processar_xml_nfe(self, xml_path: str, template_content, output_dir: str, pdf_filename: str, gerar_pdf: bool = True,
+                          canceladas=None, opcoes_pdf: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Processar um único XML de NF-e e gerar PDF (gerar_pdf=False só extrai os dados). template_content
+        é o HTML, um TemplateCompilado ou um RegistroTemplates (que escolhe o template pelo cabeçalho da
+        nota); notas cuja chave está em canceladas recebem a tarja de cancelamento; opcoes_pdf vem de
+        ProcessadorMassa.opcoes_pdf"""
+        try:
+            dados_nfe = self.extrair_dados_nfe(xml_path)
+            dados_nfe['cancelada'] = bool(canceladas) and dados_nfe.get('chave', '') in canceladas
             
-            # Informações adicionais
-            inf_adic = inf_nfe.xpath('.//nfe:infAdic', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:infAdic', namespaces=ns) else None
-            
-            # Dados de cobrança
-            cobr = inf_nfe.xpath('.//nfe:cobr', namespaces=ns)[0] if inf_nfe.xpath('.//nfe:cobr', namespaces=ns) else None
-            
-            # Dados para o template
-            dados_nfe = {
-                # Dados da NFe
-                'numero': self._get_text(ide, 'nfe:nNF', ns),
-                'serie': self._get_text(ide, 'nfe:serie', ns),
-                'dhEmi': self._get_text(ide, 'nfe:dhEmi', ns),
-                'chave': inf_nfe.get('Id', '').replace('NFe', ''),
-                'natOp': self._get_text(ide, 'nfe:natOp', ns),
-                
-                # Emitente
-                'emit_nome': self._get_text(emit, 'nfe:xNome', ns),
-                'emit_cnpj': self._get_text(emit, 'nfe:CNPJ', ns),
-                'emit_ie': self._get_text(emit, 'nfe:IE', ns),
-                'emit_iest': self._get_text(emit, 'nfe:IEST', ns),
-                'emit_endereco': self._get_endereco(emit, ns),
-                
-                # Destinatário
-                'dest_nome': self._get_text(dest, 'nfe:xNome', ns) if dest is not None else '',
-                'dest_cnpj': self._get_text(dest, 'nfe:CNPJ', ns) if dest is not None else '',
-                'dest_cpf': self._get_text(dest, 'nfe:CPF', ns) if dest is not None else '',
-                'dest_ie': self._get_text(dest, 'nfe:IE', ns) if dest is not None else '',
-                'dest_endereco': self._get_endereco(dest, ns) if dest is not None else {},
-                
-                # Produtos
-                'produtos': self._processar_produtos(produtos, ns),
+            pdf_path = ''
+            tamanho_pdf = 0
+            if gerar_pdf:
+                template = RegistroTemplates.de(template_content).selecionar(dados_nfe)
                 
-                # Totais
-                'vBC': self._get_text(total, 'nfe:vBC', ns),
-                'vICMS': self._get_text(total, 'nfe:vICMS', ns),
-                'vBCST': self._get_text(total, 'nfe:vBCST', ns),
-                'vST': self._get_text(total, 'nfe:vST', ns),
-                'vProd': self._get_text(total, 'nfe:vProd', ns),
-                'vFrete': self._get_text(total, 'nfe:vFrete', ns),
-                'vSeg': self._get_text(total, 'nfe:vSeg', ns),
-                'vDesc': self._get_text(total, 'nfe:vDesc', ns),
-                'vOutro': self._get_text(total, 'nfe:vOutro', ns),
-                'vIPI': self._get_text(total, 'nfe:vIPI', ns),
-                'vNF': self._get_text(total, 'nfe:vNF', ns),
-                'vFCP': self._get_text(total, 'nfe:vFCP', ns),
-                'vTotTrib': self._get_text(total, 'nfe:vTotTrib', ns),
+                # Substituir variáveis no template
+                html_final = self._substituir_variaveis(template, dados_nfe)
                 
-                # Transporte
-                'transp_dados': self._extrair_transporte(transp, ns) if transp is not None else {},
-                
-                # Informações adicionais
-                'inf_compl': self._get_text(inf_adic, 'nfe:infCpl', ns) if inf_adic is not None else '',
-                
-                # Duplicatas/Fatura
-                'duplicatas': self._extrair_duplicatas(cobr, ns) if cobr is not None else [],
-                
-                # Protocolo (se existir)
-                'protocolo': self._extrair_protocolo(root, ns),
-            }
-            
-            # Substituir variáveis no template
-            html_final = self._substituir_variaveis(template_content, dados_nfe)
-            
-            # Gerar PDF
-            pdf_path = os.path.join(output_dir, pdf_filename)
-            html_doc = weasyprint.HTML(string=html_final)
-            html_doc.write_pdf(pdf_path)
+                # Gerar PDF
+                pdf_path = os.path.join(output_dir, pdf_filename)
+                template.gerar_pdf(html_final, pdf_path, opcoes_pdf)
+                tamanho_pdf = os.path.getsize(pdf_path)
             
             return {
                 'success': True,
                 'pdf_path': pdf_path,
+                'template': template.nome if gerar_pdf else '',
+                'tamanho_pdf': tamanho_pdf,
                 'dados': dados_nfe
             }
             
@@ -189,6 +390,408 @@ class ProcessadorMassa:
                 'error': str(e)
             }
     
+    # Classificação pelo elemento raiz antes de qualquer trabalho caro
+    NAMESPACE_NFE = 'http://www.portalfiscal.inf.br/nfe'
+    NAMESPACE_CTE = 'http://www.portalfiscal.inf.br/cte'
+    TIPO_NFE = "NF-e"
+    TIPO_NFCE = "NFC-e"
+    TIPO_EVENTO = "Evento NF-e"
+    TIPO_CTE = "CT-e"
+    TIPO_OUTRO = "Outro XML"
+    TIPO_INVALIDO = "XML inválido"
+    TIPOS_CONVERSIVEIS = (TIPO_NFE, TIPO_NFCE)
+    RAIZES_NFE = ('nfeProc', 'NFe')
+    RAIZES_EVENTO = ('procEventoNFe', 'evento', 'envEvento')
+    TAMANHO_LEITURA_CLASSIFICACAO = 4096
+    MAX_TRABALHADORES_CLASSIFICACAO = 8
+    
+    @staticmethod
+    def classificar_documento(xml_path: str) -> str:
+        """Tipo do documento lendo só o início do arquivo: o elemento raiz e seu namespace e, em
+        NFe/nfeProc, o Id do infNFe, cujo modelo (55/65) separa NF-e de NFC-e"""
+        parser = etree.XMLPullParser(events=("start",))
+        raiz = None
+        try:
+            with open(xml_path, 'rb') as f:
+                while True:
+                    bloco = f.read(ProcessadorMassa.TAMANHO_LEITURA_CLASSIFICACAO)
+                    if not bloco:
+                        break
+                    parser.feed(bloco)
+                    for _, elemento in parser.read_events():
+                        namespace, _, nome = elemento.tag.rpartition('}')
+                        if raiz is None:
+                            raiz = nome
+                            namespace = namespace.lstrip('{')
+                            if namespace == ProcessadorMassa.NAMESPACE_CTE:
+                                return ProcessadorMassa.TIPO_CTE
+                            if namespace != ProcessadorMassa.NAMESPACE_NFE:
+                                return ProcessadorMassa.TIPO_OUTRO
+                            if nome in ProcessadorMassa.RAIZES_EVENTO:
+                                return ProcessadorMassa.TIPO_EVENTO
+                            if nome not in ProcessadorMassa.RAIZES_NFE:
+                                return ProcessadorMassa.TIPO_OUTRO
+                        elif nome == 'infNFe':
+                            chave = (elemento.get('Id') or '').replace('NFe', '')
+                            return ProcessadorMassa.TIPO_NFCE if chave[20:22] == '65' else ProcessadorMassa.TIPO_NFE
+        except (etree.XMLSyntaxError, OSError):
+            return ProcessadorMassa.TIPO_INVALIDO
+        return ProcessadorMassa.TIPO_INVALIDO if raiz is None else ProcessadorMassa.TIPO_OUTRO
+    
+    @staticmethod
+    def classificar_documentos(xmls: List[str], max_trabalhadores: int = None,
+                               cancelamentos: "IndiceCancelamentos" = None) -> List[str]:
+        """Tipo de cada XML, na mesma ordem (leituras curtas em paralelo; úteis em pastas de rede).
+        Com cancelamentos, os eventos são lidos na mesma passada e os cancelamentos vão para o índice"""
+        def classificar(xml_path):
+            tipo = ProcessadorMassa.classificar_documento(xml_path)
+            if cancelamentos is not None and tipo == ProcessadorMassa.TIPO_EVENTO:
+                return tipo, IndiceCancelamentos.chave_cancelada(xml_path)
+            return tipo, ''
+        
+        with ThreadPoolExecutor(max_workers=max_trabalhadores or ProcessadorMassa.MAX_TRABALHADORES_CLASSIFICACAO) as pool:
+            resultados = list(pool.map(classificar, xmls))
+        if cancelamentos is not None:
+            for xml_path, (_, chave) in zip(xmls, resultados):
+                if chave:
+                    cancelamentos.adicionar(chave, xml_path)
+        return [tipo for tipo, _ in resultados]
+    
+    # Leitura rápida de cabeçalho (ide, emit, dest e ICMSTot) sem montar a árvore completa
+    TAGS_CABECALHO = ('{*}ide', '{*}emit', '{*}dest', '{*}det', '{*}ICMSTot')
+    TAMANHO_LEITURA = 16384
+    TAMANHO_LOTE_CABECALHOS = 256
+    
+    @staticmethod
+    def cabecalho_de_dados(dados_nfe: Dict[str, Any], xml_path: str) -> Dict[str, Any]:
+        """Cabeçalho no formato de ler_cabecalho a partir dos dados completos da conversão"""
+        chave = dados_nfe.get('chave', '')
+        cabecalho = {
+            'arquivo': xml_path,
+            'chave': chave,
+            'nNF': dados_nfe.get('numero', ''),
+            'serie': dados_nfe.get('serie', ''),
+            'mod': chave[20:22] if len(chave) == 44 else '',
+            'dhEmi': dados_nfe.get('dhEmi', ''),
+            'tpNF': dados_nfe.get('tpNF', ''),
+            'natOp': dados_nfe.get('natOp', ''),
+            'emit_CNPJ': dados_nfe.get('emit_cnpj', ''),
+            'emit_xNome': dados_nfe.get('emit_nome', ''),
+            'emit_UF': (dados_nfe.get('emit_endereco') or {}).get('uf', ''),
+            'dest_CNPJ': dados_nfe.get('dest_cnpj') or dados_nfe.get('dest_cpf', ''),
+            'dest_xNome': dados_nfe.get('dest_nome', ''),
+            'dest_UF': (dados_nfe.get('dest_endereco') or {}).get('uf', ''),
+            'itens': len(dados_nfe.get('produtos') or []),
+        }
+        for campo in CatalogoNFe.COLUNAS_VALOR:
+            cabecalho[campo] = dados_nfe.get(campo, '')
+        return cabecalho
+    
+    def adicionar_ao_relatorio(self, xml_path: str, chave: str = '', numero: str = '', sucesso: bool = False, erro: str = '',
+                               tipo: str = '', situacao: str = None, cancelada: bool = False, tamanho_pdf: int = 0):
+        """Incluir a linha do XML no relatório Excel (tuplas ocupam bem menos memória que dicionários
+        em lotes de centenas de milhares de arquivos)"""
+        self.dados_relatorio.append((
+            chave,
+            numero,
+            situacao or ('Sim' if sucesso else 'Não'),
+            os.path.basename(xml_path),
+            datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+            os.path.dirname(xml_path),
+            round(os.path.getsize(xml_path) / 1024, 2) if os.path.exists(xml_path) else 0,
+            erro,
+            tipo,
+            'Sim' if cancelada else '',
+            round(tamanho_pdf / 1024, 2),
+        ))
+    
+    @staticmethod
+    def estatisticas_relatorio(df: pd.DataFrame, inicio: float, fim: float, excecoes: int = None,
+                               tempo_esgotado: int = 0, memoria_excedida: int = 0) -> pd.DataFrame:
+        """Aba de estatísticas a partir das linhas do relatório e dos instantes de início e fim"""
+        sucessos = len(df[df['Sucesso de Conversão'] == 'Sim'])
+        erros = len(df[df['Sucesso de Conversão'] == 'Não'])
+        ignorados = len(df[df['Sucesso de Conversão'] == ProcessadorMassa.SITUACAO_IGNORADO])
+        canceladas = int((df['Cancelada'] == 'Sim').sum())
+        total = len(df)
+        conversiveis = total - ignorados
+        tamanho_total = df['Tamanho Arquivo (KB)'].sum()
+        tamanhos_pdf = pd.to_numeric(df['Tamanho PDF (KB)'], errors='coerce').fillna(0)
+        pdfs = int((tamanhos_pdf > 0).sum())
+        tempo_processamento = fim - inicio
+        
+        stats_data = {
+            'Estatística': [
+                'Total de Arquivos',
+                'Conversões Bem-sucedidas',
+                'Conversões com Erro',
+                'Ignorados (não NF-e/NFC-e)',
+                'Notas Canceladas (com tarja)',
+                'Taxa de Sucesso (%)',
+                'Tamanho Total Processado (MB)',
+                'PDFs Gerados',
+                'Tamanho Total dos PDFs (MB)',
+                'Tamanho Médio do PDF (KB/nota)',
+                'Maior PDF (KB)',
+                'Tempo Total de Processamento (min)',
+                'Velocidade Média (arquivos/min)',
+                'Exceções Fiscais (auditoria)',
+                'Tempo Limite Excedido',
+                'Limite de Memória Excedido',
+                'Data/Hora Início',
+                'Data/Hora Fim'
+            ],
+            'Valor': [
+                total,
+                sucessos,
+                erros,
+                ignorados,
+                canceladas,
+                round((sucessos/conversiveis)*100, 2) if conversiveis > 0 else 0,
+                round(tamanho_total / 1024, 2),
+                pdfs,
+                round(tamanhos_pdf.sum() / 1024, 2),
+                round(tamanhos_pdf.sum() / pdfs, 2) if pdfs else 0,
+                round(tamanhos_pdf.max(), 2) if pdfs else 0,
+                round(tempo_processamento / 60, 2),
+                round((total / tempo_processamento) * 60, 2) if tempo_processamento > 0 else 0,
+                excecoes if excecoes is not None else '-',
+                tempo_esgotado,
+                memoria_excedida,
+                datetime.fromtimestamp(inicio).strftime('%d/%m/%Y %H:%M:%S'),
+                datetime.fromtimestamp(fim).strftime('%d/%m/%Y %H:%M:%S')
+            ]
+        }
+        return pd.DataFrame(stats_data)
+    
+    @staticmethod
+    def salvar_relatorio_excel(excel_path: str, df: pd.DataFrame, stats_df: pd.DataFrame,
+                               excecoes_df: pd.DataFrame = None, numeracao_df: pd.DataFrame = None):
+        """Salvar o relatório de conversão em Excel com formatação avançada"""
+        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
+            # Aba principal com dados
+            df.to_excel(writer, sheet_name='Relatório Conversão', index=False)
+            
+            # Aba de estatísticas
+            stats_df.to_excel(writer, sheet_name='Estatísticas', index=False)
+            
+            # Aba de exceções da auditoria fiscal
+            if excecoes_df is not None:
+                excecoes_df.to_excel(writer, sheet_name='Exceções Fiscais', index=False)
+            
+            # Aba de lacunas e duplicidades de numeração
+            if numeracao_df is not None:
+                numeracao_df.to_excel(writer, sheet_name='Numeração', index=False)
+            
+            # Formatação da aba principal
+            from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+            from openpyxl.utils.dataframe import dataframe_to_rows
+            
+            worksheet = writer.sheets['Relatório Conversão']
+            
+            # Formatação do cabeçalho
+            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+            header_font = Font(color="FFFFFF", bold=True)
+            
+            for cell in worksheet[1]:
+                cell.fill = header_fill
+                cell.font = header_font
+                cell.alignment = Alignment(horizontal="center", vertical="center")
+            
+            # Formatação condicional por status
+            success_fill = PatternFill(start_color="D4EDDA", end_color="D4EDDA", fill_type="solid")
+            error_fill = PatternFill(start_color="F8D7DA", end_color="F8D7DA", fill_type="solid")
+            ignored_fill = PatternFill(start_color="E2E3E5", end_color="E2E3E5", fill_type="solid")
+            
+            # Aplicar cores baseadas no status de conversão
+            for row in range(2, len(df) + 2):
+                status_cell = worksheet[f'C{row}']  # Coluna 'Sucesso de Conversão'
+                if status_cell.value == 'Sim':
+                    for col in range(1, len(df.columns) + 1):
+                        worksheet.cell(row=row, column=col).fill = success_fill
+                elif status_cell.value == 'Não':
+                    for col in range(1, len(df.columns) + 1):
+                        worksheet.cell(row=row, column=col).fill = error_fill
+                elif status_cell.value == ProcessadorMassa.SITUACAO_IGNORADO:
+                    for col in range(1, len(df.columns) + 1):
+                        worksheet.cell(row=row, column=col).fill = ignored_fill
+            
+            # Ajustar largura das colunas
+            for column in worksheet.columns:
+                max_length = 0
+                column_letter = column[0].column_letter
+                for cell in column:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(str(cell.value))
+                    except:
+                        pass
+                adjusted_width = min(max_length + 2, 60)
+                worksheet.column_dimensions[column_letter].width = adjusted_width
+            
+            # Formatação da aba de estatísticas
+            stats_ws = writer.sheets['Estatísticas']
+            
+            # Cabeçalho das estatísticas
+            for cell in stats_ws[1]:
+                cell.fill = PatternFill(start_color="FF9800", end_color="FF9800", fill_type="solid")
+                cell.font = Font(color="FFFFFF", bold=True)
+                cell.alignment = Alignment(horizontal="center", vertical="center")
+            
+            # Ajustar largura das colunas de estatísticas
+            stats_ws.column_dimensions['A'].width = 35
+            stats_ws.column_dimensions['B'].width = 25
+            
+            # Adicionar bordas
+            thin_border = Border(
+                left=Side(style='thin'),
+                right=Side(style='thin'),
+                top=Side(style='thin'),
+                bottom=Side(style='thin')
+            )
+            
+            for row in stats_ws.iter_rows():
+                for cell in row:
+                    cell.border = thin_border
+                    cell.alignment = Alignment(horizontal="center", vertical="center")
+            
+            # Formatação da aba de exceções fiscais
+            if excecoes_df is not None:
+                excecoes_ws = writer.sheets['Exceções Fiscais']
+                for cell in excecoes_ws[1]:
+                    cell.fill = PatternFill(start_color="C0392B", end_color="C0392B", fill_type="solid")
+                    cell.font = Font(color="FFFFFF", bold=True)
+                    cell.alignment = Alignment(horizontal="center", vertical="center")
+                for letra, largura in zip("ABCDEFGH", (48, 12, 30, 8, 32, 14, 14, 14)):
+                    excecoes_ws.column_dimensions[letra].width = largura
+            
+            if numeracao_df is not None:
+                ProcessadorMassa._formatar_aba_numeracao(writer.sheets['Numeração'])
+    
+    @staticmethod
+    def _formatar_aba_numeracao(worksheet):
+        """Cabeçalho e larguras da aba de numeração"""
+        from openpyxl.styles import PatternFill, Font, Alignment
+        for cell in worksheet[1]:
+            cell.fill = PatternFill(start_color="6C3483", end_color="6C3483", fill_type="solid")
+            cell.font = Font(color="FFFFFF", bold=True)
+            cell.alignment = Alignment(horizontal="center", vertical="center")
+        for letra, largura in zip("ABCDEFG", (20, 10, 8, 14, 16, 16, 12)):
+            worksheet.column_dimensions[letra].width = largura
+    
+    def registrar_no_catalogo(self, xml_path: str, resposta: Dict[str, Any], cabecalho: Dict[str, Any] = None):
+        """Incluir a nota no catálogo (se aberto) com o resultado da conversão; usa o cabeçalho já
+        montado ou lido, se houver"""
+        if self.catalogo is None:
+            return
+        if resposta.get('success', False):
+            cabecalho = cabecalho or self.cabecalho_de_dados(resposta.get('dados', {}), xml_path)
+            self.catalogo.registrar(cabecalho, status='Convertido', pdf=resposta.get('pdf_path', ''))
+        elif cabecalho:
+            self.catalogo.registrar(cabecalho, status='Erro')
+    
+    def fechar_catalogo(self):
+        """Gravar o último lote e fechar o catálogo"""
+        if self.catalogo is not None:
+            catalogo, self.catalogo = self.catalogo, None
+            catalogo.fechar()
+    
+    @staticmethod
+    def _filhos(elemento) -> Dict[str, str]:
+        """Texto dos filhos diretos de um elemento, pelo nome local"""
+        return {
+            filho.tag.rpartition('}')[2]: (filho.text or '').strip()
+            for filho in elemento if isinstance(filho.tag, str)
+        }
+    
+    @staticmethod
+    def ler_cabecalho(xml_path: str) -> Dict[str, Any]:
+        """Ler só o cabeçalho de uma NF-e: chave, número, série, emissão, emitente, destinatário
+        e totais (ICMSTot). O XML é lido em blocos pelo parser incremental do lxml (a mesma
+        base do etree.iterparse) e a leitura para assim que ICMSTot termina"""
+        cabecalho: Dict[str, Any] = {'arquivo': xml_path, 'itens': 0}
+        parser = etree.XMLPullParser(events=("end",), tag=ProcessadorMassa.TAGS_CABECALHO, huge_tree=True)
+        
+        with open(xml_path, 'rb') as f:
+            concluido = False
+            while not concluido:
+                bloco = f.read(ProcessadorMassa.TAMANHO_LEITURA)
+                if not bloco:
+                    break
+                parser.feed(bloco)
+                for _, elemento in parser.read_events():
+                    nome = elemento.tag.rpartition('}')[2]
+                    
+                    if nome == 'det':
+                        # Itens só são contados; liberar a memória mantém notas enormes baratas
+                        cabecalho['itens'] += 1
+                        elemento.clear()
+                        continue
+                    
+                    campos = ProcessadorMassa._filhos(elemento)
+                    if nome == 'ide':
+                        inf_nfe = elemento.getparent()
+                        cabecalho['chave'] = (inf_nfe.get('Id') or '').replace('NFe', '') if inf_nfe is not None else ''
+                        cabecalho['nNF'] = campos.get('nNF', '')
+                        cabecalho['serie'] = campos.get('serie', '')
+                        cabecalho['mod'] = campos.get('mod', '')
+                        cabecalho['tpNF'] = campos.get('tpNF', '')
+                        cabecalho['natOp'] = campos.get('natOp', '')
+                        cabecalho['dhEmi'] = campos.get('dhEmi') or campos.get('dEmi', '')
+                    elif nome in ('emit', 'dest'):
+                        endereco = elemento.find('{*}enderEmit' if nome == 'emit' else '{*}enderDest')
+                        cabecalho[f'{nome}_CNPJ'] = campos.get('CNPJ') or campos.get('CPF', '')
+                        cabecalho[f'{nome}_xNome'] = campos.get('xNome', '')
+                        cabecalho[f'{nome}_UF'] = endereco.findtext('{*}UF', '') if endereco is not None else ''
+                    elif nome == 'ICMSTot':
+                        cabecalho.update(campos)
+                        concluido = True
+                        break
+        
+        if 'chave' not in cabecalho:
+            raise ValueError("XML não contém uma NF-e (ide não encontrado)")
+        return cabecalho
+    
+    @staticmethod
+    def _ler_cabecalhos_lote(xmls: List[str]) -> List[Dict[str, Any]]:
+        """Ler um lote de cabeçalhos (executado nos processos de trabalho)"""
+        resultados = []
+        for xml_path in xmls:
+            try:
+                resultados.append(ProcessadorMassa.ler_cabecalho(xml_path))
+            except Exception as e:
+                resultados.append({'arquivo': xml_path, 'erro': str(e)})
+        return resultados
+    
+    def ler_cabecalhos(self, xmls: List[str], max_processos: int = None, progresso=None):
+        """Ler os cabeçalhos de muitos XMLs em um pool de processos, em lotes para diluir o
+        custo de comunicação. Gera um dicionário por arquivo, na ordem da lista"""
+        lotes = [xmls[i:i + self.TAMANHO_LOTE_CABECALHOS] for i in range(0, len(xmls), self.TAMANHO_LOTE_CABECALHOS)]
+        max_processos = max_processos or os.cpu_count() or 1
+        lidos = 0
+        
+        if max_processos == 1 or len(lotes) <= 1:
+            resultados_lotes = map(self._ler_cabecalhos_lote, lotes)
+            for resultados in resultados_lotes:
+                lidos += len(resultados)
+                if progresso:
+                    progresso(lidos, len(xmls))
+                yield from resultados
+            return
+        
+        with ProcessPoolExecutor(max_workers=max_processos) as pool:
+            futuros = [pool.submit(self._ler_cabecalhos_lote, lote) for lote in lotes]
+            for futuro in futuros:
+                if self.parar_solicitado:
+                    for pendente in futuros:
+                        pendente.cancel()
+                    return
+                resultados = futuro.result()
+                lidos += len(resultados)
+                if progresso:
+                    progresso(lidos, len(xmls))
+                yield from resultados
+    
     def _get_text(self, element, xpath: str, ns: dict) -> str:
         """Extrair texto de um elemento XML"""
         if element is None:
@@ -244,7 +847,9 @@ class ProcessadorMassa:
                             icms_data = {
                                 'vbc': self._get_text(icms_parent, 'nfe:vBC', ns),
                                 'picms': self._get_text(icms_parent, 'nfe:pICMS', ns),
-                                'vicms': self._get_text(icms_parent, 'nfe:vICMS', ns)
+                                'vicms': self._get_text(icms_parent, 'nfe:vICMS', ns),
+                                # ICMS51 com diferimento: vICMS é só a parte não diferida de vICMSOp
+                                'vicmsop': self._get_text(icms_parent, 'nfe:vICMSOp', ns)
                             }
                 
                 # IPI
@@ -266,6 +871,7 @@ class ProcessadorMassa:
                 'quantidade': self._get_text(prod, 'nfe:qCom', ns),
                 'valor_unitario': self._get_text(prod, 'nfe:vUnCom', ns),
                 'valor_total': self._get_text(prod, 'nfe:vProd', ns),
+                'ind_tot': self._get_text(prod, 'nfe:indTot', ns),
                 'icms': icms_data,
                 'ipi': ipi_data
             }
@@ -274,9 +880,11 @@ class ProcessadorMassa:
         
         return lista_produtos
     
-    def _substituir_variaveis(self, template: str, dados: Dict) -> str:
-        """Substituir variáveis no template HTML"""
-        html = template
+    CLASSE_PAGINA = 'class="page nfeArea"'
+    CLASSE_PAGINA_CANCELADA = 'class="page nfeArea invoiceCanceled"'
+    
+    def _substituir_variaveis(self, template, dados: Dict) -> str:
+        """Substituir variáveis no template HTML (texto ou TemplateCompilado) numa única passada"""
         
         # Formatar datas
         dhEmi = dados.get('dhEmi', '')
@@ -322,7 +930,7 @@ class ProcessadorMassa:
             '[dt_invoice_issue]': data_emissao,
             '[dt_input_output]': data_emissao,
             '[hr_input_output]': hora_emissao,
-            '[ds_code_operation_type]': '1',  # Default saída
+            '[ds_code_operation_type]': dados.get('tpNF') or '1',  # Default saída
             '[actual_page]': '1',
             '[total_pages]': '1',
             
@@ -388,9 +996,6 @@ class ProcessadorMassa:
             '{ApproximateTax}': self._formatar_valor(dados.get('vTotTrib', '')),
         }
         
-        for variavel, valor in substituicoes.items():
-            html = html.replace(variavel, str(valor))
-        
         # === PROCESSAR DUPLICATAS ===
         duplicatas_html = ''
         duplicatas = dados.get('duplicatas', [])
@@ -402,7 +1007,7 @@ class ProcessadorMassa:
                 valor = self._formatar_valor(dup.get('valor', ''))
                 duplicatas_html += f'<tr><td>{dup.get("numero", "")}</td><td>{venc}</td><td>{valor}</td></tr>'
             duplicatas_html += '</table>'
-        html = html.replace('[duplicates]', duplicatas_html)
+        substituicoes['[duplicates]'] = duplicatas_html
         
         # === PROCESSAR PRODUTOS ===
         produtos_html = ''
@@ -428,9 +1033,13 @@ class ProcessadorMassa:
                 <td style="text-align: right; padding: 2px;">{self._formatar_porcentagem(ipi.get('pipi', ''))}</td>
             </tr>
             '''
-        html = html.replace('[items]', produtos_html)
+        substituicoes['[items]'] = produtos_html
+        
+        # Tarja de cancelamento (imgCanceled) pela classe da página
+        if dados.get('cancelada'):
+            substituicoes[self.CLASSE_PAGINA] = self.CLASSE_PAGINA_CANCELADA
         
-        return html
+        return TemplateCompilado.de(template).renderizar(substituicoes)
     
     def _extrair_protocolo(self, root, ns: dict) -> str:
         """Extrair protocolo de autorização"""
@@ -514,72 +1123,2459 @@ class ProcessadorMassa:
         except:
             return []
     
-    def _formatar_cnpj_cpf(self, numero: str) -> str:
-        """Formatar CNPJ ou CPF"""
-        if not numero:
-            return ''
-        numero = ''.join(filter(str.isdigit, numero))
-        if len(numero) == 14:  # CNPJ
-            return f"{numero[:2]}.{numero[2:5]}.{numero[5:8]}/{numero[8:12]}-{numero[12:]}"
-        elif len(numero) == 11:  # CPF
-            return f"{numero[:3]}.{numero[3:6]}.{numero[6:9]}-{numero[9:]}"
-        return numero
+    def _formatar_cnpj_cpf(self, numero: str) -> str:
+        """Formatar CNPJ ou CPF"""
+        if not numero:
+            return ''
+        numero = ''.join(filter(str.isdigit, numero))
+        if len(numero) == 14:  # CNPJ
+            return f"{numero[:2]}.{numero[2:5]}.{numero[5:8]}/{numero[8:12]}-{numero[12:]}"
+        elif len(numero) == 11:  # CPF
+            return f"{numero[:3]}.{numero[3:6]}.{numero[6:9]}-{numero[9:]}"
+        return numero
+    
+    def _formatar_cep(self, cep: str) -> str:
+        """Formatar CEP"""
+        if not cep:
+            return ''
+        cep = ''.join(filter(str.isdigit, cep))
+        if len(cep) == 8:
+            return f"{cep[:5]}-{cep[5:]}"
+        return cep
+    
+    def _formatar_valor(self, valor: str) -> str:
+        """Formatar valor monetário"""
+        if not valor:
+            return '0,00'
+        try:
+            num = float(valor.replace(',', '.'))
+            return f"{num:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+        except:
+            return valor
+    
+    def _formatar_quantidade(self, qtd: str) -> str:
+        """Formatar quantidade"""
+        if not qtd:
+            return '0,0000'
+        try:
+            num = float(qtd.replace(',', '.'))
+            return f"{num:,.4f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+        except:
+            return qtd
+    
+    def _formatar_porcentagem(self, perc: str) -> str:
+        """Formatar porcentagem"""
+        if not perc:
+            return '0,00'
+        try:
+            num = float(perc.replace(',', '.'))
+            return f"{num:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+        except:
+            return perc
+    
+    def _formatar_data(self, data: str) -> str:
+        """Formatar data"""
+        if not data:
+            return ''
+        try:
+            # Se vier no formato AAAA-MM-DD
+            if len(data) >= 10 and '-' in data:
+                partes = data[:10].split('-')
+                return f"{partes[2]}/{partes[1]}/{partes[0]}"
+            return data
+        except:
+            return data
+
+class TemplateCompilado:
+    """Template HTML do DANFE pré-processado uma única vez.
+    
+    O HTML é dividido em trechos fixos e marcadores ([campo], {ApproximateTax} e a classe da página),
+    então cada nota é montada com um join em vez de uma passada de replace por variável; o CSS dos
+    blocos <style> vira uma folha de estilo que cada processo interpreta uma vez e reaproveita; as
+    imagens referenciadas são resolvidas a partir da pasta do template (base_url) e, em cada
+    processo, lidas uma única vez e compartilhadas por todos os PDFs. O objeto é enviado pronto aos
+    processos de conversão, sem que eles releiam o arquivo"""
+    
+    PADRAO_MARCADOR = re.compile(r'(\[[A-Za-z_]+\]|\{ApproximateTax\}|' + re.escape(ProcessadorMassa.CLASSE_PAGINA) + ')')
+    PADRAO_ESTILO = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+    PADRAO_RECURSO = re.compile(r'\b(?:src|href)=["\']([^"\'#:]+)["\']', re.I)
+    
+    def __init__(self, conteudo: str, caminho: str = '', mtime: float = 0.0, tamanho: int = 0, hash_conteudo: str = ''):
+        self.caminho = caminho
+        self.mtime = mtime
+        self.tamanho = tamanho
+        self.hash = hash_conteudo or hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+        self.base_url = os.path.dirname(os.path.abspath(caminho)) if caminho else None
+        
+        self.css = '\n'.join(self.PADRAO_ESTILO.findall(conteudo))
+        pedacos = self.PADRAO_MARCADOR.split(self.PADRAO_ESTILO.sub('', conteudo))
+        self.trechos = pedacos[0::2]
+        self.marcadores = pedacos[1::2]
+        
+        self.recursos = sorted(set(self.PADRAO_RECURSO.findall(conteudo)))
+        self.recursos_ausentes = [
+            recurso for recurso in self.recursos
+            if self.base_url and not os.path.exists(os.path.join(self.base_url, recurso))
+        ]
+        self._folha_estilo = None
+        self._imagens = {}
+    
+    def __getstate__(self):
+        # A folha de estilo e as imagens do weasyprint são refeitas em cada processo, na primeira nota
+        estado = self.__dict__.copy()
+        estado['_folha_estilo'] = None
+        estado['_imagens'] = {}
+        return estado
+    
+    @property
+    def nome(self) -> str:
+        return os.path.basename(self.caminho) if self.caminho else 'template'
+    
+    @classmethod
+    def de(cls, template) -> "TemplateCompilado":
+        """O próprio objeto, se já compilado; senão compila o texto recebido"""
+        return template if isinstance(template, cls) else cls(template)
+    
+    def renderizar(self, valores: Dict[str, Any]) -> str:
+        """HTML da nota: marcadores sem valor ficam como estão no template"""
+        partes = [self.trechos[0]]
+        for marcador, trecho in zip(self.marcadores, self.trechos[1:]):
+            partes.append(str(valores.get(marcador, marcador)))
+            partes.append(trecho)
+        return ''.join(partes)
+    
+    def folha_estilo(self):
+        if self._folha_estilo is None and self.css:
+            self._folha_estilo = weasyprint.CSS(string=self.css, base_url=self.base_url)
+        return self._folha_estilo
+    
+    def gerar_pdf(self, html: str, destino: str = None, opcoes: Dict[str, Any] = None):
+        """PDF do HTML renderizado (bytes, se destino for None); opcoes de ProcessadorMassa.opcoes_pdf"""
+        folha = self.folha_estilo()
+        return weasyprint.HTML(string=html, base_url=self.base_url).write_pdf(
+            destino, stylesheets=[folha] if folha is not None else None, cache=self._imagens, **(opcoes or {})
+        )
+
+class CacheTemplates:
+    """Templates compilados por caminho, invalidados pelo arquivo.
+    
+    Cada consulta faz só um stat: com mtime e tamanho iguais o template em cache é devolvido; se
+    mudaram, o arquivo é relido e só é recompilado se o hash do conteúdo também mudou (salvar sem
+    alterar, cópias e sincronizações não custam uma recompilação)"""
+    
+    def __init__(self):
+        self._templates: Dict[str, TemplateCompilado] = {}
+        self._trava = threading.Lock()
+        self.compilacoes = 0
+    
+    def obter(self, caminho: str) -> TemplateCompilado:
+        caminho = os.path.abspath(caminho)
+        info = os.stat(caminho)
+        with self._trava:
+            atual = self._templates.get(caminho)
+            if atual is not None and atual.mtime == info.st_mtime and atual.tamanho == info.st_size:
+                return atual
+            with open(caminho, 'rb') as f:
+                conteudo = f.read()
+            hash_conteudo = hashlib.sha256(conteudo).hexdigest()
+            if atual is not None and atual.hash == hash_conteudo:
+                atual.mtime, atual.tamanho = info.st_mtime, info.st_size
+                return atual
+            template = TemplateCompilado(conteudo.decode('utf-8'), caminho, info.st_mtime, info.st_size, hash_conteudo)
+            self._templates[caminho] = template
+            self.compilacoes += 1
+            return template
+
+class RegistroTemplates:
+    """Templates compilados e regras de escolha por nota (modelo, emitente, tipo de operação...).
+    
+    As regras são avaliadas na ordem, contra o cabeçalho extraído da nota (campos de
+    ProcessadorMassa.cabecalho_de_dados), e a primeira que casar define o template; sem regra
+    aplicável vale o padrão. Cada arquivo é compilado uma vez (pelo CacheTemplates) e o registro
+    inteiro segue para os processos de conversão, então lotes mistos custam o mesmo que lotes com
+    um único template. Arquivo de regras (JSON, caminhos relativos a ele):
+    
+        {"padrao": "nfe_vertical.html",
+         "regras": [{"template": "danfe_nfce.html", "quando": {"mod": "65"}},
+                    {"template": "danfe_paisagem.html", "quando": {"emit_CNPJ": ["12345678000195"]}},
+                    {"template": "copia_interna.html", "quando": {"tpNF": "0", "dest_UF": ["SP", "RJ"]}}]}
+    """
+    
+    CAMPOS_REGRA = ('mod', 'serie', 'tpNF', 'natOp', 'emit_CNPJ', 'emit_UF', 'dest_CNPJ', 'dest_UF')
+    
+    def __init__(self, padrao: TemplateCompilado, regras: List[tuple] = None):
+        self.padrao = padrao
+        # (condições {campo: frozenset de valores}, template)
+        self.regras = list(regras or [])
+    
+    @classmethod
+    def de(cls, template) -> "RegistroTemplates":
+        """O próprio registro, se já for um; senão um registro só com o template recebido"""
+        return template if isinstance(template, cls) else cls(TemplateCompilado.de(template))
+    
+    @property
+    def templates(self) -> List[TemplateCompilado]:
+        """Templates distintos do registro (o padrão primeiro)"""
+        distintos = {id(self.padrao): self.padrao}
+        for _, template in self.regras:
+            distintos.setdefault(id(template), template)
+        return list(distintos.values())
+    
+    @classmethod
+    def carregar(cls, caminho: str, cache: CacheTemplates = None) -> "RegistroTemplates":
+        """Registro a partir de um template HTML (sem regras) ou de um arquivo de regras .json"""
+        cache = cache or CacheTemplates()
+        if not caminho.lower().endswith('.json'):
+            return cls(cache.obter(caminho))
+        
+        with open(caminho, 'r', encoding='utf-8') as f:
+            configuracao = json.load(f)
+        pasta = os.path.dirname(os.path.abspath(caminho))
+        if not configuracao.get('padrao'):
+            raise ValueError(f"{os.path.basename(caminho)}: informe o template 'padrao'")
+        registro = cls(cache.obter(os.path.join(pasta, configuracao['padrao'])))
+        for numero, regra in enumerate(configuracao.get('regras', []), 1):
+            condicoes = regra.get('quando') or {}
+            desconhecidos = sorted(set(condicoes) - set(cls.CAMPOS_REGRA))
+            if desconhecidos or not regra.get('template'):
+                raise ValueError(
+                    f"{os.path.basename(caminho)}, regra {numero}: informe 'template' e condições em "
+                    f"{', '.join(cls.CAMPOS_REGRA)} (recebido: {', '.join(desconhecidos) or 'sem template'})"
+                )
+            registro.adicionar_regra(cache.obter(os.path.join(pasta, regra['template'])), **condicoes)
+        return registro
+    
+    def adicionar_regra(self, template: TemplateCompilado, **condicoes):
+        """Usar template nas notas em que cada campo tem um dos valores (texto ou lista de textos)"""
+        self.regras.append((
+            {
+                campo: frozenset([valores] if isinstance(valores, str) else (str(valor) for valor in valores))
+                for campo, valores in condicoes.items()
+            },
+            template,
+        ))
+    
+    def selecionar(self, dados_nfe: Dict[str, Any]) -> TemplateCompilado:
+        """Template da nota: a primeira regra cujas condições casam com o cabeçalho, ou o padrão"""
+        if not self.regras:
+            return self.padrao
+        cabecalho = ProcessadorMassa.cabecalho_de_dados(dados_nfe, '')
+        for condicoes, template in self.regras:
+            if all(str(cabecalho.get(campo, '')) in valores for campo, valores in condicoes.items()):
+                return template
+        return self.padrao
+
+class PoolRenderizacao:
+    """Processos de conversão (leitura do XML + PDF) recicláveis.
+    
+    Cada processo é substituído depois de documentos_por_processo documentos ou quando sua memória
+    residente passa de limite_memoria_mb, descartando os caches do weasyprint/cairo e do lxml.
+    As tarefas são enviadas uma a uma aos processos ociosos, então a troca acontece entre dois
+    documentos e o restante do lote segue para o processo novo sem perda.
+    
+    Cada documento também tem um orçamento: se passar de tempo_limite segundos o processo é
+    encerrado pelo pool, e se a memória passar de limite_documento_mb (por padrão o dobro de
+    limite_memoria_mb) o próprio processo se encerra; em ambos os casos o XML é registrado com
+    erro e o lote continua em um processo novo.
+    
+    canceladas (chaves com evento de cancelamento) é enviado uma vez a cada processo, que aplica
+    a tarja consultando o conjunto ao extrair a chave de cada nota; opcoes_pdf (tamanho da saída)
+    também segue uma vez por processo"""
+    
+    DOCUMENTOS_POR_PROCESSO = 500
+    LIMITE_MEMORIA_MB = 1024
+    TEMPO_LIMITE_S = 120
+    
+    # Verificação da memória durante um documento e código de saída quando o orçamento estoura
+    INTERVALO_VIGIA_MEMORIA_S = 0.25
+    CODIGO_MEMORIA_EXCEDIDA = 75
+    
+    def __init__(self, template_content, processos: int = 1, documentos_por_processo: int = None,
+                 limite_memoria_mb: float = None, tempo_limite: float = None, limite_documento_mb: float = None,
+                 canceladas: frozenset = None, opcoes_pdf: Dict[str, Any] = None):
+        self.template_content = RegistroTemplates.de(template_content) if template_content is not None else None
+        self.canceladas = canceladas or frozenset()
+        self.opcoes_pdf = opcoes_pdf or {}
+        self.processos = max(1, processos)
+        self.documentos_por_processo = documentos_por_processo or self.DOCUMENTOS_POR_PROCESSO
+        self.limite_memoria_mb = self.LIMITE_MEMORIA_MB if limite_memoria_mb is None else limite_memoria_mb
+        self.tempo_limite = self.TEMPO_LIMITE_S if tempo_limite is None else tempo_limite
+        self.limite_documento_mb = 2 * self.limite_memoria_mb if limite_documento_mb is None else limite_documento_mb
+        self.reciclagens = 0
+        self.tempo_esgotado = 0
+        self.memoria_excedida = 0
+        self.pico_memoria_mb = 0.0
+        
+        # Sem psutil e sem /proc (Windows/macOS) a memória não pode ser medida e os limites não valem
+        self.mede_memoria = self.memoria_rss_mb() > 0
+    
+    @staticmethod
+    def memoria_rss_mb() -> float:
+        """Memória residente do processo atual em MB (psutil, se instalado, ou /proc; 0 se indisponível)"""
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss / 1048576
+        except ImportError:
+            pass
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+        except (OSError, ValueError, AttributeError):
+            return 0.0
+    
+    @staticmethod
+    def _vigiar_memoria(limite_mb: float):
+        """Encerrar o processo filho assim que a memória residente passar do orçamento"""
+        while True:
+            time.sleep(PoolRenderizacao.INTERVALO_VIGIA_MEMORIA_S)
+            if PoolRenderizacao.memoria_rss_mb() > limite_mb:
+                os._exit(PoolRenderizacao.CODIGO_MEMORIA_EXCEDIDA)
+    
+    @staticmethod
+    def _trabalhador(conexao, template_content, documentos_por_processo: int, limite_memoria_mb: float,
+                     limite_documento_mb: float = 0, canceladas: frozenset = None, opcoes_pdf: Dict[str, Any] = None):
+        """Laço do processo filho: recebe uma tarefa por vez e responde (resposta, memória, reciclar)"""
+        if limite_documento_mb and PoolRenderizacao.memoria_rss_mb() > 0:
+            threading.Thread(target=PoolRenderizacao._vigiar_memoria, args=(limite_documento_mb,), daemon=True).start()
+        
+        processador = ProcessadorMassa()
+        feitos = 0
+        while True:
+            tarefa = conexao.recv()
+            if tarefa is None:
+                break
+            resposta = processador.processar_xml_nfe(template_content=template_content, canceladas=canceladas,
+                                                     opcoes_pdf=opcoes_pdf, **tarefa)
+            feitos += 1
+            memoria = PoolRenderizacao.memoria_rss_mb()
+            reciclar = feitos >= documentos_por_processo or bool(limite_memoria_mb and memoria > limite_memoria_mb)
+            conexao.send((resposta, memoria, reciclar))
+            if reciclar:
+                break
+        conexao.close()
+    
+    def _iniciar_trabalhador(self) -> Dict[str, Any]:
+        conexao, conexao_filho = multiprocessing.Pipe()
+        processo = multiprocessing.Process(
+            target=PoolRenderizacao._trabalhador,
+            args=(conexao_filho, self.template_content, self.documentos_por_processo, self.limite_memoria_mb,
+                  self.limite_documento_mb, self.canceladas, self.opcoes_pdf),
+            daemon=True
+        )
+        processo.start()
+        conexao_filho.close()
+        return {'processo': processo, 'conexao': conexao, 'tarefa': None, 'inicio': 0.0}
+    
+    @staticmethod
+    def _encerrar_trabalhador(trabalhador: Dict[str, Any], forcar: bool = False):
+        processo = trabalhador['processo']
+        if forcar:
+            processo.terminate()
+        else:
+            try:
+                trabalhador['conexao'].send(None)
+            except (OSError, ValueError):
+                pass
+        processo.join(5)
+        if processo.is_alive():
+            processo.kill()
+            processo.join()
+        trabalhador['conexao'].close()
+    
+    @staticmethod
+    def _remover_pdf_parcial(tarefa: Dict[str, Any]):
+        """Apagar o PDF que o processo encerrado pode ter deixado pela metade"""
+        if not tarefa.get('gerar_pdf', True):
+            return
+        try:
+            os.remove(os.path.join(tarefa['output_dir'], tarefa['pdf_filename']))
+        except OSError:
+            pass
+    
+    def processar(self, tarefas, deve_parar=None):
+        """Converter as tarefas (dicionários com os argumentos de ProcessadorMassa.processar_xml_nfe,
+        exceto template_content) e gerar (tarefa, resposta) na ordem de conclusão.
+        Quando deve_parar() fica verdadeiro, nenhuma tarefa nova é enviada e as em andamento terminam"""
+        pendentes = iter(tarefas)
+        esgotadas = False
+        trabalhadores = [self._iniciar_trabalhador() for _ in range(self.processos)]
+        try:
+            while True:
+                # Uma tarefa por processo ocioso (os reciclados só são recriados se houver tarefa)
+                for indice, trabalhador in enumerate(trabalhadores):
+                    if esgotadas:
+                        break
+                    if trabalhador is not None and trabalhador['tarefa'] is not None:
+                        continue
+                    tarefa = None if deve_parar and deve_parar() else next(pendentes, None)
+                    if tarefa is None:
+                        esgotadas = True
+                        break
+                    if trabalhador is None:
+                        trabalhador = trabalhadores[indice] = self._iniciar_trabalhador()
+                    trabalhador['tarefa'] = tarefa
+                    trabalhador['inicio'] = time.time()
+                    trabalhador['conexao'].send(tarefa)
+                
+                ocupados = {t['conexao']: i for i, t in enumerate(trabalhadores) if t is not None and t['tarefa'] is not None}
+                if not ocupados:
+                    break
+                
+                # Esperar uma resposta, no máximo até o primeiro prazo vencer
+                prazo = None
+                if self.tempo_limite:
+                    primeiro_inicio = min(trabalhadores[i]['inicio'] for i in ocupados.values())
+                    prazo = max(0.0, primeiro_inicio + self.tempo_limite - time.time())
+                prontas = multiprocessing.connection.wait(list(ocupados), timeout=prazo)
+                
+                for conexao in prontas:
+                    indice = ocupados[conexao]
+                    trabalhador = trabalhadores[indice]
+                    tarefa, trabalhador['tarefa'] = trabalhador['tarefa'], None
+                    try:
+                        resposta, memoria, reciclar = conexao.recv()
+                        self.pico_memoria_mb = max(self.pico_memoria_mb, memoria)
+                    except (EOFError, OSError):
+                        trabalhador['processo'].join(5)
+                        codigo = trabalhador['processo'].exitcode
+                        if codigo == self.CODIGO_MEMORIA_EXCEDIDA:
+                            self.memoria_excedida += 1
+                            erro = f"Limite de memória excedido ({self.limite_documento_mb:,.0f} MB)"
+                        else:
+                            erro = f"Processo de conversão encerrado inesperadamente (código {codigo})"
+                        self._remover_pdf_parcial(tarefa)
+                        resposta = {'success': False, 'error': erro}
+                        reciclar = True
+                    
+                    if reciclar:
+                        self._encerrar_trabalhador(trabalhador)
+                        self.reciclagens += 1
+                        trabalhadores[indice] = None
+                    
+                    yield tarefa, resposta
+                
+                # Documentos que estouraram o tempo: encerrar o processo e seguir com o lote
+                if self.tempo_limite:
+                    agora = time.time()
+                    for conexao, indice in ocupados.items():
+                        trabalhador = trabalhadores[indice]
+                        if conexao in prontas or agora - trabalhador['inicio'] < self.tempo_limite:
+                            continue
+                        tarefa = trabalhador['tarefa']
+                        self._encerrar_trabalhador(trabalhador, forcar=True)
+                        trabalhadores[indice] = None
+                        self.tempo_esgotado += 1
+                        self._remover_pdf_parcial(tarefa)
+                        yield tarefa, {
+                            'success': False,
+                            'error': f"Tempo limite excedido ({self.tempo_limite:,.0f} s)",
+                            'tempo_esgotado': True
+                        }
+        finally:
+            for trabalhador in trabalhadores:
+                if trabalhador is not None:
+                    self._encerrar_trabalhador(trabalhador, forcar=trabalhador['tarefa'] is not None)
+
+class PlanejadorCapacidade:
+    """Estimativa calibrada do tempo de conversão e do número de processos.
+    
+    Mede uma amostra de XMLs espalhada pelos tamanhos do lote, ajusta por mínimos quadrados o custo
+    de cada etapa (leitura do XML e geração do PDF) em função da quantidade de itens e a quantidade
+    de itens em função do tamanho do arquivo; com isso estima o custo de cada XML do lote a partir
+    de um stat, prevê o tempo total para cada número de processos e recomenda o menor número que
+    fica perto do melhor tempo possível na máquina"""
+    
+    TAMANHO_AMOSTRA = 24
+    
+    # A calibração para de medir quando passa deste tempo (os maiores XMLs da amostra ficam por último)
+    TEMPO_MAXIMO_CALIBRACAO_S = 20.0
+    
+    # Iniciar um processo de conversão (importar lxml/weasyprint e carregar o template)
+    CUSTO_INICIO_PROCESSO_S = 1.0
+    
+    # Processos a mais só compensam se reduzirem o tempo em mais de 5%
+    GANHO_MINIMO = 0.05
+    
+    def __init__(self, template_content=None, gerar_pdf: bool = True, documentos_por_processo: int = None,
+                 opcoes_pdf: Dict[str, Any] = None):
+        self.template_content = RegistroTemplates.de(template_content) if template_content is not None else None
+        self.gerar_pdf = gerar_pdf and template_content is not None
+        self.opcoes_pdf = opcoes_pdf
+        self.documentos_por_processo = documentos_por_processo or PoolRenderizacao.DOCUMENTOS_POR_PROCESSO
+        self.nucleos = os.cpu_count() or 1
+    
+    @staticmethod
+    def _ajustar(x: np.ndarray, y: np.ndarray):
+        """Reta y = a + b·x por mínimos quadrados (só a média se x não varia ou a inclinação sai negativa)"""
+        if len(y) == 0:
+            return 0.0, 0.0
+        if len(np.unique(x)) < 2:
+            return float(np.mean(y)), 0.0
+        b, a = np.polyfit(x, y, 1)
+        if b < 0:
+            return float(np.mean(y)), 0.0
+        return max(float(a), 0.0), float(b)
+    
+    @staticmethod
+    def memoria_disponivel_mb() -> float:
+        """Memória disponível na máquina em MB (psutil, se instalado, ou /proc/meminfo; 0 se indisponível)"""
+        try:
+            import psutil
+            return psutil.virtual_memory().available / 1048576
+        except ImportError:
+            pass
+        try:
+            with open('/proc/meminfo') as f:
+                for linha in f:
+                    if linha.startswith('MemAvailable:'):
+                        return int(linha.split()[1]) / 1024
+        except (OSError, ValueError):
+            pass
+        return 0.0
+    
+    def amostrar(self, tamanhos: np.ndarray) -> np.ndarray:
+        """Índices da amostra: XMLs nos quantis de tamanho do lote, do menor para o maior"""
+        ordem = np.argsort(tamanhos, kind='stable')
+        posicoes = np.linspace(0, len(ordem) - 1, min(self.TAMANHO_AMOSTRA, len(ordem))).round().astype(int)
+        return ordem[np.unique(posicoes)]
+    
+    def medir(self, xmls: List[str]) -> Dict[str, np.ndarray]:
+        """Tempo de cada etapa e quantidade de itens dos XMLs da amostra"""
+        processador = ProcessadorMassa()
+        medidas = {'tamanho': [], 'itens': [], 'leitura': [], 'pdf': []}
+        inicio = time.perf_counter()
+        
+        # O primeiro XML é convertido duas vezes: a primeira, fora da medição, aquece caches e imports
+        aquecendo = True
+        for xml_path in [xmls[0]] + list(xmls) if xmls else []:
+            medir, aquecendo = not aquecendo, False
+            if time.perf_counter() - inicio > self.TEMPO_MAXIMO_CALIBRACAO_S:
+                break
+            try:
+                t0 = time.perf_counter()
+                dados_nfe = processador.extrair_dados_nfe(xml_path)
+                t1 = time.perf_counter()
+                if self.gerar_pdf:
+                    template = self.template_content.selecionar(dados_nfe)
+                    html_final = processador._substituir_variaveis(template, dados_nfe)
+                    template.gerar_pdf(html_final, opcoes=self.opcoes_pdf)
+                t2 = time.perf_counter()
+            except Exception:
+                continue
+            if not medir:
+                continue
+            medidas['tamanho'].append(os.path.getsize(xml_path))
+            medidas['itens'].append(len(dados_nfe.get('produtos') or []))
+            medidas['leitura'].append(t1 - t0)
+            medidas['pdf'].append(t2 - t1)
+        return {nome: np.asarray(valores, dtype=np.float64) for nome, valores in medidas.items()}
+    
+    def planejar(self, xmls: List[str]) -> Dict[str, Any]:
+        """Calibrar com uma amostra do lote e prever o tempo para 1..N processos"""
+        tamanhos = np.fromiter((ProcessadorMassa.custo_estimado(xml) for xml in xmls), dtype=np.float64, count=len(xmls))
+        amostra = self.amostrar(tamanhos) if len(xmls) else np.empty(0, dtype=int)
+        medidas = self.medir([xmls[i] for i in amostra])
+        
+        # Itens em função do tamanho; custo de cada etapa em função dos itens
+        modelo_itens = self._ajustar(medidas['tamanho'], medidas['itens'])
+        etapas = {etapa: self._ajustar(medidas['itens'], medidas[etapa]) for etapa in ('leitura', 'pdf')}
+        
+        itens = np.maximum(modelo_itens[0] + modelo_itens[1] * tamanhos, 1.0)
+        custos = np.zeros(len(xmls))
+        for a, b in etapas.values():
+            custos += a + b * itens
+        
+        # Cada processo precisa de memória própria: não recomendar mais do que cabe na máquina
+        maximo = self.nucleos
+        memoria_processo = max(PoolRenderizacao.memoria_rss_mb(), 1.0)
+        disponivel = self.memoria_disponivel_mb()
+        if disponivel:
+            maximo = max(1, min(maximo, int(disponivel // memoria_processo)))
+        
+        previsoes = {processos: self.prever(custos, processos) for processos in range(1, max(maximo, 1) + 1)}
+        melhor = min(previsoes.values()) if previsoes else 0.0
+        recomendado = min(
+            (processos for processos, tempo in previsoes.items() if tempo <= melhor * (1 + self.GANHO_MINIMO)),
+            default=1
+        )
+        
+        return {
+            'custos': custos,
+            'custo_total': float(custos.sum()),
+            'amostras': len(medidas['itens']),
+            'etapas': etapas,
+            'previsoes': previsoes,
+            'recomendado': recomendado,
+        }
+    
+    def prever(self, custos: np.ndarray, processos: int) -> float:
+        """Tempo total previsto (s): o trabalho dividido pelos núcleos efetivamente usados, nunca
+        abaixo do XML mais caro, mais o início dos processos e suas reciclagens"""
+        if len(custos) == 0:
+            return 0.0
+        efetivos = min(processos, self.nucleos)
+        reciclagens = len(custos) / self.documentos_por_processo
+        return (max(float(custos.sum()) / efetivos, float(custos.max()))
+                + self.CUSTO_INICIO_PROCESSO_S * (1 + reciclagens / efetivos))
+
+class CatalogoNFe:
+    """Catálogo local (SQLite) das notas processadas: cabeçalho e totais de cada NF-e, com
+    índices para consulta por chave, CNPJ do emitente/destinatário, data de emissão e número"""
+    
+    CAMINHO_PADRAO = os.path.join(str(Path.home()), ".nfe_studio", "catalogo_nfe.db")
+    TAMANHO_LOTE = 500
+    
+    # Coluna -> tipo; a ordem é a da tabela e dos parâmetros de gravação
+    COLUNAS = {
+        'chave': 'TEXT PRIMARY KEY',
+        'nNF': 'INTEGER',
+        'serie': 'INTEGER',
+        'mod': 'TEXT',
+        'tpNF': 'TEXT',
+        'dhEmi': 'TEXT',
+        'data_emissao': 'TEXT',
+        'natOp': 'TEXT',
+        'emit_CNPJ': 'TEXT',
+        'emit_xNome': 'TEXT',
+        'emit_UF': 'TEXT',
+        'dest_CNPJ': 'TEXT',
+        'dest_xNome': 'TEXT',
+        'dest_UF': 'TEXT',
+        'vProd': 'REAL',
+        'vBC': 'REAL',
+        'vICMS': 'REAL',
+        'vST': 'REAL',
+        'vIPI': 'REAL',
+        'vDesc': 'REAL',
+        'vFrete': 'REAL',
+        'vNF': 'REAL',
+        'itens': 'INTEGER',
+        'arquivo': 'TEXT',
+        'pdf': 'TEXT',
+        'status': 'TEXT',
+        'atualizado_em': 'TEXT',
+    }
+    COLUNAS_INTEIRAS = ('nNF', 'serie', 'itens')
+    COLUNAS_VALOR = ('vProd', 'vBC', 'vICMS', 'vST', 'vIPI', 'vDesc', 'vFrete', 'vNF')
+    
+    INDICES = {
+        'idx_notas_emit': ('emit_CNPJ', 'data_emissao'),
+        'idx_notas_dest': ('dest_CNPJ', 'data_emissao'),
+        'idx_notas_data': ('data_emissao',),
+        'idx_notas_numero': ('nNF', 'serie'),
+    }
+    
+    def __init__(self, caminho: str = None):
+        self.caminho = caminho or self.CAMINHO_PADRAO
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+        self.conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+        self.conexao.row_factory = sqlite3.Row
+        self._pendentes: List[tuple] = []
+        self._lock = threading.Lock()
+        
+        # WAL: leituras (renomeador, linha de comando) não bloqueiam a gravação da conversão
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self._criar_tabela()
+    
+    def _criar_tabela(self):
+        colunas = ", ".join(f"{nome} {tipo}" for nome, tipo in self.COLUNAS.items())
+        with self.conexao:
+            self.conexao.execute(f"CREATE TABLE IF NOT EXISTS notas ({colunas})")
+            for nome, colunas_indice in self.INDICES.items():
+                self.conexao.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON notas ({', '.join(colunas_indice)})")
+    
+    @classmethod
+    def _linha(cls, cabecalho: Dict[str, Any], status: str, pdf: str) -> tuple:
+        """Converter um cabeçalho (ver ProcessadorMassa.ler_cabecalho) na tupla da tabela"""
+        valores = dict(cabecalho)
+        valores['data_emissao'] = (valores.get('dhEmi') or '')[:10]
+        valores['status'] = status
+        valores['pdf'] = pdf
+        valores['atualizado_em'] = datetime.now().isoformat(timespec="seconds")
+        for coluna in cls.COLUNAS_INTEIRAS:
+            texto = str(valores.get(coluna) or '')
+            valores[coluna] = int(texto) if texto.isdigit() else None
+        for coluna in cls.COLUNAS_VALOR:
+            try:
+                valores[coluna] = float(valores.get(coluna) or 0)
+            except (TypeError, ValueError):
+                valores[coluna] = None
+        return tuple(valores.get(coluna) for coluna in cls.COLUNAS)
+    
+    def registrar(self, cabecalho: Dict[str, Any], status: str = '', pdf: str = ''):
+        """Incluir ou atualizar uma nota; a gravação acontece em lotes (uma transação por lote)"""
+        if not cabecalho.get('chave'):
+            return
+        with self._lock:
+            self._pendentes.append(self._linha(cabecalho, status, pdf))
+            if len(self._pendentes) >= self.TAMANHO_LOTE:
+                self._gravar_pendentes()
+    
+    def _gravar_pendentes(self):
+        if not self._pendentes:
+            return
+        colunas = list(self.COLUNAS)
+        atualizacoes = ", ".join(f"{c} = excluded.{c}" for c in colunas[1:])
+        sql = (
+            f"INSERT INTO notas ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))}) "
+            f"ON CONFLICT(chave) DO UPDATE SET {atualizacoes}"
+        )
+        with self.conexao:
+            self.conexao.executemany(sql, self._pendentes)
+        self._pendentes = []
+    
+    def gravar(self):
+        """Gravar o lote pendente"""
+        with self._lock:
+            self._gravar_pendentes()
+    
+    def fechar(self):
+        self.gravar()
+        self.conexao.close()
+    
+    def consultar(self, chave: str = None, emit_cnpj: str = None, dest_cnpj: str = None,
+                  data_inicio: str = None, data_fim: str = None, valor_minimo: float = None,
+                  valor_maximo: float = None, numero: int = None, limite: int = None) -> List[Dict[str, Any]]:
+        """Consultar notas; datas no formato AAAA-MM-DD (inclusivas)"""
+        condicoes, parametros = [], []
+        filtros = (
+            ("chave = ?", chave),
+            ("emit_CNPJ = ?", emit_cnpj),
+            ("dest_CNPJ = ?", dest_cnpj),
+            ("data_emissao >= ?", data_inicio),
+            ("data_emissao <= ?", data_fim),
+            ("vNF >= ?", valor_minimo),
+            ("vNF <= ?", valor_maximo),
+            ("nNF = ?", numero),
+        )
+        for condicao, valor in filtros:
+            if valor not in (None, ''):
+                condicoes.append(condicao)
+                parametros.append(valor)
+        
+        sql = "SELECT * FROM notas"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY data_emissao, emit_CNPJ, serie, nNF"
+        if limite:
+            sql += " LIMIT ?"
+            parametros.append(int(limite))
+        
+        self.gravar()
+        return [dict(linha) for linha in self.conexao.execute(sql, parametros)]
+
+class ExportadorParquet:
+    """Exportação colunar (Parquet) dos cabeçalhos das notas e dos itens, particionada por mês de
+    emissão (ano_mes=AAAA-MM, no formato Hive) e gravada em grupos de linhas, com memória limitada"""
+    
+    LINHAS_POR_GRUPO = 50_000
+    
+    # Limite de linhas em memória somando todas as partições de um conjunto
+    LIMITE_EM_MEMORIA = 200_000
+    
+    COLUNAS_NOTAS = [
+        ('chave', 'texto'), ('nNF', 'inteiro'), ('serie', 'inteiro'), ('mod', 'texto'),
+        ('dhEmi', 'texto'), ('data_emissao', 'texto'), ('natOp', 'texto'),
+        ('emit_CNPJ', 'texto'), ('emit_xNome', 'texto'), ('emit_UF', 'texto'),
+        ('dest_CNPJ', 'texto'), ('dest_xNome', 'texto'), ('dest_UF', 'texto'),
+        ('vProd', 'valor'), ('vBC', 'valor'), ('vICMS', 'valor'), ('vST', 'valor'), ('vIPI', 'valor'),
+        ('vDesc', 'valor'), ('vFrete', 'valor'), ('vNF', 'valor'), ('itens', 'inteiro'), ('arquivo', 'texto'),
+    ]
+    COLUNAS_ITENS = [
+        ('chave', 'texto'), ('nItem', 'inteiro'), ('emit_CNPJ', 'texto'), ('data_emissao', 'texto'),
+        ('codigo', 'texto'), ('descricao', 'texto'), ('ncm', 'texto'), ('cfop', 'texto'), ('unidade', 'texto'),
+        ('quantidade', 'valor'), ('valor_unitario', 'valor'), ('valor_total', 'valor'),
+        ('icms_vbc', 'valor'), ('icms_picms', 'valor'), ('icms_vicms', 'valor'),
+        ('ipi_pipi', 'valor'), ('ipi_vipi', 'valor'),
+    ]
+    
+    def __init__(self, pasta_destino: str, linhas_por_grupo: int = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Exportação Parquet requer o pacote pyarrow (pip install pyarrow)")
+        self._pa = pa
+        self._pq = pq
+        tipos = {'texto': pa.string(), 'inteiro': pa.int32(), 'valor': pa.float64()}
+        self._esquemas = {
+            'notas': pa.schema([(nome, tipos[tipo]) for nome, tipo in self.COLUNAS_NOTAS]),
+            'itens': pa.schema([(nome, tipos[tipo]) for nome, tipo in self.COLUNAS_ITENS]),
+        }
+        
+        self.pasta = pasta_destino
+        self.linhas_por_grupo = linhas_por_grupo or self.LINHAS_POR_GRUPO
+        self.id_execucao = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._buffers: Dict[tuple, List[tuple]] = {}    # (conjunto, partição) -> linhas
+        self._em_memoria = {'notas': 0, 'itens': 0}
+        self._writers: Dict[tuple, Any] = {}
+        self.total_notas = 0
+        self.total_itens = 0
+    
+    @staticmethod
+    def _converter(valor, tipo: str):
+        if tipo == 'texto':
+            return None if valor is None else str(valor)
+        texto = str(valor or '').strip()
+        if not texto:
+            return None
+        try:
+            return int(texto) if tipo == 'inteiro' else float(texto)
+        except ValueError:
+            return None
+    
+    def adicionar(self, cabecalho: Dict[str, Any], produtos: List[Dict[str, Any]] = None):
+        """Incluir uma nota (cabeçalho no formato de ProcessadorMassa.ler_cabecalho) e seus itens
+        (no formato de ProcessadorMassa._processar_produtos)"""
+        data_emissao = (cabecalho.get('dhEmi') or '')[:10]
+        particao = data_emissao[:7] or 'sem_data'
+        nota = dict(cabecalho, data_emissao=data_emissao)
+        self._incluir('notas', particao, tuple(
+            self._converter(nota.get(nome), tipo) for nome, tipo in self.COLUNAS_NOTAS
+        ))
+        self.total_notas += 1
+        
+        for numero, produto in enumerate(produtos or [], 1):
+            icms = produto.get('icms') or {}
+            ipi = produto.get('ipi') or {}
+            item = dict(
+                produto,
+                chave=cabecalho.get('chave'), nItem=numero,
+                emit_CNPJ=cabecalho.get('emit_CNPJ'), data_emissao=data_emissao,
+                icms_vbc=icms.get('vbc'), icms_picms=icms.get('picms'), icms_vicms=icms.get('vicms'),
+                ipi_pipi=ipi.get('pipi'), ipi_vipi=ipi.get('vipi'),
+            )
+            self._incluir('itens', particao, tuple(
+                self._converter(item.get(nome), tipo) for nome, tipo in self.COLUNAS_ITENS
+            ))
+            self.total_itens += 1
+    
+    def _incluir(self, conjunto: str, particao: str, linha: tuple):
+        chave = (conjunto, particao)
+        buffer = self._buffers.setdefault(chave, [])
+        buffer.append(linha)
+        self._em_memoria[conjunto] += 1
+        if len(buffer) >= self.linhas_por_grupo:
+            self._descarregar(chave)
+        elif self._em_memoria[conjunto] >= self.LIMITE_EM_MEMORIA:
+            # Muitas partições pequenas: gravar todas para não acumular memória
+            for outra in [c for c in self._buffers if c[0] == conjunto]:
+                self._descarregar(outra)
+    
+    def _descarregar(self, chave: tuple):
+        """Gravar o buffer de uma partição como um grupo de linhas"""
+        linhas = self._buffers.pop(chave, None)
+        if not linhas:
+            return
+        conjunto, particao = chave
+        self._em_memoria[conjunto] -= len(linhas)
+        
+        esquema = self._esquemas[conjunto]
+        colunas = list(zip(*linhas))
+        tabela = self._pa.Table.from_arrays(
+            [self._pa.array(coluna, type=campo.type) for coluna, campo in zip(colunas, esquema)],
+            schema=esquema
+        )
+        
+        writer = self._writers.get(chave)
+        if writer is None:
+            pasta = os.path.join(self.pasta, conjunto, f"ano_mes={particao}")
+            os.makedirs(pasta, exist_ok=True)
+            caminho = os.path.join(pasta, f"parte-{self.id_execucao}.parquet")
+            writer = self._pq.ParquetWriter(caminho, esquema, compression="snappy")
+            self._writers[chave] = writer
+        writer.write_table(tabela, row_group_size=self.linhas_por_grupo)
+    
+    def fechar(self):
+        """Gravar os buffers restantes e fechar os arquivos"""
+        for chave in list(self._buffers):
+            self._descarregar(chave)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+class AuditoriaFiscal:
+    """Auditoria de consistência fiscal de um lote inteiro: soma dos itens x ICMSTot/vProd,
+    duplicatas x vNF e base x alíquota x valor do ICMS de cada item.
+    
+    Só os itens com indTot=1 entram na soma; no ICMS diferido (ICMS51) a base x alíquota é
+    comparada com vICMSOp, o ICMS da operação, e não com o vICMS que sobra após o diferimento.
+    
+    Os valores de cada nota são acumulados em arrays compactos (array('d')) durante a extração e
+    as verificações são feitas de uma vez, vetorizadas com NumPy, em apurar()"""
+    
+    # Diferença máxima aceita (arredondamento de centavos)
+    TOLERANCIA = 0.01
+    
+    VERIFICACAO_ITENS = "Soma dos itens x ICMSTot/vProd"
+    VERIFICACAO_DUPLICATAS = "Soma das duplicatas x vNF"
+    VERIFICACAO_ICMS = "ICMS: vBC x pICMS x vICMS"
+    
+    COLUNAS = ['Chave de Acesso', 'Nota Fiscal', 'Arquivo XML', 'Item', 'Verificação',
+               'Esperado', 'Encontrado', 'Diferença']
+    
+    def __init__(self, tolerancia: float = None):
+        self.tolerancia = self.TOLERANCIA if tolerancia is None else tolerancia
+        
+        # Por nota
+        self.chaves: List[str] = []
+        self.numeros: List[str] = []
+        self.arquivos: List[str] = []
+        self._vprod = array('d')
+        self._vnf = array('d')
+        self._soma_duplicatas = array('d')
+        self._qtd_duplicatas = array('q')
+        
+        # Por item (com o índice da nota)
+        self._item_nota = array('q')
+        self._item_numero = array('q')
+        self._item_vprod = array('d')
+        self._item_compoe_total = array('b')
+        self._item_vbc = array('d')
+        self._item_picms = array('d')
+        self._item_vicms = array('d')
+    
+    @staticmethod
+    def _valor(texto) -> float:
+        try:
+            return float(str(texto).strip())
+        except (TypeError, ValueError):
+            return float('nan')
+    
+    def __len__(self):
+        return len(self.chaves)
+    
+    def adicionar(self, dados_nfe: Dict[str, Any], xml_path: str = ''):
+        """Incluir uma nota a partir dos dados de ProcessadorMassa.extrair_dados_nfe"""
+        valor = self._valor
+        indice = len(self.chaves)
+        self.chaves.append(dados_nfe.get('chave', ''))
+        self.numeros.append(dados_nfe.get('numero', ''))
+        self.arquivos.append(os.path.basename(xml_path))
+        self._vprod.append(valor(dados_nfe.get('vProd')))
+        self._vnf.append(valor(dados_nfe.get('vNF')))
+        
+        duplicatas = dados_nfe.get('duplicatas') or []
+        self._soma_duplicatas.append(sum(valor(dup.get('valor')) for dup in duplicatas))
+        self._qtd_duplicatas.append(len(duplicatas))
+        
+        for numero, produto in enumerate(dados_nfe.get('produtos') or [], 1):
+            icms = produto.get('icms') or {}
+            self._item_nota.append(indice)
+            self._item_numero.append(numero)
+            self._item_vprod.append(valor(produto.get('valor_total')))
+            self._item_compoe_total.append(produto.get('ind_tot', '1') != '0')
+            self._item_vbc.append(valor(icms.get('vbc')))
+            self._item_picms.append(valor(icms.get('picms')))
+            self._item_vicms.append(valor(icms.get('vicmsop') or icms.get('vicms')))
+    
+    def _excecoes(self, verificacao: str, notas: np.ndarray, itens: np.ndarray,
+                  esperado: np.ndarray, encontrado: np.ndarray) -> Dict[str, Any]:
+        """Colunas do relatório para as linhas que excedem a tolerância"""
+        diferenca = np.round(encontrado - esperado, 2)
+        fora = np.abs(diferenca) > self.tolerancia + 1e-9
+        notas = notas[fora]
+        return {
+            'nota': notas,
+            'Item': itens[fora],
+            'Verificação': np.full(len(notas), verificacao, dtype=object),
+            'Esperado': np.round(esperado[fora], 2),
+            'Encontrado': np.round(encontrado[fora], 2),
+            'Diferença': diferenca[fora],
+        }
+    
+    def apurar(self) -> pd.DataFrame:
+        """Executar as verificações sobre o lote inteiro e retornar as exceções encontradas"""
+        total_notas = len(self.chaves)
+        vprod = np.asarray(self._vprod, dtype=np.float64)
+        vnf = np.asarray(self._vnf, dtype=np.float64)
+        soma_duplicatas = np.asarray(self._soma_duplicatas, dtype=np.float64)
+        qtd_duplicatas = np.asarray(self._qtd_duplicatas, dtype=np.int64)
+        
+        item_nota = np.asarray(self._item_nota, dtype=np.int64)
+        item_numero = np.asarray(self._item_numero, dtype=np.int64)
+        item_vprod = np.asarray(self._item_vprod, dtype=np.float64)
+        item_compoe_total = np.asarray(self._item_compoe_total, dtype=bool)
+        item_vbc = np.asarray(self._item_vbc, dtype=np.float64)
+        item_picms = np.asarray(self._item_picms, dtype=np.float64)
+        item_vicms = np.asarray(self._item_vicms, dtype=np.float64)
+        
+        indices_notas = np.arange(total_notas)
+        sem_item = np.zeros(total_notas, dtype=np.int64)
+        partes = []
+        
+        # 1) Soma dos vProd dos itens que compõem o total (indTot=1) por nota (um único bincount) x ICMSTot/vProd
+        vprod_itens = np.bincount(item_nota, weights=np.where(item_compoe_total, np.nan_to_num(item_vprod), 0.0),
+                                  minlength=total_notas)
+        validas = ~np.isnan(vprod)
+        partes.append(self._excecoes(
+            self.VERIFICACAO_ITENS, indices_notas[validas], sem_item[validas],
+            vprod[validas], vprod_itens[validas]
+        ))
+        
+        # 2) Soma das duplicatas x vNF (só notas com cobrança)
+        validas = (qtd_duplicatas > 0) & ~np.isnan(vnf) & ~np.isnan(soma_duplicatas)
+        partes.append(self._excecoes(
+            self.VERIFICACAO_DUPLICATAS, indices_notas[validas], sem_item[validas],
+            vnf[validas], soma_duplicatas[validas]
+        ))
+        
+        # 3) vBC x pICMS / 100 x vICMS (vICMSOp quando diferido) em cada item tributado
+        validos = ~(np.isnan(item_vbc) | np.isnan(item_picms) | np.isnan(item_vicms))
+        partes.append(self._excecoes(
+            self.VERIFICACAO_ICMS, item_nota[validos], item_numero[validos],
+            item_vbc[validos] * item_picms[validos] / 100.0, item_vicms[validos]
+        ))
+        
+        # Exceções na ordem das notas no lote
+        notas = np.concatenate([parte.pop('nota') for parte in partes])
+        ordem = np.argsort(notas, kind='stable')
+        notas = notas[ordem]
+        colunas = {nome: np.concatenate([parte[nome] for parte in partes])[ordem] for nome in partes[0]}
+        
+        chaves = np.asarray(self.chaves, dtype=object)
+        numeros = np.asarray(self.numeros, dtype=object)
+        arquivos = np.asarray(self.arquivos, dtype=object)
+        df = pd.DataFrame({
+            'Chave de Acesso': chaves[notas] if len(notas) else [],
+            'Nota Fiscal': numeros[notas] if len(notas) else [],
+            'Arquivo XML': arquivos[notas] if len(notas) else [],
+            **colunas,
+        }, columns=self.COLUNAS)
+        df['Item'] = df['Item'].astype(object).where(df['Item'] > 0, '')
+        return df
+
+class AnaliseNumeracao:
+    """Lacunas e duplicidades de nNF por emitente, modelo e série.
+    
+    Cada cabeçalho vira quatro inteiros em arrays compactos (o CNPJ é codificado uma vez por
+    emitente); apurar() ordena o lote uma única vez (lexsort) e encontra lacunas e repetições
+    comparando cada número com o seguinte, sem dicionários por nota"""
+    
+    LACUNA = "Lacuna"
+    DUPLICADO = "Duplicado"
+    
+    COLUNAS = ['Emitente (CNPJ)', 'Modelo', 'Série', 'Ocorrência', 'Número Inicial', 'Número Final', 'Quantidade']
+    
+    def __init__(self):
+        self._emitentes: Dict[str, int] = {}
+        self._emitente = array('i')
+        self._modelo = array('i')
+        self._serie = array('i')
+        self._numero = array('q')
+        self.ignorados = 0
+    
+    def __len__(self):
+        return len(self._numero)
+    
+    def adicionar(self, cabecalho: Dict[str, Any]):
+        """Incluir uma nota (cabeçalho no formato de ProcessadorMassa.ler_cabecalho)"""
+        try:
+            numero = int(str(cabecalho.get('nNF') or '').strip())
+            serie = int(str(cabecalho.get('serie') or 0).strip() or 0)
+            modelo = int(str(cabecalho.get('mod') or 0).strip() or 0)
+        except ValueError:
+            self.ignorados += 1
+            return
+        cnpj = cabecalho.get('emit_CNPJ') or ''
+        codigo = self._emitentes.get(cnpj)
+        if codigo is None:
+            codigo = self._emitentes[cnpj] = len(self._emitentes)
+        self._emitente.append(codigo)
+        self._modelo.append(modelo)
+        self._serie.append(serie)
+        self._numero.append(numero)
+    
+    def apurar(self) -> pd.DataFrame:
+        """Faixas de números ausentes e números repetidos, ordenados por emitente, modelo e série"""
+        emitente = np.asarray(self._emitente, dtype=np.int32)
+        modelo = np.asarray(self._modelo, dtype=np.int32)
+        serie = np.asarray(self._serie, dtype=np.int32)
+        numero = np.asarray(self._numero, dtype=np.int64)
+        
+        # Uma única ordenação: emitente, modelo, série e número
+        ordem = np.lexsort((numero, serie, modelo, emitente))
+        emitente, modelo, serie, numero = emitente[ordem], modelo[ordem], serie[ordem], numero[ordem]
+        
+        mesmo_grupo = ((emitente[1:] == emitente[:-1]) & (modelo[1:] == modelo[:-1])
+                       & (serie[1:] == serie[:-1]))
+        passo = numero[1:] - numero[:-1]
+        
+        # Lacunas: salto maior que 1 entre números consecutivos do mesmo grupo
+        lacunas = np.nonzero(mesmo_grupo & (passo > 1))[0]
+        inicio_lacuna = numero[lacunas] + 1
+        fim_lacuna = numero[lacunas + 1] - 1
+        
+        # Duplicados: sequências de números iguais (início e fim de cada sequência)
+        iguais = np.concatenate(([0], (mesmo_grupo & (passo == 0)).astype(np.int8), [0]))
+        bordas = np.diff(iguais)
+        inicio_seq = np.nonzero(bordas == 1)[0]
+        fim_seq = np.nonzero(bordas == -1)[0]
+        
+        posicoes = np.concatenate((lacunas, inicio_seq))
+        df = pd.DataFrame({
+            'emitente': emitente[posicoes],
+            'Modelo': modelo[posicoes],
+            'Série': serie[posicoes],
+            'Ocorrência': np.concatenate((
+                np.full(len(lacunas), self.LACUNA, dtype=object),
+                np.full(len(inicio_seq), self.DUPLICADO, dtype=object),
+            )),
+            'Número Inicial': np.concatenate((inicio_lacuna, numero[inicio_seq])),
+            'Número Final': np.concatenate((fim_lacuna, numero[inicio_seq])),
+            'Quantidade': np.concatenate((fim_lacuna - inicio_lacuna + 1, fim_seq - inicio_seq + 1)),
+        })
+        df = df.sort_values(['emitente', 'Modelo', 'Série', 'Número Inicial'], kind='stable')
+        
+        cnpjs = np.asarray(list(self._emitentes), dtype=object)
+        df.insert(0, 'Emitente (CNPJ)', cnpjs[df.pop('emitente').to_numpy()] if len(df) else [])
+        return df.reset_index(drop=True)[self.COLUNAS]
+
+class IndiceCancelamentos:
+    """Chaves de acesso com cancelamento homologado, lidas dos XMLs de evento do próprio lote.
+    
+    O índice é montado na mesma passada da classificação (só os arquivos de evento são lidos de
+    novo, por inteiro, e são pequenos); na conversão cada nota é consultada num set, em O(1),
+    sem varrer a pasta de novo. Só contam eventos com retorno da SEFAZ registrado: um pedido de
+    cancelamento sem protocolo não cancela a nota"""
+    
+    # 110111: cancelamento; 110112: cancelamento por substituição (NFC-e)
+    TIPOS_CANCELAMENTO = ('110111', '110112')
+    # 135/136: evento registrado (com ou sem vinculação); 155: cancelamento fora do prazo homologado
+    CSTAT_REGISTRADO = ('135', '136', '155')
+    TAGS_EVENTO = ('{*}chNFe', '{*}tpEvento', '{*}cStat')
+    
+    def __init__(self):
+        self.eventos: Dict[str, str] = {}
+    
+    def __len__(self):
+        return len(self.eventos)
+    
+    def __contains__(self, chave: str) -> bool:
+        return chave in self.eventos
+    
+    @property
+    def chaves(self) -> frozenset:
+        """Chaves canceladas num conjunto imutável (enviado uma vez a cada processo de conversão)"""
+        return frozenset(self.eventos)
+    
+    def adicionar(self, chave: str, xml_path: str = ''):
+        self.eventos[chave] = xml_path
+    
+    @staticmethod
+    def ler_evento(xml_path: str) -> Dict[str, str]:
+        """chNFe, tpEvento e cStat (o primeiro de cada) de um XML de evento"""
+        campos = {}
+        try:
+            for _, elemento in etree.iterparse(xml_path, events=('end',), tag=IndiceCancelamentos.TAGS_EVENTO):
+                campos.setdefault(etree.QName(elemento).localname, (elemento.text or '').strip())
+                elemento.clear()
+        except (etree.XMLSyntaxError, OSError):
+            pass
+        return campos
+    
+    @classmethod
+    def chave_cancelada(cls, xml_path: str) -> str:
+        """Chave da nota cancelada pelo evento; vazio se o evento não for um cancelamento registrado"""
+        evento = cls.ler_evento(xml_path)
+        chave = evento.get('chNFe', '')
+        if (len(chave) == 44 and evento.get('tpEvento') in cls.TIPOS_CANCELAMENTO
+                and evento.get('cStat') in cls.CSTAT_REGISTRADO):
+            return chave
+        return ''
+
+class ValidadorChaveNFe:
+    """Validação vetorizada de chaves de acesso NF-e (estrutura, UF, data, CNPJ, modelo e dígito verificador)"""
+    
+    # Códigos IBGE das UFs
+    UFS = (11, 12, 13, 14, 15, 16, 17, 21, 22, 23, 24, 25, 26, 27, 28, 29,
+           31, 32, 33, 35, 41, 42, 43, 50, 51, 52, 53)
+    MODELOS = (55, 65)
+    
+    VALIDA = 0
+    MOTIVOS = {
+        0: "",
+        1: "formato (44 dígitos)",
+        2: "UF",
+        3: "data AAMM",
+        4: "modelo",
+        5: "CNPJ/CPF do emitente",
+        6: "dígito verificador",
+    }
+    
+    # Pesos do módulo 11: 2..9 repetidos da direita para a esquerda sobre as 43 primeiras posições
+    PESOS_DV = np.array([2 + (i % 8) for i in range(43)][::-1], dtype=np.int32)
+    PESOS_CNPJ_1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int32)
+    PESOS_CNPJ_2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int32)
+    PESOS_CPF_1 = np.arange(10, 1, -1, dtype=np.int32)
+    PESOS_CPF_2 = np.arange(11, 1, -1, dtype=np.int32)
+    
+    # Tamanho dos blocos processados entre duas notificações de progresso
+    TAMANHO_BLOCO = 200_000
+    
+    @classmethod
+    def validar(cls, chaves, progresso=None) -> np.ndarray:
+        """Validar um array de chaves; retorna o código do motivo por chave (0 = válida)
+        
+        progresso(processadas, total) é chamado ao fim de cada bloco.
+        """
+        chaves = list(chaves)
+        total = len(chaves)
+        motivos = np.empty(total, dtype=np.uint8)
+        for inicio in range(0, total, cls.TAMANHO_BLOCO):
+            fim = min(inicio + cls.TAMANHO_BLOCO, total)
+            motivos[inicio:fim] = cls._validar_bloco(chaves[inicio:fim])
+            if progresso:
+                progresso(fim, total)
+        return motivos
+    
+    @classmethod
+    def _digitos(cls, chaves: List[str]):
+        """Matriz (N, 44) de dígitos e máscara das chaves com formato válido"""
+        chaves = [c if isinstance(c, str) else str(c) for c in chaves]
+        tamanhos = np.fromiter(map(len, chaves), dtype=np.int64, count=len(chaves))
+        formato_ok = np.ones(len(chaves), dtype=bool)
+        # Caminho rápido: exatamente 44 caracteres; só as demais passam pela limpeza (pontos, espaços...)
+        for i in np.flatnonzero(tamanhos != 44).tolist():
+            limpa = re.sub(r'[^0-9]', '', chaves[i])
+            if len(limpa) != 44:
+                limpa = "0" * 44
+                formato_ok[i] = False
+            chaves[i] = limpa
+        digitos = np.frombuffer("".join(chaves).encode('ascii', errors='replace'), dtype=np.uint8)
+        digitos = digitos.reshape(-1, 44) - np.uint8(ord('0'))
+        formato_ok &= (digitos <= 9).all(axis=1)
+        digitos = digitos.astype(np.int32)
+        digitos[~formato_ok] = 0
+        return digitos, formato_ok
+    
+    @staticmethod
+    def _dv_mod11(digitos: np.ndarray, pesos: np.ndarray) -> np.ndarray:
+        resto = (digitos @ pesos) % 11
+        return np.where(resto < 2, 0, 11 - resto)
+    
+    @classmethod
+    def _validar_bloco(cls, chaves: List[str]) -> np.ndarray:
+        if not chaves:
+            return np.zeros(0, dtype=np.uint8)
+        d, formato_ok = cls._digitos(chaves)
+        
+        uf_ok = np.isin(d[:, 0] * 10 + d[:, 1], cls.UFS)
+        mes = d[:, 4] * 10 + d[:, 5]
+        data_ok = (mes >= 1) & (mes <= 12)
+        modelo_ok = np.isin(d[:, 20] * 10 + d[:, 21], cls.MODELOS)
+        
+        # CNPJ do emitente (posições 7-20); emitente pessoa física traz o CPF com zeros à esquerda
+        cnpj = d[:, 6:20]
+        cnpj_ok = (
+            (cls._dv_mod11(cnpj[:, :12], cls.PESOS_CNPJ_1) == cnpj[:, 12]) &
+            (cls._dv_mod11(cnpj[:, :13], cls.PESOS_CNPJ_2) == cnpj[:, 13]) &
+            cnpj.any(axis=1)
+        )
+        cpf = cnpj[:, 3:]
+        cpf_dv1 = (cpf[:, :9] @ cls.PESOS_CPF_1 * 10) % 11 % 10
+        cpf_dv2 = (cpf[:, :10] @ cls.PESOS_CPF_2 * 10) % 11 % 10
+        cpf_ok = (cnpj[:, :3] == 0).all(axis=1) & (cpf_dv1 == cpf[:, 9]) & (cpf_dv2 == cpf[:, 10]) & cpf.any(axis=1)
+        
+        dv_ok = cls._dv_mod11(d[:, :43], cls.PESOS_DV) == d[:, 43]
+        
+        # O primeiro problema encontrado (na ordem dos motivos) é o informado
+        return np.select(
+            [~formato_ok, ~uf_ok, ~data_ok, ~modelo_ok, ~(cnpj_ok | cpf_ok), ~dv_ok],
+            [1, 2, 3, 4, 5, 6],
+            default=cls.VALIDA
+        ).astype(np.uint8)
+    
+    @classmethod
+    def status(cls, motivos: np.ndarray) -> np.ndarray:
+        """Texto de status do renomeador para cada código de motivo"""
+        textos = np.array(
+            ["Válido"] + [f"Erro - Chave inválida ({cls.MOTIVOS[m]})" for m in range(1, len(cls.MOTIVOS))],
+            dtype=object
+        )
+        return textos[motivos]
+
+class ImportadorMapeamento:
+    """Leitura em blocos de planilhas chave → nome (CSV, XLSX ou Parquet) para o renomeador"""
+    
+    TAMANHO_BLOCO = 50_000
+    EXTENSOES = ('.csv', '.txt', '.xlsx', '.xlsm', '.parquet')
+    
+    # Nomes de coluna aceitos (comparação sem maiúsculas/espaços extras)
+    COLUNAS_CHAVE = ('chave acesso nf', 'chave de acesso', 'chave acesso', 'chave', 'chave_acesso', 'chnfe')
+    COLUNAS_NOME = ('nome arq. nf', 'nome arquivo nf', 'nome arquivo', 'nome', 'nome_arquivo', 'novo nome')
+    
+    @classmethod
+    def ler_em_blocos(cls, caminho: str, tamanho_bloco: int = None):
+        """Gerar blocos (chaves, nomes) do arquivo sem carregá-lo inteiro na memória. Problemas no
+        arquivo chegam como ValueError, com a mensagem para o usuário, em qualquer formato"""
+        tamanho_bloco = tamanho_bloco or cls.TAMANHO_BLOCO
+        extensao = Path(caminho).suffix.lower()
+        if extensao in ('.csv', '.txt'):
+            return cls._tratar_erros(caminho, cls._ler_csv(caminho, tamanho_bloco))
+        elif extensao in ('.xlsx', '.xlsm'):
+            return cls._tratar_erros(caminho, cls._ler_excel(caminho, tamanho_bloco))
+        elif extensao == '.parquet':
+            return cls._tratar_erros(caminho, cls._ler_parquet(caminho, tamanho_bloco))
+        raise ValueError(f"Formato não suportado: {extensao}")
+    
+    @staticmethod
+    def _tratar_erros(caminho: str, blocos):
+        """Repassar os blocos convertendo erros do pandas/openpyxl/pyarrow em ValueError"""
+        try:
+            yield from blocos
+        except ImportError:
+            raise
+        except Exception as e:
+            if type(e) is ValueError:
+                raise
+            raise ValueError(f"Não foi possível ler {os.path.basename(caminho)}: {e}") from e
+    
+    @staticmethod
+    def _verificar_colunas(total_colunas: int):
+        """Chave e nome são obrigatórios: arquivos com uma coluna só são recusados em todos os formatos"""
+        if total_colunas < 2:
+            raise ValueError("O arquivo precisa de uma coluna de chave e uma de nome")
+    
+    @classmethod
+    def _localizar_colunas(cls, cabecalho) -> tuple:
+        """Índices das colunas de chave e nome; (None, None) se a primeira linha já for dado"""
+        nomes = [str(c).strip().lower() if c is not None else '' for c in cabecalho]
+        if nomes and len(re.sub(r'[^0-9]', '', nomes[0])) == 44:
+            return None, None
+        idx_chave = next((nomes.index(c) for c in cls.COLUNAS_CHAVE if c in nomes), 0)
+        idx_nome = next((nomes.index(c) for c in cls.COLUNAS_NOME if c in nomes), 1 if idx_chave != 1 else 0)
+        return idx_chave, idx_nome
+    
+    @staticmethod
+    def _texto(valor) -> str:
+        if valor is None:
+            return ''
+        if isinstance(valor, float) and valor.is_integer():
+            valor = int(valor)
+        return str(valor).strip()
+    
+    @staticmethod
+    def _detectar_codificacao(caminho: str) -> str:
+        """UTF-8 (com ou sem BOM) se o arquivo inteiro decodificar; senão cp1252, padrão do Excel no Windows"""
+        decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+        try:
+            with open(caminho, 'rb') as f:
+                for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                    decodificador.decode(bloco)
+            decodificador.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return 'cp1252'
+        return 'utf-8-sig'
+    
+    @classmethod
+    def _ler_csv(cls, caminho: str, tamanho_bloco: int):
+        codificacao = cls._detectar_codificacao(caminho)
+        with open(caminho, 'r', encoding=codificacao, newline='') as f:
+            amostra = f.read(64 * 1024)
+        try:
+            separador = csv.Sniffer().sniff(amostra, delimiters=',;\t|').delimiter
+        except csv.Error:
+            separador = ';' if ';' in (amostra.splitlines() or [''])[0] else ','
+        primeira_linha = next(csv.reader([amostra.splitlines()[0]], delimiter=separador)) if amostra.strip() else []
+        cls._verificar_colunas(len(primeira_linha))
+        idx_chave, idx_nome = cls._localizar_colunas(primeira_linha)
+        sem_cabecalho = idx_chave is None
+        if sem_cabecalho:
+            idx_chave, idx_nome = 0, 1
+        
+        leitor = pd.read_csv(
+            caminho, sep=separador, dtype=str, keep_default_na=False, encoding=codificacao,
+            header=None, skiprows=0 if sem_cabecalho else 1, usecols=[idx_chave, idx_nome],
+            chunksize=tamanho_bloco
+        )
+        for bloco in leitor:
+            yield (bloco[idx_chave].str.strip().tolist(), bloco[idx_nome].str.strip().tolist())
+    
+    @classmethod
+    def _ler_excel(cls, caminho: str, tamanho_bloco: int):
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            linhas = workbook.active.iter_rows(values_only=True)
+            primeira = next(linhas, None)
+            if primeira is None:
+                return
+            # Células vazias no fim da linha não contam como coluna
+            colunas = len(primeira)
+            while colunas and primeira[colunas - 1] in (None, ''):
+                colunas -= 1
+            cls._verificar_colunas(colunas)
+            idx_chave, idx_nome = cls._localizar_colunas(primeira)
+            chaves, nomes = [], []
+            if idx_chave is None:
+                idx_chave, idx_nome = 0, 1
+                chaves.append(cls._texto(primeira[0]))
+                nomes.append(cls._texto(primeira[1]) if len(primeira) > 1 else '')
+            for linha in linhas:
+                chaves.append(cls._texto(linha[idx_chave]) if len(linha) > idx_chave else '')
+                nomes.append(cls._texto(linha[idx_nome]) if len(linha) > idx_nome else '')
+                if len(chaves) >= tamanho_bloco:
+                    yield chaves, nomes
+                    chaves, nomes = [], []
+            if chaves:
+                yield chaves, nomes
+        finally:
+            workbook.close()
+    
+    @classmethod
+    def _ler_parquet(cls, caminho: str, tamanho_bloco: int):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Importação de Parquet requer o pacote pyarrow (pip install pyarrow)")
+        
+        arquivo = pq.ParquetFile(caminho)
+        colunas = arquivo.schema_arrow.names
+        cls._verificar_colunas(len(colunas))
+        idx_chave, idx_nome = cls._localizar_colunas(colunas)
+        if idx_chave is None:
+            idx_chave, idx_nome = 0, 1
+        selecionadas = [colunas[idx_chave], colunas[idx_nome]]
+        for lote in arquivo.iter_batches(batch_size=tamanho_bloco, columns=selecionadas):
+            chaves = [cls._texto(v) for v in lote.column(0).to_pylist()]
+            nomes = [cls._texto(v) for v in lote.column(1).to_pylist()]
+            yield chaves, nomes
+
+class PadraoNomeArquivo:
+    """Padrão de nomes a partir do conteúdo do XML, ex.: NF{nNF:09} {emit_xNome} {xPed} {dhEmi:%d.%m.%Y}.
+    Lê o arquivo em blocos, só considera os elementos usados pelo padrão e para assim que todos são encontrados"""
+    
+    PADRAO_EXEMPLO = "NF{nNF:09} {emit_xNome} {xPed} {dhEmi:%d.%m.%Y}"
+    
+    # Campo -> caminhos (nomes locais a partir de infNFe); vale o primeiro encontrado no arquivo
+    CAMPOS = {
+        'nNF': [('ide', 'nNF')],
+        'serie': [('ide', 'serie')],
+        'mod': [('ide', 'mod')],
+        'tpNF': [('ide', 'tpNF')],
+        'natOp': [('ide', 'natOp')],
+        'dhEmi': [('ide', 'dhEmi'), ('ide', 'dEmi')],
+        'emit_xNome': [('emit', 'xNome')],
+        'emit_xFant': [('emit', 'xFant')],
+        'emit_CNPJ': [('emit', 'CNPJ'), ('emit', 'CPF')],
+        'emit_UF': [('emit', 'enderEmit', 'UF')],
+        'dest_xNome': [('dest', 'xNome')],
+        'dest_CNPJ': [('dest', 'CNPJ'), ('dest', 'CPF')],
+        'dest_UF': [('dest', 'enderDest', 'UF')],
+        'vNF': [('total', 'ICMSTot', 'vNF')],
+        'vProd': [('total', 'ICMSTot', 'vProd')],
+        'xPed': [('det', 'prod', 'xPed'), ('compra', 'xPed')],
+        'nItemPed': [('det', 'prod', 'nItemPed')],
+    }
+    CAMPO_CHAVE = 'chave'
+    
+    TAMANHO_LEITURA = 16384
+    MAX_TRABALHADORES = 8
+    
+    def __init__(self, padrao: str):
+        self.padrao = padrao
+        self.partes = []
+        for literal, campo, formato, _ in string.Formatter().parse(padrao):
+            if campo is not None and campo != self.CAMPO_CHAVE and campo not in self.CAMPOS:
+                raise ValueError(f"Campo desconhecido no padrão: {{{campo}}}")
+            self.partes.append((literal, campo, formato or ""))
+        self.campos = {campo for _, campo, _ in self.partes if campo}
+        
+        # Caminho -> campo, para consulta direta durante a leitura
+        self._caminhos = {}
+        for campo in self.campos - {self.CAMPO_CHAVE}:
+            for caminho in self.CAMPOS[campo]:
+                self._caminhos[caminho] = campo
+        
+        # O parser só emite eventos para estas tags (ide/cUF garante a leitura da chave em infNFe)
+        self._tags = sorted({'{*}' + caminho[-1] for caminho in self._caminhos} | {'{*}cUF'})
+    
+    def ler_campos(self, xml_path: str) -> Dict[str, str]:
+        """Ler a chave e os campos do padrão com um parser incremental, parando no último campo necessário"""
+        valores: Dict[str, str] = {}
+        pendentes = set(self.campos) | {self.CAMPO_CHAVE}
+        parser = etree.XMLPullParser(events=("end",), tag=self._tags, huge_tree=True)
+        
+        with open(xml_path, 'rb') as f:
+            while pendentes:
+                bloco = f.read(self.TAMANHO_LEITURA)
+                if not bloco:
+                    break
+                parser.feed(bloco)
+                for _, elemento in parser.read_events():
+                    # Caminho do elemento a partir de infNFe (os ancestrais já estão na árvore parcial)
+                    caminho = [elemento.tag.rpartition('}')[2]]
+                    ancestral = elemento.getparent()
+                    while ancestral is not None and not ancestral.tag.endswith('infNFe'):
+                        caminho.append(ancestral.tag.rpartition('}')[2])
+                        ancestral = ancestral.getparent()
+                    if ancestral is None:
+                        continue
+                    
+                    if self.CAMPO_CHAVE in pendentes:
+                        valores[self.CAMPO_CHAVE] = (ancestral.get('Id') or '').replace('NFe', '')
+                        pendentes.discard(self.CAMPO_CHAVE)
+                    
+                    campo = self._caminhos.get(tuple(reversed(caminho)))
+                    if campo in pendentes:
+                        valores[campo] = (elemento.text or '').strip()
+                        pendentes.discard(campo)
+                    if not pendentes:
+                        break
+        return valores
+    
+    @staticmethod
+    def _formatar(valor: str, formato: str) -> str:
+        if not formato or not valor:
+            return valor
+        try:
+            if '%' in formato:
+                return datetime.fromisoformat(valor).strftime(formato)
+            if valor.isdigit():
+                return format(int(valor), formato)
+            return format(float(valor), formato)
+        except ValueError:
+            return valor
+    
+    def aplicar(self, valores: Dict[str, str]) -> str:
+        """Montar o nome a partir dos valores lidos (campos ausentes ficam vazios)"""
+        nome = "".join(
+            literal + (self._formatar(valores.get(campo, ''), formato) if campo else '')
+            for literal, campo, formato in self.partes
+        )
+        return " ".join(nome.split())
+    
+    def gerar(self, xmls: List[str], progresso=None, max_trabalhadores: int = None):
+        """Ler os XMLs em paralelo e gerar (arquivo, chave, nome, erro) para cada um"""
+        def processar(xml_path):
+            try:
+                valores = self.ler_campos(xml_path)
+                return xml_path, valores.get(self.CAMPO_CHAVE, ''), self.aplicar(valores), None
+            except Exception as e:
+                return xml_path, '', '', e
+        
+        with ThreadPoolExecutor(max_workers=max_trabalhadores or self.MAX_TRABALHADORES) as pool:
+            for processados, resultado in enumerate(pool.map(processar, xmls), 1):
+                if progresso:
+                    progresso(processados, len(xmls))
+                yield resultado
+
+class IndiceBusca:
+    """Índice de trigramas sobre chave e nome das linhas do renomeador, construído de forma vetorizada"""
+    
+    # Cada entrada é um uint64: (trigrama << 32) | id da linha; ordenado, a busca é um searchsorted
+    BITS_LINHA = 32
+    # Caracteres distintos indexados; excedentes compartilham o último código (falsos candidatos são descartados na verificação)
+    TAMANHO_ALFABETO = 1024
+    # Acima disso os segmentos são fundidos em um único array ordenado
+    MAX_SEGMENTOS = 8
+    
+    def __init__(self):
+        self._alfabeto = np.zeros(0, dtype=np.uint16)
+        self._proximo_codigo = 1  # 0 é o separador entre textos
+        self._segmentos: List[np.ndarray] = []
+        self._textos: List[str] = []
+    
+    @staticmethod
+    def normalizar(chave: str, nome: str) -> str:
+        """Texto pesquisável da linha (a quebra de linha impede casar trechos entre chave e nome)"""
+        return f"{chave}\n{nome}".lower()
+    
+    def _codificar(self, codepoints: np.ndarray, registrar: bool) -> np.ndarray:
+        """Converter codepoints para códigos densos do alfabeto (0 para caracteres desconhecidos)"""
+        maior = int(codepoints.max()) if len(codepoints) else 0
+        if registrar:
+            if maior >= len(self._alfabeto):
+                alfabeto = np.zeros(maior + 1, dtype=np.uint16)
+                alfabeto[:len(self._alfabeto)] = self._alfabeto
+                self._alfabeto = alfabeto
+            novos = np.flatnonzero(np.bincount(codepoints, minlength=1))
+            novos = novos[(novos > 0) & (self._alfabeto[novos] == 0)]
+            for cp in novos.tolist():
+                self._alfabeto[cp] = min(self._proximo_codigo, self.TAMANHO_ALFABETO - 1)
+                self._proximo_codigo += 1
+        codigos = np.zeros(len(codepoints), dtype=np.uint64)
+        conhecidos = codepoints < len(self._alfabeto)
+        codigos[conhecidos] = self._alfabeto[codepoints[conhecidos]]
+        return codigos
+    
+    def _trigramas(self, texto: str, registrar: bool = False) -> np.ndarray:
+        """Códigos de trigramas de um texto (ou de vários textos unidos pelo separador)"""
+        codepoints = np.frombuffer(texto.encode('utf-32-le'), dtype=np.uint32)
+        codigos = self._codificar(codepoints, registrar)
+        if len(codigos) < 3:
+            return np.zeros(0, dtype=np.uint64)
+        c0, c1, c2 = codigos[:-2], codigos[1:-1], codigos[2:]
+        trigramas = (c0 << np.uint64(20)) | (c1 << np.uint64(10)) | c2
+        # Trigramas que atravessam o separador são marcados como inválidos
+        trigramas[(c0 == 0) | (c1 == 0) | (c2 == 0)] = np.uint64(0)
+        return trigramas
+    
+    def adicionar(self, ids, textos: List[str]):
+        """Indexar um lote de linhas (ids consecutivos a partir do último indexado)"""
+        ids = np.asarray(ids, dtype=np.uint64)
+        if not len(ids):
+            return
+        self._textos.extend(textos)
+        self._indexar(ids, textos)
+    
+    def atualizar(self, id_linha: int, texto: str):
+        """Reindexar uma linha editada (trigramas antigos viram falsos candidatos, descartados na verificação)"""
+        self._textos[id_linha] = texto
+        self._indexar(np.array([id_linha], dtype=np.uint64), [texto])
+    
+    def _indexar(self, ids: np.ndarray, textos: List[str]):
+        tamanhos = np.fromiter((len(t) + 1 for t in textos), dtype=np.int64, count=len(textos))
+        trigramas = self._trigramas("\x00".join(textos) + "\x00", registrar=True)
+        linhas = np.repeat(ids, tamanhos)[:len(trigramas)]
+        validos = trigramas != 0
+        entradas = np.sort((trigramas[validos] << np.uint64(self.BITS_LINHA)) | linhas[validos])
+        # Remover repetições do mesmo trigrama na mesma linha
+        if len(entradas):
+            entradas = entradas[np.concatenate(([True], entradas[1:] != entradas[:-1]))]
+        self._segmentos.append(entradas)
+        if len(self._segmentos) > self.MAX_SEGMENTOS:
+            self._segmentos = [np.sort(np.concatenate(self._segmentos))]
+    
+    def _linhas_com_trigrama(self, trigrama: int) -> np.ndarray:
+        inicio = np.uint64(trigrama << self.BITS_LINHA)
+        fim = np.uint64((trigrama + 1) << self.BITS_LINHA)
+        partes = [seg[np.searchsorted(seg, inicio):np.searchsorted(seg, fim)] for seg in self._segmentos]
+        if not partes:
+            return np.zeros(0, dtype=np.int64)
+        linhas = (np.concatenate(partes) & np.uint64((1 << self.BITS_LINHA) - 1)).astype(np.int64)
+        if len(partes) > 1:
+            # Uma linha editada pode aparecer em mais de um segmento
+            linhas = np.sort(linhas)
+            linhas = linhas[np.concatenate(([True], linhas[1:] != linhas[:-1]))] if len(linhas) else linhas
+        return linhas
+    
+    def buscar(self, consulta: str, candidatos: np.ndarray) -> np.ndarray:
+        """Ids (dentre os candidatos) cujo texto contém a consulta"""
+        consulta = consulta.lower()
+        if len(consulta) >= 3:
+            trigramas = self._trigramas(consulta)
+            if not trigramas.all():
+                # Algum caractere nunca foi indexado: nenhuma linha pode conter a consulta
+                return np.zeros(0, dtype=np.int64)
+            # Interseção começando pelas listas mais curtas
+            listas = sorted((self._linhas_com_trigrama(int(t)) for t in np.unique(trigramas)), key=len)
+            for linhas in listas:
+                candidatos = np.intersect1d(candidatos, linhas, assume_unique=True)
+                if not len(candidatos):
+                    break
+        textos = self._textos
+        return candidatos[[consulta in textos[i] for i in candidatos.tolist()]] if len(candidatos) else candidatos
+
+class TabelaRenomeacao:
+    """Tabela em memória do renomeador: armazenamento por colunas, indexado por chave e thread-safe"""
+    
+    COLUNAS = ['Chave Acesso NF', 'Nome Arq. NF', 'Status']
+    
+    # Códigos compactos de status (um byte por linha) para filtros e contagens vetorizados
+    STATUS_OUTRO = 0
+    STATUS_VALIDO = 1
+    STATUS_ERRO = 2
+    STATUS_PROCESSANDO = 3
+    STATUS_SUCESSO = 4
+    
+    def __init__(self, capacidade_inicial: int = 1024):
+        self._lock = threading.RLock()
+        self._capacidade_inicial = capacidade_inicial
+        # Incrementada sempre que chaves/nomes mudam (resultados de busca anteriores deixam de valer)
+        self.versao_texto = 0
+        self.limpar()
+    
+    def limpar(self):
+        """Remover todas as linhas"""
+        with self._lock:
+            self._n = 0
+            self._total_ativos = 0
+            self._chaves = np.empty(self._capacidade_inicial, dtype=object)
+            self._nomes = np.empty(self._capacidade_inicial, dtype=object)
+            self._status = np.empty(self._capacidade_inicial, dtype=object)
+            self._codigos = np.zeros(self._capacidade_inicial, dtype=np.uint8)
+            self._ativo = np.zeros(self._capacidade_inicial, dtype=bool)
+            self._indice_chave: Dict[str, List[int]] = {}
+            self._indice_busca = IndiceBusca()
+            self.versao_texto += 1
+    
+    @classmethod
+    def codigo_status(cls, status: str) -> int:
+        """Classificar o texto do status no código compacto"""
+        if "Válido" in status:
+            return cls.STATUS_VALIDO
+        elif "Erro" in status:
+            return cls.STATUS_ERRO
+        elif "Processando" in status:
+            return cls.STATUS_PROCESSANDO
+        elif "Sucesso" in status:
+            return cls.STATUS_SUCESSO
+        return cls.STATUS_OUTRO
+    
+    def _codigos_para(self, status) -> Any:
+        """Códigos de um status único ou de um array de status (classificando cada valor distinto uma vez)"""
+        if isinstance(status, str):
+            return self.codigo_status(status)
+        valores, inverso = np.unique(np.asarray(status, dtype=object).astype(str), return_inverse=True)
+        codigos = np.array([self.codigo_status(v) for v in valores], dtype=np.uint8)
+        return codigos[inverso]
+    
+    def _garantir_capacidade(self, extra: int):
+        necessario = self._n + extra
+        capacidade = len(self._chaves)
+        if necessario <= capacidade:
+            return
+        while capacidade < necessario:
+            capacidade *= 2
+        for nome in ('_chaves', '_nomes', '_status', '_codigos', '_ativo'):
+            antigo = getattr(self, nome)
+            novo = np.zeros(capacidade, dtype=antigo.dtype) if antigo.dtype != object else np.empty(capacidade, dtype=object)
+            novo[:self._n] = antigo[:self._n]
+            setattr(self, nome, novo)
+    
+    def __len__(self) -> int:
+        return self._total_ativos
+    
+    def adicionar(self, chaves, nomes, status) -> np.ndarray:
+        """Adicionar linhas em uma única operação; retorna os ids (estáveis) atribuídos"""
+        chaves = [str(c) for c in chaves]
+        nomes = [str(n) for n in nomes]
+        quantidade = len(chaves)
+        with self._lock:
+            self._garantir_capacidade(quantidade)
+            inicio, fim = self._n, self._n + quantidade
+            self._chaves[inicio:fim] = chaves
+            self._nomes[inicio:fim] = nomes
+            self._status[inicio:fim] = status
+            self._codigos[inicio:fim] = self._codigos_para(status)
+            self._ativo[inicio:fim] = True
+            for id_linha, chave in enumerate(chaves, inicio):
+                self._indice_chave.setdefault(chave, []).append(id_linha)
+            self._indice_busca.adicionar(
+                np.arange(inicio, fim),
+                [IndiceBusca.normalizar(chave, nome) for chave, nome in zip(chaves, nomes)]
+            )
+            self._n = fim
+            self.versao_texto += 1
+            self._total_ativos += quantidade
+            return np.arange(inicio, fim)
+    
+    def remover(self, ids):
+        """Remover linhas pelos ids"""
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        with self._lock:
+            ids = ids[self._ativo[ids]]
+            self._ativo[ids] = False
+            self._total_ativos -= len(ids)
+            for id_linha in ids.tolist():
+                self._desindexar(self._chaves[id_linha], id_linha)
+            self.versao_texto += 1
+    
+    def _desindexar(self, chave: str, id_linha: int):
+        ids_chave = self._indice_chave.get(chave)
+        if ids_chave is not None:
+            ids_chave.remove(id_linha)
+            if not ids_chave:
+                del self._indice_chave[chave]
+    
+    def editar(self, id_linha: int, chave: str, nome: str):
+        """Alterar chave e nome de uma linha mantendo o índice por chave"""
+        with self._lock:
+            chave_antiga = self._chaves[id_linha]
+            if chave_antiga != chave:
+                self._desindexar(chave_antiga, id_linha)
+                self._indice_chave.setdefault(chave, []).append(id_linha)
+                self._chaves[id_linha] = chave
+            self._nomes[id_linha] = nome
+            self._indice_busca.atualizar(id_linha, IndiceBusca.normalizar(chave, nome))
+            self.versao_texto += 1
+    
+    def definir_status(self, ids, status):
+        """Atualizar o status de uma ou várias linhas (status único ou um por linha)"""
+        with self._lock:
+            self._status[ids] = status
+            self._codigos[ids] = self._codigos_para(status)
+    
+    def ids_por_chave(self, chave: str) -> List[int]:
+        """Ids das linhas com a chave informada (busca O(1))"""
+        with self._lock:
+            return list(self._indice_chave.get(chave, ()))
+    
+    def ids_ativos(self) -> np.ndarray:
+        """Ids de todas as linhas, na ordem de inserção"""
+        with self._lock:
+            return np.flatnonzero(self._ativo[:self._n])
+    
+    def ids_com_status(self, codigo: int) -> np.ndarray:
+        """Ids das linhas cujo status tem o código informado"""
+        with self._lock:
+            return np.flatnonzero(self._ativo[:self._n] & (self._codigos[:self._n] == codigo))
+    
+    def filtrar_status(self, ids, codigo: int) -> np.ndarray:
+        """Manter, dentre os ids informados, apenas os que têm o código de status"""
+        with self._lock:
+            ids = np.asarray(ids, dtype=np.int64)
+            return ids[self._codigos[ids] == codigo]
+    
+    def buscar(self, texto: str, ids_base=None) -> np.ndarray:
+        """Ids das linhas cuja chave ou nome contém o texto (sem diferenciar maiúsculas)
+        
+        ids_base restringe a busca a um resultado anterior (refinamento incremental).
+        """
+        with self._lock:
+            if ids_base is None:
+                candidatos = np.flatnonzero(self._ativo[:self._n])
+            else:
+                candidatos = np.asarray(ids_base, dtype=np.int64)
+                candidatos = candidatos[self._ativo[candidatos]]
+            if not texto:
+                return candidatos
+            return self._indice_busca.buscar(texto, candidatos)
+    
+    def contar_status(self) -> Dict[int, int]:
+        """Quantidade de linhas por código de status"""
+        with self._lock:
+            contagem = np.bincount(self._codigos[:self._n][self._ativo[:self._n]], minlength=5)
+            return {codigo: int(qtd) for codigo, qtd in enumerate(contagem)}
+    
+    def linha(self, id_linha: int) -> tuple:
+        """Valores (chave, nome, status) de uma linha"""
+        with self._lock:
+            return (self._chaves[id_linha], self._nomes[id_linha], self._status[id_linha])
+    
+    def linhas(self, ids) -> List[tuple]:
+        """Valores (chave, nome, status) de várias linhas"""
+        with self._lock:
+            return list(zip(self._chaves[ids], self._nomes[ids], self._status[ids]))
+    
+    def chaves(self, ids) -> np.ndarray:
+        """Coluna de chaves das linhas informadas"""
+        with self._lock:
+            return self._chaves[ids].copy()
+    
+    def para_dataframe(self) -> pd.DataFrame:
+        """Cópia da tabela como DataFrame (para exportação)"""
+        with self._lock:
+            ids = np.flatnonzero(self._ativo[:self._n])
+            return pd.DataFrame({
+                'Chave Acesso NF': self._chaves[ids],
+                'Nome Arq. NF': self._nomes[ids],
+                'Status': self._status[ids]
+            }, index=ids, columns=self.COLUNAS)
+
+class TreeviewVirtual:
+    """Lista virtual sobre uma ttk.Treeview: materializa apenas as linhas visíveis (mais uma pequena margem)"""
+    
+    # Linhas extras materializadas além da área visível
+    MARGEM = 5
+    
+    def __init__(self, tree: ttk.Treeview, scrollbar: ttk.Scrollbar, obter_linhas, obter_tag, ao_mudar_selecao=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.obter_linhas = obter_linhas
+        self.obter_tag = obter_tag
+        self.ao_mudar_selecao = ao_mudar_selecao
+        
+        self.ids = np.empty(0, dtype=np.int64)
+        self.inicio = 0
+        self.selecionados = set()
+        self._ignorar_selecao = False
+        
+        self.scrollbar.configure(command=self._rolar)
+        self.tree.configure(yscrollcommand=lambda *args: None)
+        
+        self.tree.bind("<<TreeviewSelect>>", self._sincronizar_selecao, add="+")
+        self.tree.bind("<Button-1>", self._clique, add="+")
+        self.tree.bind("<Configure>", lambda e: self.renderizar(), add="+")
+        self.tree.bind("<MouseWheel>", self._roda_mouse)
+        self.tree.bind("<Button-4>", lambda e: self._rolar_linhas(-3))
+        self.tree.bind("<Button-5>", lambda e: self._rolar_linhas(3))
+        self.tree.bind("<Up>", lambda e: self._mover_foco(-1))
+        self.tree.bind("<Down>", lambda e: self._mover_foco(1))
+        self.tree.bind("<Prior>", lambda e: self._rolar_linhas(-self._linhas_visiveis()))
+        self.tree.bind("<Next>", lambda e: self._rolar_linhas(self._linhas_visiveis()))
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def definir_ids(self, ids):
+        """Definir o conjunto (ordenado) de linhas exibidas"""
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.selecionados.intersection_update(self.ids.tolist())
+        self.inicio = min(self.inicio, max(0, len(self.ids) - self._linhas_visiveis()))
+        self.renderizar()
+        self._notificar_selecao()
+    
+    def _linhas_visiveis(self) -> int:
+        """Quantidade de linhas que cabem na área visível da Treeview"""
+        try:
+            altura_linha = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        except (ValueError, tk.TclError):
+            altura_linha = 20
+        altura = self.tree.winfo_height()
+        if altura <= 1:
+            return int(self.tree.cget("height"))
+        return max(1, (altura - altura_linha) // altura_linha)
+    
+    def renderizar(self):
+        """Materializar a janela de linhas a partir de self.inicio"""
+        visiveis = self._linhas_visiveis()
+        janela = self.ids[self.inicio:self.inicio + visiveis + self.MARGEM]
+        
+        self._ignorar_selecao = True
+        try:
+            self.tree.delete(*self.tree.get_children())
+            for idx, (chave, nome, status) in zip(janela.tolist(), self.obter_linhas(janela)):
+                self.tree.insert("", "end", iid=str(idx), values=(chave, nome, status), tags=(self.obter_tag(status),))
+            self.tree.selection_set([str(idx) for idx in janela.tolist() if idx in self.selecionados])
+            self.tree.yview_moveto(0)
+        finally:
+            self.tree.after_idle(self._liberar_selecao)
+        
+        total = len(self.ids)
+        if total:
+            self.scrollbar.set(self.inicio / total, min(1.0, (self.inicio + visiveis) / total))
+        else:
+            self.scrollbar.set(0, 1)
+    
+    def _liberar_selecao(self):
+        self._ignorar_selecao = False
+    
+    def rolar_para(self, inicio: int):
+        """Posicionar a primeira linha visível"""
+        maximo = max(0, len(self.ids) - self._linhas_visiveis())
+        inicio = max(0, min(int(inicio), maximo))
+        if inicio != self.inicio:
+            self.inicio = inicio
+            self.renderizar()
+    
+    def _rolar(self, *args):
+        """Comando da scrollbar vertical ('moveto' fração ou 'scroll' n unidades/páginas)"""
+        if args[0] == "moveto":
+            self.rolar_para(float(args[1]) * len(self.ids))
+        elif args[0] == "scroll":
+            passo = int(args[1])
+            if args[2] == "pages":
+                passo *= self._linhas_visiveis()
+            self._rolar_linhas(passo)
+    
+    def _rolar_linhas(self, passo: int):
+        self.rolar_para(self.inicio + passo)
+        return "break"
+    
+    def _roda_mouse(self, event):
+        passo = -1 if event.delta > 0 else 1
+        # Windows informa múltiplos de 120, macOS valores pequenos
+        if abs(event.delta) >= 120:
+            passo *= abs(event.delta) // 120
+        return self._rolar_linhas(passo * 3)
+    
+    def _mover_foco(self, delta: int):
+        """Mover o foco/seleção com o teclado, rolando ao chegar na borda da janela"""
+        if not len(self.ids):
+            return "break"
+        
+        # Posição da linha em foco dentro do conjunto completo
+        posicao = None
+        foco = self.tree.focus()
+        if foco:
+            janela = self.ids[self.inicio:self.inicio + self._linhas_visiveis() + self.MARGEM]
+            encontrados = np.flatnonzero(janela == int(foco))
+            if len(encontrados):
+                posicao = self.inicio + int(encontrados[0])
+        
+        destino = self.inicio if posicao is None else max(0, min(posicao + delta, len(self.ids) - 1))
+        if destino < self.inicio:
+            self.rolar_para(destino)
+        elif destino >= self.inicio + self._linhas_visiveis():
+            self.rolar_para(destino - self._linhas_visiveis() + 1)
+        
+        idx = int(self.ids[destino])
+        self.selecionar([idx])
+        self.tree.focus(str(idx))
+        return "break"
+    
+    def _clique(self, event):
+        # Clique simples (sem Ctrl/Shift) descarta a seleção das linhas fora da janela
+        if not event.state & 0x0005:
+            self.selecionados.clear()
+    
+    def _sincronizar_selecao(self, event=None):
+        """Refletir no conjunto completo a seleção feita nas linhas materializadas"""
+        if self._ignorar_selecao:
+            return
+        exibidos = {int(iid) for iid in self.tree.get_children()}
+        selecionados_tree = {int(iid) for iid in self.tree.selection()}
+        self.selecionados.difference_update(exibidos - selecionados_tree)
+        self.selecionados.update(selecionados_tree)
+        self._notificar_selecao()
+    
+    def _notificar_selecao(self):
+        if self.ao_mudar_selecao:
+            self.ao_mudar_selecao(len(self.ids), len(self.selecionados))
+    
+    def selecionar(self, ids):
+        """Substituir a seleção pelos ids informados"""
+        self.selecionados = set(int(i) for i in ids)
+        self.renderizar()
+        self._notificar_selecao()
+    
+    def selecionar_todos(self):
+        """Selecionar todas as linhas do conjunto exibido"""
+        self.selecionar(self.ids.tolist())
+    
+    def ids_selecionados(self) -> List[int]:
+        """Ids selecionados, na ordem de exibição"""
+        return [idx for idx in self.ids.tolist() if idx in self.selecionados]
+
+class PlanoRenomeacao:
+    """Plano de renomeação verificado: um registro por arquivo (ou por linha sem arquivo)"""
+    
+    COLUNAS = ["Chave Acesso NF", "Nome Arq. NF", "Arquivo Atual", "Novo Nome", "Situação", "Ocorrências"]
+    
+    def __init__(self, pasta: str, registros: List[Dict[str, Any]]):
+        self.pasta = pasta
+        self.registros = registros
+    
+    @staticmethod
+    def situacao(registro: Dict[str, Any]) -> str:
+        ocorrencias = registro["ocorrencias"]
+        if any(o in PlanejadorRenomeacao.ERROS for o in ocorrencias):
+            return "Erro"
+        if any(o != PlanejadorRenomeacao.INALTERADO for o in ocorrencias):
+            return "Aviso"
+        return "OK"
+    
+    def operacoes(self) -> List[Dict[str, Any]]:
+        """Operações a executar (sem erros e com nome diferente do atual)"""
+        return [
+            {"id": r["id"], "chave": r["chave"], "origem": r["origem"], "destino": r["destino"]}
+            for r in self.registros
+            if r["destino"] and r["origem"] != r["destino"] and self.situacao(r) != "Erro"
+        ]
+    
+    def resumo(self) -> Dict[str, int]:
+        """Quantidade de registros por ocorrência"""
+        contagem: Dict[str, int] = {}
+        for registro in self.registros:
+            for ocorrencia in registro["ocorrencias"]:
+                contagem[ocorrencia] = contagem.get(ocorrencia, 0) + 1
+        return contagem
+    
+    def para_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            [
+                (r["chave"], r["nome"], r["origem"], r["destino"], self.situacao(r), "; ".join(r["ocorrencias"]))
+                for r in self.registros
+            ],
+            columns=self.COLUNAS
+        )
+    
+    def exportar(self, caminho: str):
+        """Exportar o plano (simulação, nada é renomeado) para CSV ou Excel"""
+        df = self.para_dataframe()
+        if caminho.lower().endswith(".csv"):
+            df.to_csv(caminho, sep=";", index=False, encoding="utf-8-sig")
+            return
+        
+        # Modo write_only do openpyxl: grava linha a linha, sem montar a planilha em memória
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        planilha = workbook.create_sheet("Plano Renomeação")
+        planilha.append(self.COLUNAS)
+        for linha in df.itertuples(index=False, name=None):
+            planilha.append(linha)
+        workbook.save(caminho)
+
+class PlanejadorRenomeacao:
+    """Pré-verificação da renomeação: monta o plano completo origem -> destino com buscas
+    em dicionários e conjuntos, apontando chaves duplicadas, arquivos ausentes, colisões
+    de nomes e caracteres inválidos antes que qualquer arquivo seja tocado"""
+    
+    CARACTERES_INVALIDOS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+    SEQUENCIA_DIGITOS = re.compile(r"\d{44,}")
+    NOMES_RESERVADOS = {"CON", "PRN", "AUX", "NUL"} | {f"{p}{n}" for p in ("COM", "LPT") for n in range(1, 10)}
+    TAMANHO_MAXIMO = 255
+    
+    # Ocorrências que impedem a renomeação
+    DUPLICADA = "Chave duplicada na lista"
+    NAO_ENCONTRADO = "Arquivo não encontrado"
+    ARQUIVO_COMPARTILHADO = "Arquivo já associado a outra chave"
+    ERROS = (DUPLICADA, NAO_ENCONTRADO, ARQUIVO_COMPARTILHADO)
+    
+    # Ocorrências corrigidas automaticamente
+    INVALIDO = "Caracteres inválidos removidos"
+    RESERVADO = "Nome reservado do Windows"
+    NOME_VAZIO = "Nome vazio (usado NF_<chave>)"
+    TRUNCADO = "Nome truncado"
+    COLISAO = "Nome repetido na lista"
+    EXISTENTE = "Nome já existe na pasta"
+    INALTERADO = "Arquivo já tem o nome final"
+    
+    def __init__(self, pasta: str, arquivos_pasta: List[str] = None, arquivos_por_chave: Dict[str, str] = None):
+        self.pasta = pasta
+        self.arquivos = arquivos_pasta if arquivos_pasta is not None else os.listdir(pasta)
+        self._por_chave = self._indexar(self.arquivos)
+        
+        # Arquivos associados pelo conteúdo (XMLs cujo nome não traz a chave)
+        if arquivos_por_chave:
+            existentes = set(self.arquivos)
+            for chave, arquivo in arquivos_por_chave.items():
+                lista = self._por_chave.setdefault(chave, [])
+                if arquivo in existentes and arquivo not in lista:
+                    lista.append(arquivo)
+    
+    @classmethod
+    def _indexar(cls, arquivos: List[str]) -> Dict[str, List[str]]:
+        """Índice chave -> arquivos, a partir das sequências de 44+ dígitos de cada nome"""
+        por_chave: Dict[str, List[str]] = {}
+        for arquivo in arquivos:
+            for sequencia in cls.SEQUENCIA_DIGITOS.findall(arquivo):
+                for inicio in range(len(sequencia) - 43):
+                    lista = por_chave.setdefault(sequencia[inicio:inicio + 44], [])
+                    if not lista or lista[-1] != arquivo:
+                        lista.append(arquivo)
+        return por_chave
+    
+    @classmethod
+    def limpar_nome(cls, nome: str, chave: str):
+        """Nome de arquivo seguro para o sistema de arquivos e as correções aplicadas"""
+        nome = (nome or "").strip()
+        limpo = cls.CARACTERES_INVALIDOS.sub("", nome).strip().rstrip(". ")
+        ocorrencias = []
+        if limpo != nome:
+            ocorrencias.append(cls.INVALIDO)
+        if not limpo:
+            limpo = f"NF_{chave}"
+            ocorrencias.append(cls.NOME_VAZIO)
+        elif limpo.split(".")[0].upper() in cls.NOMES_RESERVADOS:
+            limpo = f"_{limpo}"
+            ocorrencias.append(cls.RESERVADO)
+        return limpo, ocorrencias
+    
+    def planejar(self, ids, chaves, nomes) -> PlanoRenomeacao:
+        """Montar o plano para as linhas informadas (na ordem da tabela)"""
+        registros = []
+        chaves_vistas = set()
+        origens_usadas = set()
+        existentes = {arquivo.casefold() for arquivo in self.arquivos}
+        reservados = set()
+        
+        for idx, chave, nome in zip(ids, chaves, nomes):
+            registro = {"id": idx, "chave": chave, "nome": nome, "origem": "", "destino": "", "ocorrencias": []}
+            
+            if chave in chaves_vistas:
+                registro["ocorrencias"].append(self.DUPLICADA)
+                registros.append(registro)
+                continue
+            chaves_vistas.add(chave)
+            
+            arquivos = self._por_chave.get(chave)
+            if not arquivos:
+                registro["ocorrencias"].append(self.NAO_ENCONTRADO)
+                registros.append(registro)
+                continue
+            
+            base, correcoes = self.limpar_nome(nome, chave)
+            
+            # Todos os arquivos da chave (XML, PDF...) recebem o mesmo nome, cada um com sua extensão
+            for origem in arquivos:
+                extensao = os.path.splitext(origem)[1]
+                ocorrencias = list(correcoes)
+                registro_arquivo = dict(registro, origem=origem, ocorrencias=ocorrencias)
+                registros.append(registro_arquivo)
+                
+                if origem in origens_usadas:
+                    ocorrencias.append(self.ARQUIVO_COMPARTILHADO)
+                    continue
+                origens_usadas.add(origem)
+                
+                limite = self.TAMANHO_MAXIMO - len(extensao) - 6  # espaço para o contador " (99)"
+                nome_base = base
+                if len(nome_base) > limite:
+                    nome_base = nome_base[:limite].rstrip(". ")
+                    ocorrencias.append(self.TRUNCADO)
+                
+                destino = f"{nome_base}{extensao}"
+                if destino == origem:
+                    ocorrencias.append(self.INALTERADO)
+                    registro_arquivo["destino"] = destino
+                    reservados.add(destino.casefold())
+                    continue
+                
+                if destino.casefold() in reservados:
+                    ocorrencias.append(self.COLISAO)
+                elif destino.casefold() in existentes:
+                    ocorrencias.append(self.EXISTENTE)
+                
+                contador = 1
+                while destino.casefold() in reservados or destino.casefold() in existentes:
+                    destino = f"{nome_base} ({contador}){extensao}"
+                    contador += 1
+                reservados.add(destino.casefold())
+                registro_arquivo["destino"] = destino
+        
+        return PlanoRenomeacao(self.pasta, registros)
+
+class ExecutorRenomeacao:
+    """Execução concorrente de renomeações com pool limitado de threads. Em compartilhamentos
+    de rede (SMB) cada rename é uma ida e volta ao servidor; algumas em paralelo escondem a latência"""
+    
+    MAX_TRABALHADORES = 16
+    LIMITE_POR_PASTA = 4
+    
+    # Operações em voo por trabalhador (evita criar um Future por linha do plano de uma vez)
+    FATOR_JANELA = 4
+    
+    def __init__(self, max_trabalhadores: int = None, limite_por_pasta: int = None, limites_pastas: Dict[str, int] = None):
+        self.max_trabalhadores = max(1, max_trabalhadores or self.MAX_TRABALHADORES)
+        self.limite_por_pasta = max(1, limite_por_pasta or self.LIMITE_POR_PASTA)
+        self.limites_pastas = {os.path.normcase(os.path.abspath(p)): max(1, int(n)) for p, n in (limites_pastas or {}).items()}
+        self._semaforos: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+    
+    def limite(self, pasta: str) -> int:
+        """Concorrência máxima na pasta de destino"""
+        return self.limites_pastas.get(os.path.normcase(os.path.abspath(pasta)), self.limite_por_pasta)
+    
+    def _semaforo(self, pasta: str) -> threading.BoundedSemaphore:
+        chave = os.path.normcase(os.path.abspath(pasta))
+        with self._lock:
+            if chave not in self._semaforos:
+                self._semaforos[chave] = threading.BoundedSemaphore(self.limite(pasta))
+            return self._semaforos[chave]
+    
+    def mapear(self, funcao, itens, pasta_de):
+        """Aplicar funcao(item) em paralelo, respeitando o limite da pasta de cada item.
+        Gera (item, resultado, erro) na ordem de conclusão, na thread de quem consome"""
+        itens = iter(itens)
+        trabalhadores = self.max_trabalhadores
+        
+        def tarefa(item):
+            with self._semaforo(pasta_de(item)):
+                return funcao(item)
+        
+        with ThreadPoolExecutor(max_workers=trabalhadores) as pool:
+            em_voo = {}
+            while True:
+                while len(em_voo) < trabalhadores * self.FATOR_JANELA:
+                    item = next(itens, None)
+                    if item is None:
+                        break
+                    em_voo[pool.submit(tarefa, item)] = item
+                if not em_voo:
+                    break
+                
+                concluidos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    item = em_voo.pop(futuro)
+                    erro = futuro.exception()
+                    yield item, (None if erro else futuro.result()), erro
+
+class DiarioRenomeacao:
+    """Diário (journal) de uma renomeação em lote: o plano é gravado em disco antes da execução,
+    permitindo retomar ou reverter após uma interrupção e desfazer a operação concluída"""
+    
+    NOME_ARQUIVO = ".nfe_renomeador_diario.jsonl"
+    
+    # Confirmações de operações concluídas são sincronizadas em lote; após uma queda,
+    # o estado real é reconciliado com o sistema de arquivos
+    INTERVALO_SYNC = 0.5
+    
+    FEITA = "feita"
+    PENDENTE = "pendente"
+    CONFLITO = "conflito"
+    
+    def __init__(self, pasta: str):
+        self.pasta = pasta
+        self.caminho = os.path.join(pasta, self.NOME_ARQUIVO)
+        self.operacoes: List[Dict[str, Any]] = []
+        self.concluidas = set()
+        self.desfeitas = set()
+        self.criado = ""
+        self.finalizado = False
+        self.desfeito = False
+        self._arquivo = None
+        self._ultimo_sync = 0.0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def carregar(cls, pasta: str):
+        """Ler o diário existente na pasta (None se não houver)"""
+        diario = cls(pasta)
+        if not os.path.exists(diario.caminho):
+            return None
+        with open(diario.caminho, "r", encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    # Última linha truncada por uma queda durante a gravação
+                    continue
+                tipo = registro.get("tipo")
+                if tipo == "plano":
+                    diario.criado = registro.get("criado", "")
+                elif tipo == "op":
+                    diario.operacoes.append(registro)
+                elif tipo == "ok":
+                    diario.concluidas.add(registro["seq"])
+                elif tipo == "desfeita":
+                    diario.desfeitas.add(registro["seq"])
+                elif tipo == "fim":
+                    diario.finalizado = True
+                elif tipo == "desfeito":
+                    diario.desfeito = True
+        return diario
+    
+    @property
+    def interrompido(self) -> bool:
+        """Renomeação iniciada e não concluída nem revertida"""
+        return bool(self.operacoes) and not self.finalizado and not self.desfeito
     
-    def _formatar_cep(self, cep: str) -> str:
-        """Formatar CEP"""
-        if not cep:
-            return ''
-        cep = ''.join(filter(str.isdigit, cep))
-        if len(cep) == 8:
-            return f"{cep[:5]}-{cep[5:]}"
-        return cep
+    @property
+    def pode_desfazer(self) -> bool:
+        return self.finalizado and not self.desfeito and bool(self.concluidas)
     
-    def _formatar_valor(self, valor: str) -> str:
-        """Formatar valor monetário"""
-        if not valor:
-            return '0,00'
-        try:
-            num = float(valor.replace(',', '.'))
-            return f"{num:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        except:
-            return valor
+    def _caminho(self, nome: str) -> str:
+        return os.path.join(self.pasta, nome)
     
-    def _formatar_quantidade(self, qtd: str) -> str:
-        """Formatar quantidade"""
-        if not qtd:
-            return '0,0000'
-        try:
-            num = float(qtd.replace(',', '.'))
-            return f"{num:,.4f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        except:
-            return qtd
+    def _gravar(self, registro: Dict[str, Any], sincronizar: bool = False):
+        with self._lock:
+            self._arquivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            agora = time.monotonic()
+            if sincronizar or agora - self._ultimo_sync >= self.INTERVALO_SYNC:
+                self._arquivo.flush()
+                os.fsync(self._arquivo.fileno())
+                self._ultimo_sync = agora
     
-    def _formatar_porcentagem(self, perc: str) -> str:
-        """Formatar porcentagem"""
-        if not perc:
-            return '0,00'
-        try:
-            num = float(perc.replace(',', '.'))
-            return f"{num:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-        except:
-            return perc
+    def _abrir(self):
+        if self._arquivo is None:
+            self._arquivo = open(self.caminho, "a", encoding="utf-8")
     
-    def _formatar_data(self, data: str) -> str:
-        """Formatar data"""
-        if not data:
-            return ''
-        try:
-            # Se vier no formato AAAA-MM-DD
-            if len(data) >= 10 and '-' in data:
-                partes = data[:10].split('-')
-                return f"{partes[2]}/{partes[1]}/{partes[0]}"
-            return data
-        except:
-            return data
+    def fechar(self):
+        if self._arquivo is not None:
+            self._arquivo.flush()
+            os.fsync(self._arquivo.fileno())
+            self._arquivo.close()
+            self._arquivo = None
+    
+    def gravar_plano(self, operacoes: List[Dict[str, Any]]):
+        """Gravar o plano completo (origem -> destino) e sincronizar com o disco antes de executar"""
+        self.operacoes = [dict(op, seq=seq) for seq, op in enumerate(operacoes)]
+        self.concluidas = set()
+        self.desfeitas = set()
+        self.finalizado = self.desfeito = False
+        self.criado = datetime.now().isoformat(timespec="seconds")
+        
+        # O plano é escrito num arquivo temporário e trocado atomicamente pelo anterior
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"tipo": "plano", "criado": self.criado, "total": len(self.operacoes)}) + "\n")
+            for op in self.operacoes:
+                f.write(json.dumps(dict(op, tipo="op"), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, self.caminho)
+        self._abrir()
+    
+    def estado(self, op: Dict[str, Any]) -> str:
+        """Estado real de uma operação, conferido no sistema de arquivos"""
+        origem_existe = os.path.exists(self._caminho(op["origem"]))
+        destino_existe = os.path.exists(self._caminho(op["destino"]))
+        if destino_existe and not origem_existe:
+            return self.FEITA
+        if origem_existe and not destino_existe:
+            return self.PENDENTE
+        return self.CONFLITO
+    
+    def _renomear(self, origem: str, destino: str):
+        # Renomeação na mesma pasta: os.rename é atômico, mas no POSIX sobrescreve o destino
+        if os.path.exists(self._caminho(destino)):
+            raise FileExistsError(f"Destino já existe: {destino}")
+        os.rename(self._caminho(origem), self._caminho(destino))
+    
+    def _pasta_destino(self, op: Dict[str, Any]) -> str:
+        return os.path.dirname(self._caminho(op["destino"]))
+    
+    def _aplicar(self, op: Dict[str, Any], somente_pendentes: bool):
+        """Executar uma operação (roda nas threads do executor)"""
+        if somente_pendentes and self.estado(op) == self.FEITA:
+            # Renomeada antes da interrupção, mas sem confirmação gravada
+            return
+        self._renomear(op["origem"], op["destino"])
+    
+    def _reverter(self, op: Dict[str, Any]) -> bool:
+        """Reverter uma operação; False se não havia o que desfazer"""
+        if self.estado(op) != self.FEITA:
+            # Não chegou a ser renomeada (ou foi alterada depois): nada a desfazer
+            return False
+        self._renomear(op["destino"], op["origem"])
+        return True
+    
+    def executar(self, ao_concluir=None, somente_pendentes: bool = False, executor: "ExecutorRenomeacao" = None):
+        """Executar as operações do plano, registrando cada conclusão.
+        ao_concluir(op, erro) é chamado após cada operação (erro=None em caso de sucesso).
+        Os destinos do plano são distintos entre si e de todos os arquivos existentes,
+        então as operações são independentes e podem rodar em paralelo"""
+        executor = executor or ExecutorRenomeacao()
+        self._abrir()
+        pendentes = [op for op in self.operacoes if op["seq"] not in self.concluidas]
+        resultados = executor.mapear(lambda op: self._aplicar(op, somente_pendentes), pendentes, self._pasta_destino)
+        for op, _, erro in resultados:
+            if erro is None:
+                self.concluidas.add(op["seq"])
+                self._gravar({"tipo": "ok", "seq": op["seq"]})
+            if ao_concluir:
+                ao_concluir(op, erro)
+        
+        self.finalizado = True
+        self._gravar({"tipo": "fim"}, sincronizar=True)
+        self.fechar()
+    
+    def retomar(self, ao_concluir=None, executor: "ExecutorRenomeacao" = None):
+        """Concluir (roll forward) uma renomeação interrompida"""
+        self.executar(ao_concluir, somente_pendentes=True, executor=executor)
+    
+    def desfazer(self, ao_concluir=None):
+        """Reverter as operações realizadas, uma por vez e em ordem estritamente inversa à do diário
+        (serve tanto para o desfazer quanto para o roll back de uma renomeação interrompida).
+        
+        Ao contrário de executar(), o desfazer não usa o ExecutorRenomeacao: entre o plano e o
+        desfazer os arquivos podem ter mudado, e quando o destino de uma operação é a origem de
+        outra (troca de nomes, renomeações em cadeia) só a reprodução sequencial do fim para o
+        começo devolve cada arquivo ao nome original sem colisões"""
+        self._abrir()
+        for op in reversed(self.operacoes):
+            if op["seq"] in self.desfeitas:
+                continue
+            try:
+                revertida, erro = self._reverter(op), None
+            except Exception as e:
+                revertida, erro = False, e
+            if erro is None and not revertida:
+                continue
+            if erro is None:
+                self.desfeitas.add(op["seq"])
+                self._gravar({"tipo": "desfeita", "seq": op["seq"]})
+            if ao_concluir:
+                ao_concluir(op, erro)
+        
+        self.desfeito = True
+        self._gravar({"tipo": "desfeito"}, sincronizar=True)
+        self.fechar()
 
 class NFeStudioPro(ctk.CTk):
     """NFe Studio Pro - Suite Completa para Processamento de Notas Fiscais Eletrônicas"""
     
+    # Intervalo entre atualizações da Treeview durante a renomeação
+    INTERVALO_ATUALIZACAO_RENAME_MS = 250
+    # Espera após a última tecla antes de aplicar o filtro de texto
+    ATRASO_FILTRO_RENAME_MS = 200
+    
     def __init__(self):
         super().__init__()
         
@@ -592,6 +3588,16 @@ class NFeStudioPro(ctk.CTk):
         self.pasta_xmls_var = tk.StringVar()
         self.pasta_saida_var = tk.StringVar()
         self.template_var = tk.StringVar()
+        self.gerar_pdf_var = tk.BooleanVar(value=True)
+        self.exportar_parquet_var = tk.BooleanVar(value=False)
+        self.processos_var = tk.StringVar(value=str(max(1, (os.cpu_count() or 2) - 1)))
+        self.reciclar_docs_var = tk.StringVar(value=str(PoolRenderizacao.DOCUMENTOS_POR_PROCESSO))
+        self.limite_memoria_var = tk.StringVar(value=str(PoolRenderizacao.LIMITE_MEMORIA_MB))
+        self.tempo_limite_var = tk.StringVar(value=str(PoolRenderizacao.TEMPO_LIMITE_S))
+        self.fatia_var = tk.StringVar()
+        self.compressao_pdf_var = tk.StringVar(value=ProcessadorMassa.COMPRESSAO_PADRAO)
+        self.subconjunto_fontes_var = tk.BooleanVar(value=True)
+        self.pdfa_var = tk.StringVar(value="Não")
         
         # Estado do processamento do conversor
         self.processando = False
@@ -602,13 +3608,25 @@ class NFeStudioPro(ctk.CTk):
         self.processador = ProcessadorMassa()
         
         # === VARIÁVEIS DO RENOMEADOR ===
-        self.dados_df = pd.DataFrame(columns=['Chave Acesso NF', 'Nome Arq. NF', 'Status'])
+        self.tabela_rename = TabelaRenomeacao()
         self.selected_folder_rename = tk.StringVar()
         self.filtro_var_rename = tk.StringVar()
         self.status_filtro_ativo = ""
+        self._filtro_agendado = None
+        self._resultado_filtro_texto = None  # (versão da tabela, texto, ids) da última busca
+        self.limite_padrao_rename = ExecutorRenomeacao.LIMITE_POR_PASTA
+        self.limites_pasta_rename: Dict[str, int] = {}  # renomeações simultâneas por pasta
+        self.padrao_nome_var_rename = tk.StringVar(value=PadraoNomeArquivo.PADRAO_EXEMPLO)
+        self.arquivos_xml_rename: Dict[str, Dict[str, str]] = {}  # pasta -> chave -> XML lido pelo padrão de nomes
         self.filtro_var_rename.trace('w', self.aplicar_filtro_rename)
         self.status_var_rename = tk.StringVar(value="Pronto para processar arquivos")
         
+        # Atualizações da renomeação acumuladas pela thread e aplicadas em lote
+        self.renomeacao_thread = None
+        self._rename_lock = threading.Lock()
+        self._rename_status_pendente = {}
+        self._rename_logs_pendentes = []
+        
         # Configurar interface
         self.setup_ui()
         
@@ -684,6 +3702,33 @@ class NFeStudioPro(ctk.CTk):
         )
         self.btn_adicionar_dados.pack(side="left", padx=5)
         
+        self.btn_importar_dados = ctk.CTkButton(
+            buttons_frame, 
+            text="📥 Importar Arquivo", 
+            command=self.importar_arquivo_rename,
+            width=140, height=35,
+            fg_color="#2196F3"
+        )
+        self.btn_importar_dados.pack(side="left", padx=5)
+        
+        self.btn_padrao_nome = ctk.CTkButton(
+            buttons_frame, 
+            text="🧩 Nomes do XML", 
+            command=self.gerar_nomes_por_padrao_rename,
+            width=140, height=35,
+            fg_color="#2196F3"
+        )
+        self.btn_padrao_nome.pack(side="left", padx=5)
+        
+        self.btn_catalogo = ctk.CTkButton(
+            buttons_frame, 
+            text="🗂️ Catálogo", 
+            command=self.consultar_catalogo_rename,
+            width=140, height=35,
+            fg_color="#2196F3"
+        )
+        self.btn_catalogo.pack(side="left", padx=5)
+        
         # Separador visual
         separator2 = ctk.CTkLabel(buttons_frame, text="|", text_color="gray")
         separator2.pack(side="left", padx=5)
@@ -711,6 +3756,15 @@ class NFeStudioPro(ctk.CTk):
         )
         self.btn_renomear.pack(side="left", padx=5)
         
+        self.btn_desfazer = ctk.CTkButton(
+            buttons_frame, 
+            text="↩️ Desfazer", 
+            command=self.desfazer_renomeacao,
+            width=140, height=35,
+            fg_color="#607D8B"
+        )
+        self.btn_desfazer.pack(side="left", padx=5)
+        
         # Separador visual
         separator4 = ctk.CTkLabel(buttons_frame, text="|", text_color="gray")
         separator4.pack(side="left", padx=5)
@@ -758,7 +3812,6 @@ class NFeStudioPro(ctk.CTk):
             textvariable=self.filtro_var_rename
         )
         self.filter_entry.pack(side="left", padx=5, pady=10)
-        self.filter_entry.bind('<KeyRelease>', self.aplicar_filtro_rename)
         
         # Filtros por status
         status_frame = ctk.CTkFrame(filter_frame, fg_color="transparent")
@@ -790,6 +3843,20 @@ class NFeStudioPro(ctk.CTk):
             width=130, height=32
         )
         self.btn_selecionar_todos.pack(side="right", padx=5)
+        
+        # Renomeações simultâneas na pasta (em compartilhamentos de rede, mais de uma esconde a latência)
+        self.paralelismo_var_rename = tk.StringVar(value=str(ExecutorRenomeacao.LIMITE_POR_PASTA))
+        self.paralelismo_menu = ctk.CTkOptionMenu(
+            actions_frame,
+            values=["1", "2", "4", "8", "16"],
+            variable=self.paralelismo_var_rename,
+            command=self.alterar_paralelismo_rename,
+            width=70, height=32
+        )
+        self.paralelismo_menu.pack(side="right", padx=5)
+        
+        paralelismo_label = ctk.CTkLabel(actions_frame, text="⚡ Paralelismo:", font=ctk.CTkFont(size=12))
+        paralelismo_label.pack(side="right", padx=(10, 0))
     
     def create_renomeador_data_frame(self):
         """Criar frame principal com a tabela de dados"""
@@ -814,10 +3881,19 @@ class NFeStudioPro(ctk.CTk):
         self.tree.column("Status", width=120, minwidth=100)
         
         # Scrollbars para a tabela
-        v_scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
+        v_scrollbar = ttk.Scrollbar(table_frame, orient="vertical")
         h_scrollbar = ttk.Scrollbar(table_frame, orient="horizontal", command=self.tree.xview)
         
-        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        
+        # Lista virtual: só as linhas visíveis existem na Treeview; a scrollbar vertical percorre a tabela inteira
+        self.tree_virtual = TreeviewVirtual(
+            self.tree,
+            v_scrollbar,
+            obter_linhas=self.tabela_rename.linhas,
+            obter_tag=self._tag_status_rename,
+            ao_mudar_selecao=self.atualizar_selecao_rename
+        )
         
         # Pack da treeview e scrollbars
         self.tree.pack(side="left", fill="both", expand=True)
@@ -1115,11 +4191,78 @@ class NFeStudioPro(ctk.CTk):
         self.create_input_field(
             fields_container,
             "🎨 Template HTML",
-            "Arquivo de template para geração da DANFE...",
+            "Template HTML da DANFE ou arquivo .json com regras de templates...",
             self.template_var,
             self.select_template_file,
             "Procurar"
         )
+        
+        # Saídas da conversão
+        saidas_frame = ctk.CTkFrame(fields_container, fg_color="transparent")
+        saidas_frame.pack(fill="x", pady=(10, 0))
+        
+        ctk.CTkCheckBox(
+            saidas_frame,
+            text="🖨️ Gerar PDFs (DANFE)",
+            variable=self.gerar_pdf_var,
+            font=ctk.CTkFont(size=13)
+        ).pack(side="left", padx=(0, 20))
+        
+        ctk.CTkCheckBox(
+            saidas_frame,
+            text="📦 Exportar dados em Parquet (notas e itens)",
+            variable=self.exportar_parquet_var,
+            font=ctk.CTkFont(size=13)
+        ).pack(side="left")
+        
+        # Fatia i/N: várias máquinas convertendo a mesma pasta compartilhada, sem coordenação
+        ctk.CTkEntry(
+            saidas_frame,
+            textvariable=self.fatia_var,
+            width=70, height=28
+        ).pack(side="right")
+        ctk.CTkLabel(saidas_frame, text="🧩 Fatia (i/N):", font=ctk.CTkFont(size=12)).pack(side="right", padx=(0, 5))
+        
+        # Processos de conversão e reciclagem (limita a memória em lotes longos)
+        desempenho_frame = ctk.CTkFrame(fields_container, fg_color="transparent")
+        desempenho_frame.pack(fill="x", pady=(10, 0))
+        
+        for texto, variavel, valores in (
+            ("⚡ Processos:", self.processos_var, ["1", "2", "4", "8", "16"]),
+            ("♻️ Reciclar a cada (docs):", self.reciclar_docs_var, ["100", "250", "500", "1000", "5000"]),
+            ("💾 Memória máx. por processo (MB):", self.limite_memoria_var, ["512", "1024", "2048", "4096"]),
+            ("⏱️ Tempo máx. por XML (s):", self.tempo_limite_var, ["30", "60", "120", "300", "600"]),
+        ):
+            ctk.CTkLabel(desempenho_frame, text=texto, font=ctk.CTkFont(size=12)).pack(side="left", padx=(0, 5))
+            ctk.CTkOptionMenu(
+                desempenho_frame,
+                values=valores,
+                variable=variavel,
+                width=80, height=28
+            ).pack(side="left", padx=(0, 20))
+        
+        # Tamanho dos PDFs: compressão, subconjunto das fontes e PDF/A
+        tamanho_pdf_frame = ctk.CTkFrame(fields_container, fg_color="transparent")
+        tamanho_pdf_frame.pack(fill="x", pady=(10, 0))
+        
+        for texto, variavel, valores in (
+            ("🗜️ Compressão dos PDFs:", self.compressao_pdf_var, list(ProcessadorMassa.NIVEIS_COMPRESSAO)),
+            ("🗄️ PDF/A:", self.pdfa_var, ["Não"] + list(ProcessadorMassa.PERFIS_PDFA)),
+        ):
+            ctk.CTkLabel(tamanho_pdf_frame, text=texto, font=ctk.CTkFont(size=12)).pack(side="left", padx=(0, 5))
+            ctk.CTkOptionMenu(
+                tamanho_pdf_frame,
+                values=valores,
+                variable=variavel,
+                width=110, height=28
+            ).pack(side="left", padx=(0, 20))
+        
+        ctk.CTkCheckBox(
+            tamanho_pdf_frame,
+            text="🔤 Incorporar só os caracteres usados das fontes",
+            variable=self.subconjunto_fontes_var,
+            font=ctk.CTkFont(size=12)
+        ).pack(side="left")
     
     def create_input_field(self, parent, label, placeholder, variable, command, btn_text):
         """Criar campo de entrada moderno"""
@@ -1196,6 +4339,20 @@ class NFeStudioPro(ctk.CTk):
         )
         self.start_btn.pack(side="left", padx=(0, 10), expand=True, fill="x")
         
+        # Botão Inventário (só cabeçalhos, sem gerar PDFs)
+        self.inventario_btn = ctk.CTkButton(
+            buttons_container,
+            text="📋 Inventário",
+            command=self.iniciar_inventario,
+            height=55,
+            font=ctk.CTkFont(size=16, weight="bold"),
+            fg_color=("#3498DB", "#2980B9"),
+            hover_color=("#2E86C1", "#21618C"),
+            corner_radius=12,
+            width=160
+        )
+        self.inventario_btn.pack(side="left", padx=(0, 10))
+        
         # Botão Parar
         self.stop_btn = ctk.CTkButton(
             buttons_container,
@@ -1300,7 +4457,7 @@ class NFeStudioPro(ctk.CTk):
         """Selecionar arquivo de template"""
         file_path = filedialog.askopenfilename(
             title="Selecionar template HTML",
-            filetypes=[("HTML files", "*.html"), ("All files", "*.*")]
+            filetypes=[("HTML files", "*.html"), ("Regras de template", "*.json"), ("All files", "*.*")]
         )
         if file_path:
             self.template_var.set(file_path)
@@ -1347,43 +4504,104 @@ class NFeStudioPro(ctk.CTk):
             messagebox.showerror("Erro", "Pasta de XMLs não existe!")
             return
         
-        if not os.path.exists(self.template_var.get()):
+        if not self.gerar_pdf_var.get() and not self.exportar_parquet_var.get():
+            messagebox.showerror("Erro", "Selecione ao menos uma saída: PDFs ou Parquet!")
+            return
+        
+        if self.gerar_pdf_var.get() and not os.path.exists(self.template_var.get()):
             messagebox.showerror("Erro", "Template HTML não encontrado!")
             return
         
+        if not self._definir_fatia():
+            return
+        
         # Descobrir XMLs
         xmls = self.processador.descobrir_xmls(self.pasta_xmls_var.get())
         if not xmls:
             messagebox.showerror("Erro", "Nenhum XML encontrado na pasta!")
             return
         
+        # Calibrar a estimativa com uma amostra do lote (em segundo plano) antes de confirmar
+        self.start_btn.configure(state="disabled")
+        self.inventario_btn.configure(state="disabled")
+        self.add_message(f"📐 Calibrando a estimativa de tempo com uma amostra de {min(len(xmls), PlanejadorCapacidade.TAMANHO_AMOSTRA)} XMLs...")
+        thread = threading.Thread(target=self._calibrar_processamento, args=(xmls,), daemon=True)
+        thread.start()
+    
+    @staticmethod
+    def _formatar_duracao(segundos: float) -> str:
+        if segundos < 90:
+            return f"{segundos:.0f} s"
+        if segundos < 5400:
+            return f"{segundos / 60:.0f} min"
+        return f"{segundos / 3600:.1f} h"
+    
+    def _calibrar_processamento(self, xmls: List[str]):
+        """Medir a amostra e prever o tempo (roda em thread separada); a confirmação volta à thread principal"""
+        try:
+            template = None
+            if self.gerar_pdf_var.get():
+                template = RegistroTemplates.carregar(self.template_var.get(), self.processador.template_cache)
+            planejador = PlanejadorCapacidade(
+                template, gerar_pdf=self.gerar_pdf_var.get(),
+                documentos_por_processo=int(self.reciclar_docs_var.get()),
+                opcoes_pdf=self._opcoes_pdf()
+            )
+            plano = planejador.planejar(xmls)
+        except Exception as e:
+            plano = None
+            self.message_queue.put(("message", f"⚠️ Não foi possível calibrar a estimativa: {str(e)}"))
+        self.after(0, lambda: self._confirmar_processamento(xmls, plano))
+    
+    def _confirmar_processamento(self, xmls: List[str], plano: Dict[str, Any] = None):
+        """Confirmar o processamento com o tempo previsto pela calibração"""
+        processos = int(self.processos_var.get())
+        if plano and plano['amostras']:
+            previsoes = plano['previsoes']
+            previsto = previsoes.get(processos, previsoes[max(previsoes)])
+            recomendado = plano['recomendado']
+            estimativa = (
+                f"⏱️ Tempo estimado: ~{self._formatar_duracao(previsto)} com {processos} processo(s)\n"
+                f"💡 Recomendado para esta máquina: {recomendado} processo(s) "
+                f"(~{self._formatar_duracao(previsoes[recomendado])})\n"
+                f"📐 Calibrado com {plano['amostras']} XMLs da amostra\n\n"
+            )
+        else:
+            estimativa = "⏱️ Tempo estimado: indisponível\n\n"
+        
         # Confirmar processamento com interface melhorada
         resposta = messagebox.askyesno(
             "🚀 Confirmar Processamento em Massa",
-            f"📊 Total de XMLs encontrados: {len(xmls):,}\n"
+            f"📊 Total de XMLs encontrados: {len(xmls):,}"
+            f"{' (fatia ' + self.fatia_var.get().strip() + ')' if self.processador.fatia else ''}\n"
             f"📁 Pasta de origem: {self.pasta_xmls_var.get()}\n"
             f"📤 Pasta de destino: {self.pasta_saida_var.get()}\n\n"
-            f"⏱️ Tempo estimado: {len(xmls)*2:.0f}-{len(xmls)*5:.0f} segundos\n"
-            f"🔧 Processamento sequencial para máxima estabilidade\n\n"
+            f"{estimativa}"
             f"Deseja iniciar o processamento?",
             icon='question'
         )
         
         if not resposta:
+            self.start_btn.configure(state="normal")
+            self.inventario_btn.configure(state="normal")
             return
         
         # Iniciar processamento
         self.processando = True
         self.processador.parar_solicitado = False
         self.start_btn.configure(state="disabled")
+        self.inventario_btn.configure(state="disabled")
         self.stop_btn.configure(state="normal")
         
         # Executar em thread separada
-        thread = threading.Thread(target=self.executar_processamento, args=(xmls,), daemon=True)
+        thread = threading.Thread(target=self.executar_processamento, args=(xmls, plano), daemon=True)
         thread.start()
     
-    def executar_processamento(self, xmls: List[str]):
+    def executar_processamento(self, xmls: List[str], plano: Dict[str, Any] = None):
         """Executar processamento em massa (roda em thread separada)"""
+        exportador = None
+        auditoria = AuditoriaFiscal()
+        numeracao = AnaliseNumeracao()
         try:
             # Configurar processador
             self.processador.pasta_xmls = self.pasta_xmls_var.get()
@@ -1401,87 +4619,182 @@ class NFeStudioPro(ctk.CTk):
             # Criar pasta de saída
             os.makedirs(self.processador.pasta_saida, exist_ok=True)
             
-            # ⚡ OTIMIZAÇÃO: Carregar template uma única vez
-            if self.processador.template_cache is None:
+            gerar_pdf = self.gerar_pdf_var.get()
+            
+            # ⚡ OTIMIZAÇÃO: Templates compilados uma única vez (só são necessários para os PDFs); se um
+            # arquivo foi trocado ou editado desde o último lote, é recompilado aqui. Um arquivo .json no
+            # lugar do template traz as regras de escolha por modelo, emitente, tipo de operação...
+            registro = None
+            if gerar_pdf:
                 try:
-                    with open(self.processador.template_path, 'r', encoding='utf-8') as f:
-                        self.processador.template_cache = f.read()
-                    self.message_queue.put(("message", "⚡ Template carregado em cache"))
+                    compilacoes = self.processador.template_cache.compilacoes
+                    registro = RegistroTemplates.carregar(self.processador.template_path, self.processador.template_cache)
+                    compilados = self.processador.template_cache.compilacoes - compilacoes
+                    if compilados:
+                        self.message_queue.put(("message", f"⚡ Templates compilados: {compilados} de {len(registro.templates)}"))
+                    else:
+                        self.message_queue.put(("message", "⚡ Templates inalterados, usando o cache"))
+                    if registro.regras:
+                        self.message_queue.put(("message", f"🧩 {len(registro.regras)} regra(s) de escolha de template; padrão: {registro.padrao.nome}"))
+                    for template in registro.templates:
+                        if template.recursos_ausentes:
+                            self.message_queue.put(("message", f"⚠️ Imagens de {template.nome} não encontradas: {', '.join(template.recursos_ausentes)}"))
                 except Exception as e:
                     self.message_queue.put(("message", f"❌ Erro ao carregar template: {e}"))
+                    self.message_queue.put(("finish", None))
                     return
             
+            # Catálogo SQLite: cada nota processada é incluída ou atualizada, em lotes
+            try:
+                self.processador.catalogo = CatalogoNFe()
+            except Exception as e:
+                self.processador.catalogo = None
+                self.message_queue.put(("message", f"⚠️ Catálogo indisponível: {e}"))
+            
+            # Parquet: cabeçalhos e itens em grupos de linhas, particionados por ano/mês de emissão
+            if self.exportar_parquet_var.get():
+                try:
+                    exportador = ExportadorParquet(os.path.join(self.processador.pasta_saida, "parquet"))
+                    self.message_queue.put(("message", f"📦 Exportação Parquet em: {exportador.pasta}"))
+                except ImportError as e:
+                    self.message_queue.put(("message", f"⚠️ {e}"))
+                    if not gerar_pdf:
+                        self.message_queue.put(("finish", None))
+                        return
+            
+            # Pré-classificação pela raiz do XML: só NF-e/NFC-e seguem para a conversão; os eventos de
+            # cancelamento lidos na mesma passada formam o índice das notas que recebem a tarja
+            cancelamentos = IndiceCancelamentos()
+            tipos = ProcessadorMassa.classificar_documentos(xmls, cancelamentos=cancelamentos)
+            tipo_por_xml = {}
+            conversiveis = []
+            for xml_path, tipo in zip(xmls, tipos):
+                if tipo in ProcessadorMassa.TIPOS_CONVERSIVEIS:
+                    conversiveis.append(xml_path)
+                    tipo_por_xml[xml_path] = tipo
+                else:
+                    self.processador.adicionar_ao_relatorio(
+                        xml_path, erro=f"Não convertido: {tipo}", tipo=tipo,
+                        situacao=ProcessadorMassa.SITUACAO_IGNORADO
+                    )
+            ignorados = len(xmls) - len(conversiveis)
+            resumo_ignorados = ''
+            if ignorados:
+                contagem = pd.Series(tipos).value_counts()
+                resumo_ignorados = ", ".join(f"{quantidade:,} {tipo}" for tipo, quantidade in contagem.items()
+                                             if tipo not in ProcessadorMassa.TIPOS_CONVERSIVEIS)
+                self.message_queue.put(("message", f"🏷️ {ignorados:,} arquivos fora da conversão: {resumo_ignorados}"))
+            if plano is not None and len(plano['custos']) == len(xmls):
+                plano = dict(plano, custos=np.asarray(plano['custos'])[
+                    [tipo in ProcessadorMassa.TIPOS_CONVERSIVEIS for tipo in tipos]
+                ])
+            xmls = conversiveis
+            self.processador.total_arquivos = len(xmls)
+            if len(cancelamentos):
+                self.message_queue.put(("message", f"🚫 {len(cancelamentos):,} cancelamentos indexados (tarja nos PDFs)"))
+            
+            # Processos de conversão recicláveis: a memória não cresce com o tamanho do lote
+            pool = PoolRenderizacao(
+                registro,
+                processos=int(self.processos_var.get()),
+                documentos_por_processo=int(self.reciclar_docs_var.get()),
+                limite_memoria_mb=int(self.limite_memoria_var.get()),
+                tempo_limite=int(self.tempo_limite_var.get()),
+                canceladas=cancelamentos.chaves,
+                opcoes_pdf=self._opcoes_pdf()
+            )
+            
             self.message_queue.put(("message", f"🚀 Iniciando processamento de {len(xmls):,} XMLs"))
             self.message_queue.put(("message", f"📁 Pasta de saída: {self.processador.pasta_saida}"))
-            self.message_queue.put(("message", "⚡ Modo otimizado: template em cache + processador reutilizado"))
+            if pool.mede_memoria:
+                self.message_queue.put(("message", f"⚡ {pool.processos} processo(s) de conversão, reciclados a cada {pool.documentos_por_processo:,} documentos ou {pool.limite_memoria_mb:,} MB"))
+            else:
+                self.message_queue.put(("message", f"⚡ {pool.processos} processo(s) de conversão, reciclados a cada {pool.documentos_por_processo:,} documentos"))
+                self.message_queue.put(("message", "⚠️ Memória dos processos não mensurável (instale psutil): o limite de memória por processo está desativado"))
+            if pool.mede_memoria:
+                self.message_queue.put(("message", f"⏱️ Orçamento por XML: {pool.tempo_limite:,} s e {pool.limite_documento_mb:,} MB"))
+            else:
+                self.message_queue.put(("message", f"⏱️ Orçamento por XML: {pool.tempo_limite:,} s (sem medição de memória, só o tempo vale)"))
             
-            # Processar cada XML sequencialmente
-            for i, xml_path in enumerate(xmls):
-                if self.processador.parar_solicitado:
-                    self.message_queue.put(("message", "⚠️ Processamento interrompido pelo usuário"))
-                    break
-                
+            # Custo estimado de cada XML: o tempo restante acompanha o trabalho restante, não a contagem
+            if plano is not None and len(plano['custos']) == len(xmls) and plano['custo_total'] > 0:
+                custo_por_xml = dict(zip(xmls, plano['custos'].tolist()))
+            else:
+                custo_por_xml = {}
+            custo_total = sum(custo_por_xml.values()) or float(len(xmls))
+            custo_concluido = 0.0
+            templates_usados = {}
+            bytes_pdf = 0
+            
+            # Com mais de um processo, os maiores XMLs vão primeiro para nenhum processo ficar sozinho no fim
+            if pool.processos > 1:
+                xmls = ProcessadorMassa.ordenar_por_custo(xmls, custo_por_xml.get if custo_por_xml else None)
+                self.message_queue.put(("message", "📐 Agendamento: maiores XMLs primeiro (LPT)"))
+            
+            tarefas = (
+                {
+                    'xml_path': xml_path,
+                    'output_dir': self.processador.pasta_saida,
+                    'pdf_filename': f"{Path(xml_path).stem}.pdf",
+                    'gerar_pdf': gerar_pdf,
+                }
+                for xml_path in xmls
+            )
+            
+            for tarefa, resposta in pool.processar(tarefas, deve_parar=lambda: self.processador.parar_solicitado):
+                xml_path = tarefa['xml_path']
+                custo_concluido += custo_por_xml.get(xml_path, 1.0)
                 try:
-                    # Nome do arquivo PDF baseado no XML
-                    nome_base = Path(xml_path).stem
-                    pdf_filename = f"{nome_base}.pdf"
-                    pdf_path = os.path.join(self.processador.pasta_saida, pdf_filename)
-                    
-                    # Processar NF-e gerando apenas PDF (com cache)
-                    resposta = self.processador.processar_xml_nfe(
-                        xml_path=xml_path,
-                        template_content=self.processador.template_cache,
-                        output_dir=self.processador.pasta_saida,
-                        pdf_filename=pdf_filename
-                    )
-                    
                     self.processador.processados += 1
                     
                     # Coletar dados para o relatório Excel
                     chave_acesso = ""
                     numero_nf = ""
-                    sucesso_conversao = "Não"
                     
                     if resposta.get('success', False):
                         self.processador.sucessos += 1
-                        sucesso_conversao = "Sim"
                         dados_nfe = resposta.get('dados', {})
                         chave_acesso = dados_nfe.get('chave', '')
                         numero_nf = dados_nfe.get('numero', '')
+                        bytes_pdf += resposta.get('tamanho_pdf', 0)
+                        if resposta.get('template'):
+                            templates_usados[resposta['template']] = templates_usados.get(resposta['template'], 0) + 1
+                        cabecalho = ProcessadorMassa.cabecalho_de_dados(dados_nfe, xml_path)
+                        self.processador.registrar_no_catalogo(xml_path, resposta, cabecalho)
+                        if exportador is not None:
+                            exportador.adicionar(cabecalho, dados_nfe.get('produtos'))
+                        auditoria.adicionar(dados_nfe, xml_path)
+                        numeracao.adicionar(cabecalho)
                     else:
                         self.processador.erros += 1
                         erro_msg = resposta.get('error', 'Erro desconhecido')
                         self.message_queue.put(("message", f"❌ {os.path.basename(xml_path)}: {erro_msg}"))
-                        # Tentar extrair chave e número mesmo com erro
+                        # Tentar extrair chave e número mesmo com erro (só o cabeçalho)
                         try:
-                            with open(xml_path, 'r', encoding='utf-8') as f:
-                                xml_content = f.read()
-                            root = etree.fromstring(xml_content.encode('utf-8'))
-                            ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                            inf_nfe = root.xpath('.//nfe:infNFe', namespaces=ns)[0]
-                            chave_acesso = inf_nfe.get('Id', '').replace('NFe', '')
-                            ide = inf_nfe.xpath('.//nfe:ide', namespaces=ns)[0]
-                            numero_nf = ide.xpath('.//nfe:nNF', namespaces=ns)[0].text if ide.xpath('.//nfe:nNF', namespaces=ns) else ''
+                            cabecalho = ProcessadorMassa.ler_cabecalho(xml_path)
+                            chave_acesso = cabecalho.get('chave', '')
+                            numero_nf = cabecalho.get('nNF', '')
+                            self.processador.registrar_no_catalogo(xml_path, resposta, cabecalho)
+                            numeracao.adicionar(cabecalho)
                         except:
                             pass
                     
                     # Adicionar dados ao relatório
-                    self.processador.dados_relatorio.append({
-                        'Chave de Acesso': chave_acesso,
-                        'Nota Fiscal': numero_nf,
-                        'Sucesso de Conversão': sucesso_conversao,
-                        'Arquivo XML': os.path.basename(xml_path),
-                        'Data/Hora Processamento': datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
-                        'Pasta Origem': os.path.dirname(xml_path),
-                        'Tamanho Arquivo (KB)': round(os.path.getsize(xml_path) / 1024, 2) if os.path.exists(xml_path) else 0,
-                        'Erro Detalhado': resposta.get('error', '') if not resposta.get('success', False) else ''
-                    })
+                    self.processador.adicionar_ao_relatorio(
+                        xml_path, chave_acesso, numero_nf,
+                        sucesso=resposta.get('success', False),
+                        erro=resposta.get('error', '') if not resposta.get('success', False) else '',
+                        tipo=tipo_por_xml.get(xml_path, ''),
+                        cancelada=chave_acesso in cancelamentos,
+                        tamanho_pdf=resposta.get('tamanho_pdf', 0)
+                    )
                     
                     # Calcular progresso
                     progresso = self.processador.processados / self.processador.total_arquivos
                     tempo_decorrido = time.time() - self.processador.inicio_processamento
                     velocidade = self.processador.processados / tempo_decorrido if tempo_decorrido > 0 else 0
-                    tempo_restante = (self.processador.total_arquivos - self.processador.processados) / velocidade if velocidade > 0 else 0
+                    ritmo = custo_concluido / tempo_decorrido if tempo_decorrido > 0 else 0
+                    tempo_restante = (custo_total - custo_concluido) / ritmo if ritmo > 0 else 0
                     
                     # Enviar atualização de progresso
                     self.message_queue.put(("progress", {
@@ -1502,16 +4815,46 @@ class NFeStudioPro(ctk.CTk):
                     self.processador.erros += 1
                     self.message_queue.put(("message", f"❌ Erro em {os.path.basename(xml_path)}: {str(e)}"))
                     # Adicionar ao relatório mesmo com erro crítico
-                    self.processador.dados_relatorio.append({
-                        'Chave de Acesso': '',
-                        'Nota Fiscal': '',
-                        'Sucesso de Conversão': 'Não',
-                        'Arquivo XML': os.path.basename(xml_path),
-                        'Data/Hora Processamento': datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
-                        'Pasta Origem': os.path.dirname(xml_path),
-                        'Tamanho Arquivo (KB)': round(os.path.getsize(xml_path) / 1024, 2) if os.path.exists(xml_path) else 0,
-                        'Erro Detalhado': str(e)
-                    })
+                    self.processador.adicionar_ao_relatorio(xml_path, erro=str(e), tipo=tipo_por_xml.get(xml_path, ''))
+            
+            if self.processador.parar_solicitado:
+                self.message_queue.put(("message", "⚠️ Processamento interrompido pelo usuário"))
+            self.message_queue.put(("message", f"♻️ Processos reciclados: {pool.reciclagens:,} (pico de memória por processo: {pool.pico_memoria_mb:.0f} MB)"))
+            if bytes_pdf:
+                media_kb = bytes_pdf / 1024 / max(1, sum(templates_usados.values()))
+                self.message_queue.put(("message", f"📄 PDFs: {bytes_pdf / 1048576:,.1f} MB no total, {media_kb:,.1f} KB por nota"))
+            if len(templates_usados) > 1:
+                resumo = ", ".join(f"{nome}: {quantidade:,}" for nome, quantidade in sorted(templates_usados.items()))
+                self.message_queue.put(("message", f"🧩 PDFs por template: {resumo}"))
+            if pool.tempo_esgotado or pool.memoria_excedida:
+                self.message_queue.put(("message", f"⏱️ XMLs interrompidos: {pool.tempo_esgotado:,} por tempo, {pool.memoria_excedida:,} por memória"))
+            
+            # Gravar o último lote do catálogo
+            if self.processador.catalogo is not None:
+                caminho_catalogo = self.processador.catalogo.caminho
+                self.processador.fechar_catalogo()
+                self.message_queue.put(("message", f"🗂️ Catálogo atualizado: {caminho_catalogo}"))
+            
+            # Descarregar os grupos de linhas pendentes e fechar os arquivos Parquet
+            if exportador is not None:
+                exportador.fechar()
+                self.message_queue.put(("message", f"📦 Parquet: {exportador.total_notas:,} notas e {exportador.total_itens:,} itens exportados"))
+            
+            # Auditoria fiscal do lote inteiro (vetorizada)
+            try:
+                excecoes_df = auditoria.apurar()
+                self.message_queue.put(("message", f"🔎 Auditoria fiscal: {len(excecoes_df):,} exceções em {len(auditoria):,} notas"))
+            except Exception as e:
+                excecoes_df = None
+                self.message_queue.put(("message", f"⚠️ Erro na auditoria fiscal: {str(e)}"))
+            
+            # Lacunas e duplicidades de numeração por emitente/série
+            try:
+                numeracao_df = numeracao.apurar()
+                self.message_queue.put(("message", self._resumo_numeracao(numeracao_df)))
+            except Exception as e:
+                numeracao_df = None
+                self.message_queue.put(("message", f"⚠️ Erro na análise de numeração: {str(e)}"))
             
             # Estatísticas finais
             tempo_total = time.time() - self.processador.inicio_processamento
@@ -1520,120 +4863,23 @@ class NFeStudioPro(ctk.CTk):
             # Gerar relatório Excel
             try:
                 if self.processador.dados_relatorio:
-                    df = pd.DataFrame(self.processador.dados_relatorio)
+                    df = pd.DataFrame(self.processador.dados_relatorio, columns=ProcessadorMassa.COLUNAS_RELATORIO)
+                    
+                    # Linhas na ordem das pastas/arquivos, independente da ordem de conclusão
+                    df = df.sort_values(['Pasta Origem', 'Arquivo XML'], kind='stable', ignore_index=True)
                     
                     # Nome do arquivo Excel com timestamp
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    excel_filename = f"Relatorio_Conversao_NFe_{timestamp}.xlsx"
+                    excel_filename = f"Relatorio_Conversao_NFe_{timestamp}{self.processador.sufixo_fatia}.xlsx"
                     excel_path = os.path.join(self.processador.pasta_saida, excel_filename)
                     
-                    # Salvar Excel com formatação avançada
-                    with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-                        # Aba principal com dados
-                        df.to_excel(writer, sheet_name='Relatório Conversão', index=False)
-                        
-                        # Aba de estatísticas
-                        sucessos = len(df[df['Sucesso de Conversão'] == 'Sim'])
-                        erros = len(df[df['Sucesso de Conversão'] == 'Não'])
-                        total = len(df)
-                        tamanho_total = df['Tamanho Arquivo (KB)'].sum()
-                        tempo_processamento = time.time() - self.processador.inicio_processamento
-                        
-                        stats_data = {
-                            'Estatística': [
-                                'Total de Arquivos',
-                                'Conversões Bem-sucedidas',
-                                'Conversões com Erro',
-                                'Taxa de Sucesso (%)',
-                                'Tamanho Total Processado (MB)',
-                                'Tempo Total de Processamento (min)',
-                                'Velocidade Média (arquivos/min)',
-                                'Data/Hora Início',
-                                'Data/Hora Fim'
-                            ],
-                            'Valor': [
-                                total,
-                                sucessos,
-                                erros,
-                                round((sucessos/total)*100, 2) if total > 0 else 0,
-                                round(tamanho_total / 1024, 2),
-                                round(tempo_processamento / 60, 2),
-                                round((total / tempo_processamento) * 60, 2) if tempo_processamento > 0 else 0,
-                                datetime.fromtimestamp(self.processador.inicio_processamento).strftime('%d/%m/%Y %H:%M:%S'),
-                                datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-                            ]
-                        }
-                        
-                        stats_df = pd.DataFrame(stats_data)
-                        stats_df.to_excel(writer, sheet_name='Estatísticas', index=False)
-                        
-                        # Formatação da aba principal
-                        from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-                        from openpyxl.utils.dataframe import dataframe_to_rows
-                        
-                        worksheet = writer.sheets['Relatório Conversão']
-                        
-                        # Formatação do cabeçalho
-                        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                        header_font = Font(color="FFFFFF", bold=True)
-                        
-                        for cell in worksheet[1]:
-                            cell.fill = header_fill
-                            cell.font = header_font
-                            cell.alignment = Alignment(horizontal="center", vertical="center")
-                        
-                        # Formatação condicional por status
-                        success_fill = PatternFill(start_color="D4EDDA", end_color="D4EDDA", fill_type="solid")
-                        error_fill = PatternFill(start_color="F8D7DA", end_color="F8D7DA", fill_type="solid")
-                        
-                        # Aplicar cores baseadas no status de conversão
-                        for row in range(2, len(df) + 2):
-                            status_cell = worksheet[f'C{row}']  # Coluna 'Sucesso de Conversão'
-                            if status_cell.value == 'Sim':
-                                for col in range(1, len(df.columns) + 1):
-                                    worksheet.cell(row=row, column=col).fill = success_fill
-                            elif status_cell.value == 'Não':
-                                for col in range(1, len(df.columns) + 1):
-                                    worksheet.cell(row=row, column=col).fill = error_fill
-                        
-                        # Ajustar largura das colunas
-                        for column in worksheet.columns:
-                            max_length = 0
-                            column_letter = column[0].column_letter
-                            for cell in column:
-                                try:
-                                    if len(str(cell.value)) > max_length:
-                                        max_length = len(str(cell.value))
-                                except:
-                                    pass
-                            adjusted_width = min(max_length + 2, 60)
-                            worksheet.column_dimensions[column_letter].width = adjusted_width
-                        
-                        # Formatação da aba de estatísticas
-                        stats_ws = writer.sheets['Estatísticas']
-                        
-                        # Cabeçalho das estatísticas
-                        for cell in stats_ws[1]:
-                            cell.fill = PatternFill(start_color="FF9800", end_color="FF9800", fill_type="solid")
-                            cell.font = Font(color="FFFFFF", bold=True)
-                            cell.alignment = Alignment(horizontal="center", vertical="center")
-                        
-                        # Ajustar largura das colunas de estatísticas
-                        stats_ws.column_dimensions['A'].width = 35
-                        stats_ws.column_dimensions['B'].width = 25
-                        
-                        # Adicionar bordas
-                        thin_border = Border(
-                            left=Side(style='thin'),
-                            right=Side(style='thin'),
-                            top=Side(style='thin'),
-                            bottom=Side(style='thin')
-                        )
-                        
-                        for row in stats_ws.iter_rows():
-                            for cell in row:
-                                cell.border = thin_border
-                                cell.alignment = Alignment(horizontal="center", vertical="center")
+                    stats_df = ProcessadorMassa.estatisticas_relatorio(
+                        df, self.processador.inicio_processamento, time.time(),
+                        excecoes=len(excecoes_df) if excecoes_df is not None else None,
+                        tempo_esgotado=pool.tempo_esgotado,
+                        memoria_excedida=pool.memoria_excedida
+                    )
+                    ProcessadorMassa.salvar_relatorio_excel(excel_path, df, stats_df, excecoes_df, numeracao_df)
                     
                     self.message_queue.put(("message", f"📊 Relatório Excel gerado: {excel_filename}"))
                     self.message_queue.put(("excel_path", excel_path))  # Para abrir automaticamente
@@ -1643,8 +4889,12 @@ class NFeStudioPro(ctk.CTk):
             
             self.message_queue.put(("message", "🎉 PROCESSAMENTO CONCLUÍDO!"))
             self.message_queue.put(("message", f"📊 Total: {self.processador.total_arquivos:,} XMLs"))
-            self.message_queue.put(("message", f"✅ Sucessos: {self.processador.sucessos:,} ({self.processador.sucessos/self.processador.total_arquivos*100:.1f}%)"))
-            self.message_queue.put(("message", f"❌ Erros: {self.processador.erros:,} ({self.processador.erros/self.processador.total_arquivos*100:.1f}%)"))
+            if self.processador.total_arquivos:
+                self.message_queue.put(("message", f"✅ Sucessos: {self.processador.sucessos:,} ({self.processador.sucessos/self.processador.total_arquivos*100:.1f}%)"))
+                self.message_queue.put(("message", f"❌ Erros: {self.processador.erros:,} ({self.processador.erros/self.processador.total_arquivos*100:.1f}%)"))
+            else:
+                # Lote só com eventos, CT-e, outros XMLs ou arquivos inválidos: nada a converter
+                self.message_queue.put(("message", f"🏷️ Nenhuma NF-e/NFC-e no lote; {ignorados:,} arquivos ignorados: {resumo_ignorados}"))
             self.message_queue.put(("message", f"⏱️ Tempo total: {tempo_total/60:.1f} minutos"))
             self.message_queue.put(("message", f"⚡ Velocidade média: {velocidade_media:.1f} XMLs/segundo"))
             self.message_queue.put(("message", f"📁 Arquivos salvos em: {self.processador.pasta_saida}"))
@@ -1652,9 +4902,130 @@ class NFeStudioPro(ctk.CTk):
             self.message_queue.put(("finish", None))
             
         except Exception as e:
+            self.processador.fechar_catalogo()
+            if exportador is not None:
+                try:
+                    exportador.fechar()
+                except Exception:
+                    pass
             self.message_queue.put(("message", f"❌ Erro geral no processamento: {str(e)}"))
             self.message_queue.put(("finish", None))
     
+    def _opcoes_pdf(self) -> Dict[str, Any]:
+        """Opções de tamanho dos PDFs escolhidas na tela"""
+        pdfa = self.pdfa_var.get()
+        return ProcessadorMassa.opcoes_pdf(
+            self.compressao_pdf_var.get(),
+            subconjunto_fontes=self.subconjunto_fontes_var.get(),
+            pdfa='' if pdfa == "Não" else pdfa
+        )
+    
+    def _definir_fatia(self) -> bool:
+        """Ler a fatia i/N da tela para o processador; False (com aviso) se for inválida"""
+        try:
+            self.processador.fatia = ProcessadorMassa.interpretar_fatia(self.fatia_var.get())
+        except ValueError as e:
+            messagebox.showerror("Erro", str(e))
+            return False
+        return True
+    
+    def iniciar_inventario(self):
+        """Listar chave, número, emitente, emissão e totais de todos os XMLs (sem gerar PDFs)"""
+        if not self.pasta_xmls_var.get() or not os.path.exists(self.pasta_xmls_var.get()):
+            messagebox.showerror("Erro", "Selecione a pasta com XMLs!")
+            return
+        
+        if not self.pasta_saida_var.get():
+            messagebox.showerror("Erro", "Selecione a pasta de destino!")
+            return
+        
+        if not self._definir_fatia():
+            return
+        
+        self.processando = True
+        self.processador.parar_solicitado = False
+        self.start_btn.configure(state="disabled")
+        self.inventario_btn.configure(state="disabled")
+        self.stop_btn.configure(state="normal")
+        
+        thread = threading.Thread(target=self.executar_inventario, daemon=True)
+        thread.start()
+    
+    def executar_inventario(self):
+        """Ler os cabeçalhos em um pool de processos e gravar o inventário em CSV (roda em thread separada)"""
+        colunas = [
+            'chave', 'nNF', 'serie', 'mod', 'tpNF', 'dhEmi', 'natOp',
+            'emit_CNPJ', 'emit_xNome', 'emit_UF', 'dest_CNPJ', 'dest_xNome', 'dest_UF',
+            'vProd', 'vBC', 'vICMS', 'vST', 'vIPI', 'vDesc', 'vFrete', 'vNF', 'itens', 'arquivo', 'erro'
+        ]
+        try:
+            xmls = self.processador.descobrir_xmls(self.pasta_xmls_var.get())
+            if not xmls:
+                self.message_queue.put(("message", "❌ Nenhum XML encontrado na pasta!"))
+                return
+            
+            pasta_saida = self.pasta_saida_var.get()
+            os.makedirs(pasta_saida, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            csv_path = os.path.join(pasta_saida, f"Inventario_NFe_{timestamp}{self.processador.sufixo_fatia}.csv")
+            
+            self.message_queue.put(("message", f"📋 Inventariando {len(xmls):,} XMLs (somente cabeçalhos)..."))
+            inicio = time.time()
+            contagem = {'lidos': 0, 'erros': 0}
+            numeracao = AnaliseNumeracao()
+            
+            def progresso(lidos, total):
+                decorrido = time.time() - inicio
+                velocidade = lidos / decorrido if decorrido > 0 else 0
+                self.message_queue.put(("progress", {
+                    'valor': lidos / total,
+                    'processados': lidos,
+                    'total': total,
+                    'sucessos': lidos - contagem['erros'],
+                    'erros': contagem['erros'],
+                    'velocidade': velocidade,
+                    'tempo_restante': (total - lidos) / velocidade if velocidade > 0 else 0
+                }))
+            
+            # Gravação linha a linha: a memória não cresce com o tamanho da coleção
+            with open(csv_path, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.DictWriter(f, fieldnames=colunas, delimiter=';', extrasaction='ignore')
+                writer.writeheader()
+                for cabecalho in self.processador.ler_cabecalhos(xmls, progresso=progresso):
+                    if 'erro' in cabecalho:
+                        contagem['erros'] += 1
+                    else:
+                        numeracao.adicionar(cabecalho)
+                    contagem['lidos'] += 1
+                    writer.writerow(cabecalho)
+            
+            duracao = time.time() - inicio
+            if self.processador.parar_solicitado:
+                self.message_queue.put(("message", "⚠️ Inventário interrompido pelo usuário"))
+            self.message_queue.put(("message", f"📋 Inventário gravado: {os.path.basename(csv_path)}"))
+            self.message_queue.put(("message", f"📊 {contagem['lidos']:,} XMLs em {duracao:.1f}s ({contagem['erros']:,} com erro)"))
+            
+            # Lacunas e duplicidades de numeração dos cabeçalhos lidos
+            numeracao_df = numeracao.apurar()
+            excel_path = os.path.join(pasta_saida, f"Numeracao_NFe_{timestamp}{self.processador.sufixo_fatia}.xlsx")
+            with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
+                numeracao_df.to_excel(writer, sheet_name='Numeração', index=False)
+                ProcessadorMassa._formatar_aba_numeracao(writer.sheets['Numeração'])
+            self.message_queue.put(("message", self._resumo_numeracao(numeracao_df)))
+            self.message_queue.put(("message", f"🔢 Relatório de numeração: {os.path.basename(excel_path)}"))
+        except Exception as e:
+            self.message_queue.put(("message", f"❌ Erro no inventário: {str(e)}"))
+        finally:
+            self.message_queue.put(("finish_inventario", None))
+    
+    @staticmethod
+    def _resumo_numeracao(numeracao_df: pd.DataFrame) -> str:
+        """Linha de log com o total de números ausentes e repetidos"""
+        lacunas = numeracao_df[numeracao_df['Ocorrência'] == AnaliseNumeracao.LACUNA]
+        duplicados = numeracao_df[numeracao_df['Ocorrência'] == AnaliseNumeracao.DUPLICADO]
+        return (f"🔢 Numeração: {int(lacunas['Quantidade'].sum()):,} números ausentes em {len(lacunas):,} faixas, "
+                f"{len(duplicados):,} números duplicados")
+    
     def parar_processamento(self):
         """Parar processamento em massa"""
         self.processador.parar_solicitado = True
@@ -1728,11 +5099,21 @@ class NFeStudioPro(ctk.CTk):
                         # Armazenar caminho do Excel para abrir depois
                         self.excel_path_gerado = msg_data
                     
+                    elif msg_type == "finish_inventario":
+                        self.processando = False
+                        self.start_btn.configure(state="normal")
+                        self.inventario_btn.configure(state="normal")
+                        self.stop_btn.configure(state="disabled")
+                        if hasattr(self, 'progress_bar'):
+                            self.progress_bar.set(1.0)
+                    
                     elif msg_type == "finish":
                         # Finalizar processamento
                         self.processando = False
                         if hasattr(self, 'start_btn'):
                             self.start_btn.configure(state="normal")
+                        if hasattr(self, 'inventario_btn'):
+                            self.inventario_btn.configure(state="normal")
                         if hasattr(self, 'stop_btn'):
                             self.stop_btn.configure(state="disabled")
                         if hasattr(self, 'progress_bar'):
@@ -1809,40 +5190,208 @@ class NFeStudioPro(ctk.CTk):
         self.tree.tag_configure("processando", background="#FFF3CD", foreground="#856404")
         self.tree.tag_configure("sucesso", background="#D1ECF1", foreground="#0C5460")
 
-    def carregar_dados_na_tree(self):
-        """Carregar dados do DataFrame na Treeview"""
-        # Limpar tree
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        # Carregar dados em lotes para melhor performance
-        batch_size = 100
-        total_rows = len(self.dados_df)
-        
-        for i in range(0, total_rows, batch_size):
-            batch = self.dados_df.iloc[i:i+batch_size]
-            for idx, row in batch.iterrows():
-                status = row['Status']
-                tag = ""
-                if "Válido" in status:
-                    tag = "valido"
-                elif "Erro" in status:
-                    tag = "erro"
-                elif "Processando" in status:
-                    tag = "processando"
-                elif "Sucesso" in status:
-                    tag = "sucesso"
-                    
-                self.tree.insert("", "end", values=(
-                    row['Chave Acesso NF'],
-                    row['Nome Arq. NF'],
-                    status
-                ), tags=(tag,))
-                
-            # Atualizar interface a cada lote
-            self.update_idletasks()
+    def carregar_dados_na_tree(self):
+        """Carregar dados da tabela na Treeview (apenas a janela visível é materializada)"""
+        self.tree_virtual.definir_ids(self.tabela_rename.ids_ativos())
+        self.atualizar_contador_rename()
+
+    def _tag_status_rename(self, status: str) -> str:
+        """Tag de cor da Treeview correspondente ao status"""
+        if "Válido" in status:
+            return "valido"
+        elif "Erro" in status:
+            return "erro"
+        elif "Processando" in status:
+            return "processando"
+        elif "Sucesso" in status:
+            return "sucesso"
+        return ""
+
+    def _agendar_status_rename(self, idx, status: str):
+        """Registrar mudança de status de uma linha (aplicada em lote na thread principal)"""
+        with self._rename_lock:
+            self._rename_status_pendente[idx] = status
+
+    def _agendar_log_rename(self, mensagem: str):
+        """Registrar mensagem de log (aplicada em lote na thread principal)"""
+        with self._rename_lock:
+            self._rename_logs_pendentes.append((datetime.now().strftime("%H:%M:%S"), mensagem))
+
+    def _aplicar_atualizacoes_rename(self):
+        """Aplicar na Treeview e no log as atualizações acumuladas pela thread"""
+        with self._rename_lock:
+            status_pendente = self._rename_status_pendente
+            logs_pendentes = self._rename_logs_pendentes
+            self._rename_status_pendente = {}
+            self._rename_logs_pendentes = []
+        
+        # Atualizar somente as linhas alteradas, endereçadas pelo iid estável
+        if hasattr(self, 'tree'):
+            for idx, status in status_pendente.items():
+                iid = str(idx)
+                if self.tree.exists(iid):
+                    values = self.tree.item(iid, 'values')
+                    self.tree.item(iid, values=(values[0], values[1], status), tags=(self._tag_status_rename(status),))
+        
+        # Um único insert para todas as mensagens do intervalo
+        if (logs_pendentes and hasattr(self, 'log_text_rename') and
+                self.current_screen == "renomeador"):
+            texto = "".join(f"[{hora}] [RENOMEADOR] {mensagem}\n" for hora, mensagem in logs_pendentes)
+            self.log_text_rename.insert("end", texto)
+            self.log_text_rename.see("end")
+
+    def _ciclo_atualizacao_rename(self):
+        """Atualizar a interface algumas vezes por segundo enquanto a renomeação roda"""
+        self._aplicar_atualizacoes_rename()
+        if self._renomeacao_em_andamento():
+            self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, self._ciclo_atualizacao_rename)
+
+    def _registrar_operacao_rename(self, op: Dict[str, Any], erro, desfazendo: bool = False, ids=None):
+        """Refletir na tabela o resultado de uma operação do diário de renomeação"""
+        if erro is not None:
+            status = f"Erro - {erro}"
+            self._agendar_log_rename(f"❌ Erro: {erro}")
+        elif desfazendo:
+            status = "Válido"
+            self._agendar_log_rename(f"↩️ Restaurado: {op['origem']}")
+        else:
+            status = f"Sucesso - {op['destino']}"
+            self._agendar_log_rename(f"✅ Renomeado: {op['destino']}")
+        
+        # Fora da execução original os ids mudam; a chave localiza as linhas em O(1)
+        if ids is None:
+            ids = self.tabela_rename.ids_por_chave(op["chave"])
+        if ids:
+            self.tabela_rename.definir_status(ids, status)
+            for idx in ids:
+                self._agendar_status_rename(idx, status)
+
+    def _executor_rename(self) -> ExecutorRenomeacao:
+        """Executor de renomeações com os limites de concorrência configurados por pasta"""
+        return ExecutorRenomeacao(limite_por_pasta=self.limite_padrao_rename, limites_pastas=self.limites_pasta_rename)
+
+    def alterar_paralelismo_rename(self, valor: str):
+        """Definir quantas renomeações simultâneas são permitidas na pasta selecionada"""
+        pasta = self.selected_folder_rename.get()
+        if not pasta:
+            self.adicionar_log_rename(f"⚡ Paralelismo padrão: {valor} renomeações simultâneas")
+            self.limite_padrao_rename = int(valor)
+            return
+        self.limites_pasta_rename[pasta] = int(valor)
+        self.adicionar_log_rename(f"⚡ Paralelismo em {Path(pasta).name}: {valor} renomeações simultâneas")
+
+    def _renomeacao_em_andamento(self) -> bool:
+        return self.renomeacao_thread is not None and self.renomeacao_thread.is_alive()
+
+    def verificar_diario_rename(self, pasta: str) -> bool:
+        """Oferecer a recuperação de uma renomeação interrompida na pasta.
+        Retorna True apenas se não há pendência (a recuperação roda em segundo plano)"""
+        try:
+            diario = DiarioRenomeacao.carregar(pasta)
+        except OSError as e:
+            self.adicionar_log_rename(f"⚠️ Erro ao ler o diário de renomeação: {str(e)}")
+            return True
+        
+        if diario is None or not diario.interrompido:
+            return True
+        
+        restantes = len(diario.operacoes) - len(diario.concluidas)
+        resposta = messagebox.askyesnocancel(
+            "Renomeação Interrompida",
+            f"Foi encontrada uma renomeação interrompida nesta pasta.\n\n"
+            f"🕒 Iniciada em: {diario.criado}\n"
+            f"📄 Operações planejadas: {len(diario.operacoes)}\n"
+            f"⏳ Sem confirmação: {restantes}\n\n"
+            "Sim: concluir a renomeação\n"
+            "Não: reverter os arquivos já renomeados\n"
+            "Cancelar: decidir depois"
+        )
+        if resposta is None:
+            self.adicionar_log_rename("⚠️ Renomeação interrompida pendente nesta pasta")
+            return False
+        
+        if resposta:
+            self.adicionar_log_rename("⏩ Concluindo renomeação interrompida...")
+            self._executar_diario_rename(diario, desfazendo=False)
+        else:
+            self.adicionar_log_rename("⏪ Revertendo renomeação interrompida...")
+            self._executar_diario_rename(diario, desfazendo=True)
+        return False
+
+    def desfazer_renomeacao(self):
+        """Desfazer a última renomeação da pasta, reproduzindo o diário em ordem inversa"""
+        pasta = self.selected_folder_rename.get()
+        if not pasta:
+            messagebox.showwarning("Aviso", "Selecione uma pasta primeiro")
+            return
+        
+        if self._renomeacao_em_andamento():
+            messagebox.showwarning("Aviso", "Aguarde o término da operação em andamento")
+            return
+        
+        if not self.verificar_diario_rename(pasta):
+            return
+        
+        try:
+            diario = DiarioRenomeacao.carregar(pasta)
+        except OSError as e:
+            messagebox.showerror("Erro", f"Erro ao ler o diário de renomeação:\n{str(e)}")
+            return
+        
+        if diario is None or not diario.pode_desfazer:
+            messagebox.showinfo("Desfazer", "Nenhuma renomeação para desfazer nesta pasta")
+            return
+        
+        confirmacao = messagebox.askyesno(
+            "Desfazer Renomeação",
+            f"Deseja desfazer a renomeação de {len(diario.concluidas)} arquivos?\n\n"
+            f"📁 Pasta: {Path(pasta).name}\n"
+            f"🕒 Executada em: {diario.criado}"
+        )
+        if not confirmacao:
+            return
+        
+        self.adicionar_log_rename("↩️ Desfazendo a última renomeação...")
+        self._executar_diario_rename(diario, desfazendo=True)
+
+    def _executar_diario_rename(self, diario: DiarioRenomeacao, desfazendo: bool):
+        """Retomar ou reverter um diário em segundo plano"""
+        contagem = {"ok": 0, "erros": 0}
+        executor = self._executor_rename()
+        
+        def ao_concluir(op, erro):
+            self._registrar_operacao_rename(op, erro, desfazendo=desfazendo)
+            contagem["ok" if erro is None else "erros"] += 1
+        
+        def executar():
+            try:
+                if desfazendo:
+                    diario.desfazer(ao_concluir)
+                else:
+                    diario.retomar(ao_concluir, executor=executor)
+                erro_critico = None
+            except Exception as e:
+                erro_critico = e
             
-        self.atualizar_contador_rename()
+            def finalizar():
+                self._aplicar_atualizacoes_rename()
+                self.btn_renomear.configure(state="normal")
+                self.btn_desfazer.configure(state="normal")
+                if erro_critico is not None:
+                    self.adicionar_log_rename(f"💥 Erro crítico: {str(erro_critico)}")
+                    messagebox.showerror("Erro", f"Erro ao processar o diário de renomeação:\n{str(erro_critico)}")
+                    return
+                acao = "restaurados" if desfazendo else "renomeados"
+                self.adicionar_log_rename(f"📊 Resumo: {contagem['ok']} {acao}, {contagem['erros']} erros")
+                self.status_var_rename.set(f"✅ Concluído: {contagem['ok']} {acao}")
+            
+            self.after(0, finalizar)
+        
+        self.btn_renomear.configure(state="disabled")
+        self.btn_desfazer.configure(state="disabled")
+        self.renomeacao_thread = threading.Thread(target=executar, daemon=True)
+        self.renomeacao_thread.start()
+        self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, self._ciclo_atualizacao_rename)
 
     def selecionar_pasta_rename(self):
         """Selecionar pasta com os arquivos XML e PDF"""
@@ -1865,15 +5414,21 @@ class NFeStudioPro(ctk.CTk):
                 self.adicionar_log_rename(f"📊 Arquivos encontrados: {total_arquivos} ({xml_count} XML, {pdf_count} PDF)")
             except Exception as e:
                 self.adicionar_log_rename(f"⚠️ Erro ao contar arquivos: {str(e)}")
+            
+            # Paralelismo configurado para esta pasta
+            limite = self.limites_pasta_rename.get(pasta, self.limite_padrao_rename)
+            self.paralelismo_var_rename.set(str(limite))
+            
+            # Retomar ou reverter uma renomeação interrompida nesta pasta
+            self.verificar_diario_rename(pasta)
         else:
             self.adicionar_log_rename("❌ Seleção de pasta cancelada")
 
     def validar_chave_acesso_rename(self, chave: str) -> bool:
-        """Validar se a chave de acesso tem formato válido"""
+        """Validar chave de acesso (formato, UF, data, CNPJ, modelo e dígito verificador)"""
         if not chave:
             return False
-        chave_limpa = re.sub(r'[^0-9]', '', chave)
-        return len(chave_limpa) == 44
+        return ValidadorChaveNFe.validar([chave])[0] == ValidadorChaveNFe.VALIDA
 
     def adicionar_lote_rename(self):
         """Adicionar múltiplas linhas de uma vez com campos separados"""
@@ -1995,50 +5550,31 @@ class NFeStudioPro(ctk.CTk):
                 messagebox.showwarning("Aviso", f"Número de linhas diferente!\n\nChaves: {len(chaves_linhas)} linhas\nNomes: {len(nomes_linhas)} linhas\n\nCertifique-se de que cada chave tenha um nome correspondente.")
                 return
                 
-            novos_dados = []
-            erros = []
+            # Validação em massa (sem log por linha)
+            motivos = ValidadorChaveNFe.validar(chaves_linhas)
+            novos_status = ValidadorChaveNFe.status(motivos)
+            erros = [
+                f"Linha {i + 1}: Chave inválida - {ValidadorChaveNFe.MOTIVOS[int(motivos[i])]} ({chaves_linhas[i][:20]}...)"
+                for i in np.flatnonzero(motivos != ValidadorChaveNFe.VALIDA)[:5].tolist()
+            ]
+            total_erros = int((motivos != ValidadorChaveNFe.VALIDA).sum())
             
-            for i, (chave, nome) in enumerate(zip(chaves_linhas, nomes_linhas), 1):
-                if not chave or not nome:
-                    erros.append(f"Linha {i}: Chave ou nome vazio")
-                    continue
-                    
-                # Validar chave
-                if not self.validar_chave_acesso_rename(chave):
-                    status = f"Erro - Linha {i}: Chave inválida"
-                    erros.append(f"Linha {i}: Chave inválida ({chave[:20]}...)")
-                    self.adicionar_log_rename(f"⚠️ Linha {i}: Chave inválida - {chave[:20]}...")
-                else:
-                    status = "Válido"
-                    self.adicionar_log_rename(f"✅ Linha {i}: Chave válida - {nome}")
-                    
-                novos_dados.append({
-                    'Chave Acesso NF': chave,
-                    'Nome Arq. NF': nome,
-                    'Status': status
-                })
-                
-            if novos_dados:
-                df_novo = pd.DataFrame(novos_dados)
-                self.dados_df = pd.concat([self.dados_df, df_novo], ignore_index=True)
-                self.carregar_dados_na_tree()
-                
-                # Mostrar resultado
-                resultado_msg = f"✅ Adicionados {len(novos_dados)} registros em lote"
-                self.adicionar_log_rename(f"✅ Lote processado: {len(novos_dados)} registros adicionados")
-                
-                if erros:
-                    self.adicionar_log_rename(f"⚠️ {len(erros)} erros encontrados no lote")
-                    resultado_msg += f"\n\n⚠️ {len(erros)} erros encontrados:\n" + "\n".join(erros[:5])
-                    if len(erros) > 5:
-                        resultado_msg += f"\n... e mais {len(erros) - 5} erros"
-                
-                dialog.destroy()
-                messagebox.showinfo("Lote Processado", resultado_msg)
-                self.status_var_rename.set(f"✅ Lote adicionado: {len(novos_dados)} itens")
-            else:
-                self.adicionar_log_rename("❌ Nenhum dado válido encontrado no lote")
-                messagebox.showwarning("Aviso", "Nenhum dado válido encontrado")
+            self.tabela_rename.adicionar(chaves_linhas, nomes_linhas, novos_status)
+            self.carregar_dados_na_tree()
+            
+            # Mostrar resultado
+            resultado_msg = f"✅ Adicionados {len(chaves_linhas)} registros em lote"
+            self.adicionar_log_rename(f"✅ Lote processado: {len(chaves_linhas)} registros adicionados")
+            
+            if total_erros:
+                self.adicionar_log_rename(f"⚠️ {total_erros} erros encontrados no lote")
+                resultado_msg += f"\n\n⚠️ {total_erros} erros encontrados:\n" + "\n".join(erros)
+                if total_erros > 5:
+                    resultado_msg += f"\n... e mais {total_erros - 5} erros"
+            
+            dialog.destroy()
+            messagebox.showinfo("Lote Processado", resultado_msg)
+            self.status_var_rename.set(f"✅ Lote adicionado: {len(chaves_linhas)} itens")
                 
         def limpar_campos():
             chave_text.delete("1.0", "end")
@@ -2076,9 +5612,318 @@ class NFeStudioPro(ctk.CTk):
         )
         processar_btn.pack(side="right", padx=(5, 5))
 
+    def importar_arquivo_rename(self):
+        """Importar pares chave → nome de um arquivo CSV, Excel ou Parquet (leitura em blocos, fora da thread da interface)"""
+        caminho = filedialog.askopenfilename(
+            title="Importar chaves e nomes",
+            filetypes=[
+                ("Planilhas", "*.csv *.txt *.xlsx *.xlsm *.parquet"),
+                ("CSV", "*.csv *.txt"),
+                ("Excel", "*.xlsx *.xlsm"),
+                ("Parquet", "*.parquet"),
+                ("Todos os arquivos", "*.*")
+            ]
+        )
+        if not caminho:
+            self.adicionar_log_rename("❌ Importação cancelada")
+            return
+        
+        nome_arquivo = os.path.basename(caminho)
+        self.btn_importar_dados.configure(state="disabled")
+        self.progress_bar_rename.set(0)
+        
+        # Estado compartilhado com a thread; a interface o consulta algumas vezes por segundo
+        estado = {'lidas': 0, 'adicionadas': 0, 'invalidas': 0, 'ignoradas': 0, 'erro': None, 'inicio': time.time()}
+        
+        def importar_em_segundo_plano():
+            try:
+                chaves, nomes = [], []
+                for bloco_chaves, bloco_nomes in ImportadorMapeamento.ler_em_blocos(caminho):
+                    for chave, nome in zip(bloco_chaves, bloco_nomes):
+                        if chave and nome:
+                            chaves.append(chave)
+                            nomes.append(nome)
+                        else:
+                            estado['ignoradas'] += 1
+                    estado['lidas'] += len(bloco_chaves)
+                
+                # Validação em massa e inclusão na tabela em uma única operação
+                motivos = ValidadorChaveNFe.validar(chaves)
+                self.tabela_rename.adicionar(chaves, nomes, ValidadorChaveNFe.status(motivos))
+                estado['adicionadas'] = len(chaves)
+                estado['invalidas'] = int((motivos != ValidadorChaveNFe.VALIDA).sum())
+            except Exception as e:
+                estado['erro'] = e
+        
+        thread = threading.Thread(target=importar_em_segundo_plano, daemon=True)
+        thread.start()
+        
+        def acompanhar():
+            if thread.is_alive():
+                self.status_var_rename.set(f"📥 Importando {nome_arquivo}... {estado['lidas']:,} linhas lidas")
+                self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+                return
+            
+            self.btn_importar_dados.configure(state="normal")
+            self.progress_bar_rename.set(1.0)
+            if estado['erro'] is not None:
+                self.adicionar_log_rename(f"❌ Erro ao importar {nome_arquivo}: {estado['erro']}")
+                messagebox.showerror("Erro", f"Erro ao importar arquivo:\n{estado['erro']}")
+                self.status_var_rename.set("❌ Falha na importação")
+                return
+            
+            self._executar_filtro_rename()
+            duracao = time.time() - estado['inicio']
+            self.adicionar_log_rename(
+                f"📥 {nome_arquivo}: {estado['adicionadas']:,} registros importados "
+                f"({estado['adicionadas'] - estado['invalidas']:,} válidos, {estado['invalidas']:,} chaves inválidas, "
+                f"{estado['ignoradas']:,} linhas vazias ignoradas) em {duracao:.1f}s"
+            )
+            self.status_var_rename.set(f"✅ Importados: {estado['adicionadas']:,} itens")
+        
+        self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+
+    def gerar_nomes_por_padrao_rename(self):
+        """Preencher a tabela lendo os XMLs da pasta e montando os nomes a partir de um padrão"""
+        pasta = self.selected_folder_rename.get()
+        if not pasta:
+            messagebox.showwarning("Aviso", "Selecione uma pasta primeiro")
+            return
+        
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Nomes a partir do XML")
+        dialog.geometry("640x360")
+        dialog.transient(self)
+        dialog.grab_set()
+        
+        # Centralizar
+        dialog.update_idletasks()
+        x = (dialog.winfo_screenwidth() // 2) - 320
+        y = (dialog.winfo_screenheight() // 2) - 180
+        dialog.geometry(f"640x360+{x}+{y}")
+        
+        title_label = ctk.CTkLabel(
+            dialog,
+            text="🧩 Padrão de Nome",
+            font=ctk.CTkFont(size=18, weight="bold")
+        )
+        title_label.pack(pady=(20, 10))
+        
+        padrao_entry = ctk.CTkEntry(
+            dialog,
+            textvariable=self.padrao_nome_var_rename,
+            width=580,
+            font=ctk.CTkFont(family="Consolas", size=12)
+        )
+        padrao_entry.pack(padx=20, pady=(0, 10))
+        
+        campos = ", ".join(["chave"] + list(PadraoNomeArquivo.CAMPOS))
+        campos_label = ctk.CTkLabel(
+            dialog,
+            text=f"Campos disponíveis: {campos}\n\n"
+                 "Formatos: {nNF:09} completa com zeros, {vNF:.2f} casas decimais, "
+                 "{dhEmi:%d.%m.%Y} data",
+            font=ctk.CTkFont(size=11),
+            text_color="gray",
+            wraplength=580,
+            justify="left"
+        )
+        campos_label.pack(padx=20, pady=(0, 15))
+        
+        buttons_frame = ctk.CTkFrame(dialog, fg_color="transparent")
+        buttons_frame.pack(pady=(0, 20))
+        
+        def confirmar():
+            try:
+                padrao = PadraoNomeArquivo(self.padrao_nome_var_rename.get())
+            except ValueError as e:
+                messagebox.showerror("Padrão inválido", str(e), parent=dialog)
+                return
+            dialog.destroy()
+            self._gerar_nomes_rename(pasta, padrao)
+        
+        ctk.CTkButton(
+            buttons_frame, text="🧩 Gerar Nomes", command=confirmar,
+            width=140, height=35, fg_color="#2B8B3D", hover_color="#228B22"
+        ).pack(side="left", padx=5)
+        
+        ctk.CTkButton(
+            buttons_frame, text="Cancelar", command=dialog.destroy,
+            width=100, height=35, fg_color="gray50"
+        ).pack(side="left", padx=5)
+
+    def _gerar_nomes_rename(self, pasta: str, padrao: PadraoNomeArquivo):
+        """Ler os XMLs da pasta em segundo plano e incluir os pares chave → nome na tabela"""
+        xmls = sorted(
+            os.path.join(pasta, arquivo) for arquivo in os.listdir(pasta)
+            if arquivo.lower().endswith('.xml')
+        )
+        if not xmls:
+            messagebox.showwarning("Aviso", "Nenhum XML encontrado na pasta")
+            return
+        
+        self.adicionar_log_rename(f"🧩 Gerando nomes com o padrão {padrao.padrao} para {len(xmls)} XMLs...")
+        self.btn_padrao_nome.configure(state="disabled")
+        self.progress_bar_rename.set(0)
+        
+        # Estado compartilhado com a thread; a interface o consulta algumas vezes por segundo
+        estado = {'lidos': 0, 'adicionados': 0, 'invalidas': 0, 'falhas': 0, 'erro': None, 'inicio': time.time()}
+        
+        def gerar_em_segundo_plano():
+            try:
+                def progresso(lidos, total):
+                    estado['lidos'] = lidos
+                
+                chaves, nomes, arquivos = [], [], {}
+                for xml_path, chave, nome, erro in padrao.gerar(xmls, progresso):
+                    if erro is not None or not chave:
+                        estado['falhas'] += 1
+                        self._agendar_log_rename(f"⚠️ {os.path.basename(xml_path)}: {erro or 'chave de acesso não encontrada'}")
+                        continue
+                    chaves.append(chave)
+                    nomes.append(nome)
+                    arquivos[chave] = os.path.basename(xml_path)
+                
+                self.arquivos_xml_rename.setdefault(pasta, {}).update(arquivos)
+                
+                # Validação em massa e inclusão na tabela em uma única operação
+                motivos = ValidadorChaveNFe.validar(chaves)
+                self.tabela_rename.adicionar(chaves, nomes, ValidadorChaveNFe.status(motivos))
+                estado['adicionados'] = len(chaves)
+                estado['invalidas'] = int((motivos != ValidadorChaveNFe.VALIDA).sum())
+            except Exception as e:
+                estado['erro'] = e
+        
+        thread = threading.Thread(target=gerar_em_segundo_plano, daemon=True)
+        thread.start()
+        
+        def acompanhar():
+            self._aplicar_atualizacoes_rename()
+            if thread.is_alive():
+                self.progress_bar_rename.set(estado['lidos'] / len(xmls))
+                self.status_var_rename.set(f"🧩 Lendo XMLs... {estado['lidos']:,}/{len(xmls):,}")
+                self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+                return
+            
+            self.btn_padrao_nome.configure(state="normal")
+            self.progress_bar_rename.set(1.0)
+            if estado['erro'] is not None:
+                self.adicionar_log_rename(f"❌ Erro ao gerar nomes: {estado['erro']}")
+                messagebox.showerror("Erro", f"Erro ao gerar nomes:\n{estado['erro']}")
+                self.status_var_rename.set("❌ Falha ao gerar nomes")
+                return
+            
+            self._executar_filtro_rename()
+            duracao = time.time() - estado['inicio']
+            self.adicionar_log_rename(
+                f"🧩 {estado['adicionados']:,} nomes gerados "
+                f"({estado['invalidas']:,} chaves inválidas, {estado['falhas']:,} XMLs ignorados) em {duracao:.1f}s"
+            )
+            self.status_var_rename.set(f"✅ Nomes gerados: {estado['adicionados']:,} itens")
+        
+        self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+
+    def consultar_catalogo_rename(self):
+        """Incluir na tabela notas do catálogo (filtradas por emitente, destinatário, período e valor)"""
+        if not os.path.exists(CatalogoNFe.CAMINHO_PADRAO):
+            messagebox.showinfo("Catálogo", "O catálogo ainda não existe: ele é criado durante a conversão de XMLs")
+            return
+        
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Consultar Catálogo")
+        dialog.geometry("520x460")
+        dialog.transient(self)
+        dialog.grab_set()
+        
+        # Centralizar
+        dialog.update_idletasks()
+        x = (dialog.winfo_screenwidth() // 2) - 260
+        y = (dialog.winfo_screenheight() // 2) - 230
+        dialog.geometry(f"520x460+{x}+{y}")
+        
+        title_label = ctk.CTkLabel(
+            dialog,
+            text="🗂️ Consultar Catálogo",
+            font=ctk.CTkFont(size=18, weight="bold")
+        )
+        title_label.pack(pady=(20, 10))
+        
+        campos_frame = ctk.CTkFrame(dialog, fg_color="transparent")
+        campos_frame.pack(fill="x", padx=20)
+        
+        filtros = {}
+        for linha, (campo, rotulo) in enumerate([
+            ('emit_cnpj', "CNPJ do emitente"),
+            ('dest_cnpj', "CNPJ do destinatário"),
+            ('data_inicio', "Emissão de (DD/MM/AAAA)"),
+            ('data_fim', "Emissão até (DD/MM/AAAA)"),
+            ('valor_minimo', "Valor mínimo (R$)"),
+        ]):
+            ctk.CTkLabel(campos_frame, text=rotulo, font=ctk.CTkFont(size=12)).grid(row=linha, column=0, sticky="w", pady=4)
+            filtros[campo] = ctk.CTkEntry(campos_frame, width=250)
+            filtros[campo].grid(row=linha, column=1, sticky="ew", padx=(10, 0), pady=4)
+        
+        ctk.CTkLabel(campos_frame, text="Padrão de nome", font=ctk.CTkFont(size=12)).grid(row=5, column=0, sticky="w", pady=4)
+        ctk.CTkEntry(campos_frame, textvariable=self.padrao_nome_var_rename, width=250).grid(row=5, column=1, sticky="ew", padx=(10, 0), pady=4)
+        
+        buttons_frame = ctk.CTkFrame(dialog, fg_color="transparent")
+        buttons_frame.pack(pady=20)
+        
+        def consultar():
+            try:
+                padrao = PadraoNomeArquivo(self.padrao_nome_var_rename.get())
+                valores = {campo: entrada.get().strip() for campo, entrada in filtros.items()}
+                valores['emit_cnpj'] = re.sub(r'\D', '', valores['emit_cnpj'])
+                valores['dest_cnpj'] = re.sub(r'\D', '', valores['dest_cnpj'])
+                valores['data_inicio'] = _data_iso(valores['data_inicio'])
+                valores['data_fim'] = _data_iso(valores['data_fim'])
+                valores['valor_minimo'] = float(valores['valor_minimo'].replace('.', '').replace(',', '.')) if valores['valor_minimo'] else None
+            except ValueError as e:
+                messagebox.showerror("Filtro inválido", str(e), parent=dialog)
+                return
+            
+            catalogo = CatalogoNFe()
+            try:
+                notas = catalogo.consultar(**valores)
+            finally:
+                catalogo.fechar()
+            dialog.destroy()
+            
+            if not notas:
+                self.adicionar_log_rename("🗂️ Nenhuma nota encontrada no catálogo")
+                return
+            
+            # Campos do catálogo no formato do padrão de nomes
+            chaves = [nota['chave'] for nota in notas]
+            nomes = [padrao.aplicar({c: '' if v is None else str(v) for c, v in nota.items()}) for nota in notas]
+            
+            # XMLs catalogados que estão na pasta selecionada podem ser localizados pelo conteúdo
+            pasta = self.selected_folder_rename.get()
+            if pasta:
+                arquivos = self.arquivos_xml_rename.setdefault(pasta, {})
+                for nota in notas:
+                    arquivo = nota.get('arquivo') or ''
+                    if os.path.normcase(os.path.dirname(arquivo)) == os.path.normcase(pasta):
+                        arquivos[nota['chave']] = os.path.basename(arquivo)
+            
+            motivos = ValidadorChaveNFe.validar(chaves)
+            self.tabela_rename.adicionar(chaves, nomes, ValidadorChaveNFe.status(motivos))
+            self._executar_filtro_rename()
+            self.adicionar_log_rename(f"🗂️ {len(notas):,} notas incluídas a partir do catálogo")
+        
+        ctk.CTkButton(
+            buttons_frame, text="🔍 Consultar e Incluir", command=consultar,
+            width=160, height=35, fg_color="#2B8B3D", hover_color="#228B22"
+        ).pack(side="left", padx=5)
+        
+        ctk.CTkButton(
+            buttons_frame, text="Cancelar", command=dialog.destroy,
+            width=100, height=35, fg_color="gray50"
+        ).pack(side="left", padx=5)
+
     def validar_todos_rename(self):
         """Validar todas as chaves de acesso"""
-        if self.dados_df.empty:
+        if len(self.tabela_rename) == 0:
             messagebox.showwarning("Aviso", "Nenhum dado para validar")
             return
             
@@ -2108,114 +5953,131 @@ class NFeStudioPro(ctk.CTk):
         progress_text = ctk.CTkLabel(progress_dialog, text="0%")
         progress_text.pack(pady=5)
         
-        total_rows = len(self.dados_df)
-        validados = 0
-        erros = 0
-        
-        # Processar em lotes
-        batch_size = 50
-        for i in range(0, total_rows, batch_size):
-            batch_end = min(i + batch_size, total_rows)
-            
-            for idx in range(i, batch_end):
-                chave = str(self.dados_df.iloc[idx]['Chave Acesso NF'])
-                
-                if self.validar_chave_acesso_rename(chave):
-                    self.dados_df.loc[idx, 'Status'] = "Válido"
-                    validados += 1
-                else:
-                    self.dados_df.loc[idx, 'Status'] = "Erro - Chave inválida"
-                    erros += 1
-                    
-                # Atualizar progress
-                progress = (idx + 1) / total_rows
-                progress_bar.set(progress)
-                progress_text.configure(text=f"{int(progress * 100)}%")
-                status_label.configure(text=f"Validando... {idx + 1}/{total_rows}")
-                
-            # Atualizar interface
-            progress_dialog.update()
-            self.update_idletasks()
+        ids = self.tabela_rename.ids_ativos()
+        chaves = self.tabela_rename.chaves(ids)
+        total_rows = len(ids)
         
-        # Recarregar dados na tree
-        self.carregar_dados_na_tree()
+        # Estado compartilhado com a thread; a interface o consulta algumas vezes por segundo
+        estado = {'processadas': 0, 'motivos': None, 'erro': None}
         
-        # Fechar dialog
-        progress_dialog.destroy()
+        def validar_em_segundo_plano():
+            try:
+                def progresso(processadas, total):
+                    estado['processadas'] = processadas
+                motivos = ValidadorChaveNFe.validar(chaves, progresso)
+                # Atualização em massa dos status
+                self.tabela_rename.definir_status(ids, ValidadorChaveNFe.status(motivos))
+                estado['motivos'] = motivos
+            except Exception as e:
+                estado['erro'] = e
         
-        # Mostrar resultado
-        resultado_msg = f"✅ Validação concluída!\n\n"
-        resultado_msg += f"📊 Total processado: {total_rows}\n"
-        resultado_msg += f"✅ Válidos: {validados}\n"
-        resultado_msg += f"❌ Erros: {erros}"
+        thread = threading.Thread(target=validar_em_segundo_plano, daemon=True)
+        thread.start()
         
-        self.adicionar_log_rename(f"✅ Validação concluída: {validados} válidos, {erros} erros")
-        self.status_var_rename.set(f"✅ Validação: {validados} válidos, {erros} erros")
+        def acompanhar():
+            processadas = estado['processadas']
+            progress = processadas / total_rows if total_rows else 1
+            progress_bar.set(progress)
+            progress_text.configure(text=f"{int(progress * 100)}%")
+            status_label.configure(text=f"Validando... {processadas}/{total_rows}")
+            
+            if thread.is_alive():
+                self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+                return
+            
+            # Fechar dialog
+            progress_dialog.destroy()
+            
+            if estado['erro'] is not None:
+                self.adicionar_log_rename(f"❌ Erro na validação: {estado['erro']}")
+                messagebox.showerror("Erro", f"Erro durante validação:\n{estado['erro']}")
+                return
+            
+            motivos = estado['motivos']
+            validados = int((motivos == ValidadorChaveNFe.VALIDA).sum())
+            erros = total_rows - validados
+            
+            # Recarregar dados na tree (respeitando o filtro ativo)
+            self._executar_filtro_rename()
+            
+            # Mostrar resultado
+            resultado_msg = f"✅ Validação concluída!\n\n"
+            resultado_msg += f"📊 Total processado: {total_rows}\n"
+            resultado_msg += f"✅ Válidos: {validados}\n"
+            resultado_msg += f"❌ Erros: {erros}"
+            
+            contagem = np.bincount(motivos, minlength=len(ValidadorChaveNFe.MOTIVOS))
+            detalhes = [f"{ValidadorChaveNFe.MOTIVOS[m]}: {int(qtd)}" for m, qtd in enumerate(contagem) if m and qtd]
+            if detalhes:
+                resultado_msg += "\n\n" + "\n".join(detalhes)
+            
+            self.adicionar_log_rename(f"✅ Validação concluída: {validados} válidos, {erros} erros")
+            if detalhes:
+                self.adicionar_log_rename(f"⚠️ Motivos: {', '.join(detalhes)}")
+            self.status_var_rename.set(f"✅ Validação: {validados} válidos, {erros} erros")
+            
+            messagebox.showinfo("Validação Concluída", resultado_msg)
         
-        messagebox.showinfo("Validação Concluída", resultado_msg)
+        self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
 
     def aplicar_filtro_rename(self, *args):
-        """Aplicar filtro de texto em tempo real"""
+        """Agendar o filtro de texto (debounce: só roda após uma pausa na digitação)"""
         if not hasattr(self, 'tree') or not hasattr(self, 'filtro_var_rename'):
             return
-            
-        filtro_texto = self.filtro_var_rename.get().lower()
         
-        # Limpar tree
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        if self._filtro_agendado is not None:
+            self.after_cancel(self._filtro_agendado)
+        self._filtro_agendado = self.after(self.ATRASO_FILTRO_RENAME_MS, self._executar_filtro_rename)
+
+    def _executar_filtro_rename(self):
+        """Aplicar filtro de texto e de status usando o índice de busca da tabela"""
+        self._filtro_agendado = None
+        if not hasattr(self, 'tree'):
+            return
             
-        # Filtrar dados
-        dados_filtrados = self.dados_df.copy()
-        
-        if filtro_texto:
-            # Filtrar por chave ou nome
-            mascara = (
-                dados_filtrados['Chave Acesso NF'].astype(str).str.lower().str.contains(filtro_texto, na=False) |
-                dados_filtrados['Nome Arq. NF'].astype(str).str.lower().str.contains(filtro_texto, na=False)
-            )
-            dados_filtrados = dados_filtrados[mascara]
+        filtro_texto = self.filtro_var_rename.get().lower()
         
-        # Aplicar filtro de status se existir
-        if hasattr(self, 'status_filtro_ativo') and self.status_filtro_ativo != "Todos":
-            if self.status_filtro_ativo == "Válidos":
-                dados_filtrados = dados_filtrados[dados_filtrados['Status'] == "Válido"]
-            elif self.status_filtro_ativo == "Erros":
-                dados_filtrados = dados_filtrados[dados_filtrados['Status'].str.contains("Erro", na=False)]
+        # Reaproveitar a última busca; se a consulta apenas cresceu, refinar o resultado anterior
+        anterior = self._resultado_filtro_texto
+        versao = self.tabela_rename.versao_texto
+        if anterior is not None and anterior[0] == versao and anterior[1] == filtro_texto:
+            ids_texto = anterior[2]
+        else:
+            ids_base = None
+            if anterior is not None and anterior[0] == versao and anterior[1] in filtro_texto:
+                ids_base = anterior[2]
+            ids_texto = self.tabela_rename.buscar(filtro_texto, ids_base)
+            self._resultado_filtro_texto = (versao, filtro_texto, ids_texto)
+        
+        # Aplicar filtro de status se existir (por código, sem reprocessar o texto)
+        codigo_filtro = {
+            "Válidos": TabelaRenomeacao.STATUS_VALIDO,
+            "Erros": TabelaRenomeacao.STATUS_ERRO,
+            "Sucessos": TabelaRenomeacao.STATUS_SUCESSO
+        }.get(getattr(self, 'status_filtro_ativo', ""))
+        ids = ids_texto
+        if codigo_filtro is not None:
+            ids = self.tabela_rename.filtrar_status(ids, codigo_filtro)
         
         # Carregar dados filtrados
-        for idx, row in dados_filtrados.iterrows():
-            status = row['Status']
-            tag = ""
-            if "Válido" in status:
-                tag = "valido"
-            elif "Erro" in status:
-                tag = "erro"
-            elif "Processando" in status:
-                tag = "processando"
-            elif "Sucesso" in status:
-                tag = "sucesso"
-                
-            self.tree.insert("", "end", values=(
-                row['Chave Acesso NF'],
-                row['Nome Arq. NF'],
-                status
-            ), tags=(tag,))
+        self.tree_virtual.definir_ids(ids)
         
         # Atualizar contador
-        total_filtrado = len(dados_filtrados)
-        total_geral = len(self.dados_df)
+        total_filtrado = len(ids)
+        total_geral = len(self.tabela_rename)
         self.status_var_rename.set(f"Mostrando {total_filtrado} de {total_geral} itens")
 
     def filtrar_por_status_rename(self, status_filtro: str):
         """Filtrar por status específico"""
         self.status_filtro_ativo = status_filtro
         self.adicionar_log_rename(f"🔍 Filtro aplicado: {status_filtro}")
-        self.aplicar_filtro_rename()
+        if self._filtro_agendado is not None:
+            self.after_cancel(self._filtro_agendado)
+        self._executar_filtro_rename()
 
     def iniciar_renomeacao(self):
-        """Iniciar processo de renomeação"""
-        if self.dados_df.empty:
+        """Iniciar processo de renomeação (pré-verificação do plano e confirmação)"""
+        if len(self.tabela_rename) == 0:
             messagebox.showwarning("Aviso", "Nenhum dado para processar")
             return
             
@@ -2223,49 +6085,188 @@ class NFeStudioPro(ctk.CTk):
             messagebox.showwarning("Aviso", "Selecione uma pasta primeiro")
             return
         
+        if self._renomeacao_em_andamento():
+            messagebox.showwarning("Aviso", "Aguarde o término da operação em andamento")
+            return
+        
+        # Uma renomeação interrompida precisa ser concluída ou revertida antes de outra
+        if not self.verificar_diario_rename(self.selected_folder_rename.get()):
+            return
+        
         # Verificar se há dados válidos
-        dados_validos = self.dados_df[self.dados_df['Status'] == "Válido"]
-        if dados_validos.empty:
+        ids_validos = self.tabela_rename.ids_com_status(TabelaRenomeacao.STATUS_VALIDO)
+        if len(ids_validos) == 0:
             messagebox.showwarning("Aviso", "Nenhum dado válido para renomear")
             return
         
-        # Confirmação
-        total_validos = len(dados_validos)
-        confirmacao = messagebox.askyesno(
-            "Confirmar Renomeação",
-            f"Deseja renomear {total_validos} arquivos?\n\n"
-            f"📁 Pasta: {Path(self.selected_folder_rename.get()).name}\n"
-            f"📄 Arquivos válidos: {total_validos}\n\n"
-            "⚠️ Esta operação não pode ser desfeita!"
+        pasta = self.selected_folder_rename.get()
+        dados_validos = self.tabela_rename.linhas(ids_validos)
+        self.adicionar_log_rename("🧭 Verificando plano de renomeação...")
+        self.status_var_rename.set("🧭 Verificando plano de renomeação...")
+        
+        # Pré-verificação em segundo plano: nenhum arquivo é tocado até a confirmação
+        estado = {'plano': None, 'erro': None}
+        
+        def planejar():
+            try:
+                planejador = PlanejadorRenomeacao(pasta, arquivos_por_chave=self.arquivos_xml_rename.get(pasta))
+                estado['plano'] = planejador.planejar(
+                    ids_validos.tolist(),
+                    [linha[0] for linha in dados_validos],
+                    [linha[1] for linha in dados_validos]
+                )
+            except Exception as e:
+                estado['erro'] = e
+        
+        # O botão fica desabilitado da pré-verificação até o fim da renomeação (ou o cancelamento)
+        self.btn_renomear.configure(state="disabled")
+        self.renomeacao_thread = threading.Thread(target=planejar, daemon=True)
+        self.renomeacao_thread.start()
+        
+        def acompanhar():
+            if self.renomeacao_thread.is_alive():
+                self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+                return
+            if estado['erro'] is not None:
+                self.btn_renomear.configure(state="normal")
+                self.adicionar_log_rename(f"❌ Erro na pré-verificação: {estado['erro']}")
+                messagebox.showerror("Erro", f"Erro ao montar o plano de renomeação:\n{estado['erro']}")
+                return
+            self.mostrar_plano_rename(estado['plano'])
+        
+        self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, acompanhar)
+
+    def mostrar_plano_rename(self, plano: PlanoRenomeacao):
+        """Exibir o resultado da pré-verificação e pedir confirmação"""
+        operacoes = plano.operacoes()
+        resumo = plano.resumo()
+        self.status_var_rename.set(f"🧭 Plano: {len(operacoes)} renomeações")
+        self.adicionar_log_rename(f"🧭 Plano verificado: {len(operacoes)} renomeações, {len(resumo)} tipos de ocorrência")
+        
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Pré-verificação da Renomeação")
+        dialog.geometry("560x460")
+        dialog.transient(self)
+        dialog.grab_set()
+        
+        # Centralizar
+        dialog.update_idletasks()
+        x = (dialog.winfo_screenwidth() // 2) - 280
+        y = (dialog.winfo_screenheight() // 2) - 230
+        dialog.geometry(f"560x460+{x}+{y}")
+        
+        title_label = ctk.CTkLabel(
+            dialog,
+            text="🧭 Plano de Renomeação",
+            font=ctk.CTkFont(size=18, weight="bold")
         )
+        title_label.pack(pady=(20, 10))
         
-        if not confirmacao:
+        linhas = [
+            f"📁 Pasta: {Path(plano.pasta).name}",
+            f"📄 Arquivos a renomear: {len(operacoes)}",
+            ""
+        ]
+        for ocorrencia, quantidade in sorted(resumo.items(), key=lambda item: -item[1]):
+            icone = "❌" if ocorrencia in PlanejadorRenomeacao.ERROS else "⚠️"
+            linhas.append(f"{icone} {ocorrencia}: {quantidade}")
+        if not resumo:
+            linhas.append("✅ Nenhuma ocorrência encontrada")
+        linhas += ["", "↩️ A operação fica registrada e pode ser desfeita pelo botão Desfazer"]
+        
+        resumo_text = ctk.CTkTextbox(dialog, height=260, font=ctk.CTkFont(size=12))
+        resumo_text.pack(fill="both", expand=True, padx=20, pady=(0, 10))
+        resumo_text.insert("1.0", "\n".join(linhas))
+        resumo_text.configure(state="disabled")
+        
+        buttons_frame = ctk.CTkFrame(dialog, fg_color="transparent")
+        buttons_frame.pack(pady=(0, 20))
+        
+        def exportar():
+            arquivo = filedialog.asksaveasfilename(
+                parent=dialog,
+                title="Exportar Plano (Simulação)",
+                defaultextension=".xlsx",
+                filetypes=[
+                    ("Planilha Excel", "*.xlsx"),
+                    ("CSV", "*.csv")
+                ],
+                initialfile=f"plano_renomeacao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+            )
+            if not arquivo:
+                return
+            self.adicionar_log_rename(f"💾 Exportando plano: {os.path.basename(arquivo)}...")
+            
+            def exportar_em_segundo_plano():
+                try:
+                    plano.exportar(arquivo)
+                    self._agendar_log_rename(f"💾 Plano exportado: {os.path.basename(arquivo)}")
+                except Exception as e:
+                    self._agendar_log_rename(f"❌ Erro ao exportar plano: {str(e)}")
+                self.after(0, self._aplicar_atualizacoes_rename)
+            
+            threading.Thread(target=exportar_em_segundo_plano, daemon=True).start()
+        
+        def confirmar():
+            dialog.destroy()
+            self.executar_plano_rename(plano)
+        
+        def cancelar():
+            dialog.destroy()
+            self.btn_renomear.configure(state="normal")
             self.adicionar_log_rename("❌ Renomeação cancelada pelo usuário")
-            return
+            self.status_var_rename.set("Renomeação cancelada")
+        
+        ctk.CTkButton(
+            buttons_frame, text=f"🔄 Renomear {len(operacoes)} Arquivos", command=confirmar,
+            width=180, height=35, fg_color="#2B8B3D", hover_color="#228B22",
+            state="normal" if operacoes else "disabled"
+        ).pack(side="left", padx=5)
+        
+        ctk.CTkButton(
+            buttons_frame, text="💾 Exportar Plano", command=exportar,
+            width=140, height=35, fg_color="#2196F3"
+        ).pack(side="left", padx=5)
+        
+        ctk.CTkButton(
+            buttons_frame, text="Cancelar", command=cancelar,
+            width=100, height=35, fg_color="gray50"
+        ).pack(side="left", padx=5)
         
+        dialog.protocol("WM_DELETE_WINDOW", cancelar)
+
+    def executar_plano_rename(self, plano: PlanoRenomeacao):
+        """Executar um plano já verificado"""
         self.adicionar_log_rename("🚀 Iniciando processo de renomeação...")
         
         # Desabilitar botões durante processamento
-        if hasattr(self, 'renomear_btn'):
-            self.renomear_btn.configure(state="disabled", text="🔄 Renomeando...")
+        self.btn_renomear.configure(state="disabled", text="🔄 Renomeando...")
+        self.btn_desfazer.configure(state="disabled")
         
         # Iniciar thread de renomeação
-        import threading
-        self.renomeacao_thread = threading.Thread(target=self.renomear_arquivos_thread, daemon=True)
+        self.renomeacao_thread = threading.Thread(target=self.renomear_arquivos_thread, args=(plano,), daemon=True)
         self.renomeacao_thread.start()
+        
+        # Atualizar a tabela em lotes enquanto a thread trabalha
+        self.after(self.INTERVALO_ATUALIZACAO_RENAME_MS, self._ciclo_atualizacao_rename)
 
     def limpar_lista_rename(self):
         """Limpar lista de dados"""
-        self.dados_df = pd.DataFrame(columns=['Chave Acesso NF', 'Nome Arq. NF', 'Status'])
+        self.tabela_rename.limpar()
         if hasattr(self, 'tree'):
             self.carregar_dados_na_tree()
 
     def atualizar_contador_rename(self):
         """Atualizar contador de itens"""
         if hasattr(self, 'status_var_rename'):
-            total = len(self.dados_df)
+            total = len(self.tabela_rename)
             self.status_var_rename.set(f"Total: {total} itens")
 
+    def atualizar_selecao_rename(self, exibidos: int, selecionados: int):
+        """Atualizar contador de itens exibidos e selecionados"""
+        if hasattr(self, 'contador_label'):
+            self.contador_label.configure(text=f"Itens: {exibidos} | Selecionados: {selecionados}")
+
     def adicionar_log_rename(self, mensagem: str):
         """Adicionar mensagem ao log do renomeador (apenas se a tela renomeador está ativa)"""
         # VERIFICAÇÃO RIGOROSA: Só adicionar se ESTIVER na tela do renomeador E o widget do renomeador existir
@@ -2310,7 +6311,7 @@ class NFeStudioPro(ctk.CTk):
                 with open(arquivo, 'w', encoding='utf-8') as f:
                     f.write(f"=== LOG DO RENOMEADOR NFe ===\n")
                     f.write(f"Data/Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-                    f.write(f"Total de itens: {len(self.dados_df)}\n")
+                    f.write(f"Total de itens: {len(self.tabela_rename)}\n")
                     f.write("=" * 50 + "\n\n")
                     f.write(log_content)
                     
@@ -2326,9 +6327,8 @@ class NFeStudioPro(ctk.CTk):
     def selecionar_todos_rename(self):
         """Selecionar todos os itens na TreeView"""
         if hasattr(self, 'tree'):
-            for item in self.tree.get_children():
-                self.tree.selection_add(item)
-            self.adicionar_log_rename(f"✅ Selecionados todos os {len(self.tree.get_children())} itens")
+            self.tree_virtual.selecionar_todos()
+            self.adicionar_log_rename(f"✅ Selecionados todos os {len(self.tree_virtual)} itens")
 
     def editar_item_rapido_rename(self, event):
         """Editar item rapidamente com duplo clique"""
@@ -2339,12 +6339,8 @@ class NFeStudioPro(ctk.CTk):
         if not item:
             return
             
-        values = self.tree.item(item, 'values')
-        if not values:
-            return
-            
-        chave_acesso = values[0]
-        nome_atual = values[1]
+        id_linha = int(item)
+        chave_acesso, nome_atual, _ = self.tabela_rename.linha(id_linha)
         
         # Dialog de edição
         dialog = ctk.CTkToplevel(self)
@@ -2378,17 +6374,13 @@ class NFeStudioPro(ctk.CTk):
                 messagebox.showwarning("Aviso", "Preencha todos os campos")
                 return
                 
-            # Atualizar DataFrame
-            mask = self.dados_df['Chave Acesso NF'] == chave_acesso
-            self.dados_df.loc[mask, 'Chave Acesso NF'] = nova_chave
-            self.dados_df.loc[mask, 'Nome Arq. NF'] = novo_nome
+            # Atualizar tabela
+            self.tabela_rename.editar(id_linha, nova_chave, novo_nome)
             
             # Revalidar se a chave mudou
             if nova_chave != chave_acesso:
-                if self.validar_chave_acesso_rename(nova_chave):
-                    self.dados_df.loc[mask, 'Status'] = "Válido"
-                else:
-                    self.dados_df.loc[mask, 'Status'] = "Erro - Chave inválida"
+                motivos = ValidadorChaveNFe.validar([nova_chave])
+                self.tabela_rename.definir_status(id_linha, ValidadorChaveNFe.status(motivos)[0])
             
             self.carregar_dados_na_tree()
             self.adicionar_log_rename(f"✏️ Item editado: {nova_chave[:20]}...")
@@ -2410,7 +6402,7 @@ class NFeStudioPro(ctk.CTk):
         if not item:
             return
             
-        self.tree.selection_set(item)
+        self.tree_virtual.selecionar([int(item)])
         
         # Criar menu de contexto
         menu = tk.Menu(self, tearoff=0)
@@ -2432,16 +6424,13 @@ class NFeStudioPro(ctk.CTk):
         if not hasattr(self, 'tree') or not item:
             return
             
-        values = self.tree.item(item, 'values')
-        if not values:
-            return
-            
-        chave_acesso = values[0]
+        id_linha = int(item)
+        chave_acesso = self.tabela_rename.linha(id_linha)[0]
         
         confirmacao = messagebox.askyesno("Confirmar Remoção", f"Remover item?\n\nChave: {chave_acesso}")
         if confirmacao:
-            # Remover do DataFrame
-            self.dados_df = self.dados_df[self.dados_df['Chave Acesso NF'] != chave_acesso]
+            # Remover da tabela
+            self.tabela_rename.remover(id_linha)
             self.carregar_dados_na_tree()
             self.adicionar_log_rename(f"🗑️ Item removido: {chave_acesso[:20]}...")
 
@@ -2450,22 +6439,14 @@ class NFeStudioPro(ctk.CTk):
         if not hasattr(self, 'tree') or not item:
             return
             
-        values = self.tree.item(item, 'values')
-        if not values:
-            return
-            
-        chave_acesso = values[0]
-        nome_arquivo = values[1]
+        chave_acesso, nome_arquivo, _ = self.tabela_rename.linha(int(item))
         
         # Criar novo item duplicado
-        novo_item = {
-            'Chave Acesso NF': chave_acesso + "_COPIA",
-            'Nome Arq. NF': nome_arquivo + " (Cópia)",
-            'Status': "Erro - Chave inválida"
-        }
-        
-        df_novo = pd.DataFrame([novo_item])
-        self.dados_df = pd.concat([self.dados_df, df_novo], ignore_index=True)
+        self.tabela_rename.adicionar(
+            [chave_acesso + "_COPIA"],
+            [nome_arquivo + " (Cópia)"],
+            "Erro - Chave inválida"
+        )
         self.carregar_dados_na_tree()
         self.adicionar_log_rename(f"📋 Item duplicado: {chave_acesso[:20]}...")
 
@@ -2474,106 +6455,70 @@ class NFeStudioPro(ctk.CTk):
         if not hasattr(self, 'tree') or not item:
             return
             
-        values = self.tree.item(item, 'values')
-        if not values:
-            return
-            
-        chave_acesso = values[0]
+        id_linha = int(item)
+        chave_acesso = self.tabela_rename.linha(id_linha)[0]
         
         # Atualizar status
-        self.dados_df.loc[self.dados_df['Chave Acesso NF'] == chave_acesso, 'Status'] = novo_status
+        self.tabela_rename.definir_status(id_linha, novo_status)
         self.carregar_dados_na_tree()
         self.adicionar_log_rename(f"🏷️ Status alterado para '{novo_status}': {chave_acesso[:20]}...")
 
-    def renomear_arquivos_thread(self):
-        """Thread para renomeação de arquivos"""
-        pasta = self.selected_folder_rename.get()
-        dados_validos = self.dados_df[self.dados_df['Status'] == "Válido"].copy()
-        
-        total_arquivos = len(dados_validos)
+    def renomear_arquivos_thread(self, plano: PlanoRenomeacao):
+        """Thread para renomeação de arquivos: grava o diário do plano verificado e executa"""
+        pasta = plano.pasta
+        total_arquivos = len(plano.registros)
         arquivos_renomeados = 0
         arquivos_nao_encontrados = 0
         erros = 0
         
         try:
-            # Listar todos os arquivos da pasta
-            arquivos_pasta = os.listdir(pasta)
+            # Linhas barradas na pré-verificação ou que já têm o nome final
+            for registro in plano.registros:
+                idx = registro["id"]
+                ocorrencias = registro["ocorrencias"]
+                if PlanoRenomeacao.situacao(registro) == "Erro":
+                    motivo = next(o for o in ocorrencias if o in PlanejadorRenomeacao.ERROS)
+                    status = f"Erro - {motivo}"
+                    if motivo == PlanejadorRenomeacao.NAO_ENCONTRADO:
+                        arquivos_nao_encontrados += 1
+                        self._agendar_log_rename(f"❌ Arquivo não encontrado para chave: {registro['chave'][:20]}...")
+                    else:
+                        erros += 1
+                        self._agendar_log_rename(f"❌ {motivo}: {registro['chave'][:20]}...")
+                elif PlanejadorRenomeacao.INALTERADO in ocorrencias:
+                    status = f"Sucesso - {registro['destino']}"
+                else:
+                    status = "Processando..."
+                self.tabela_rename.definir_status(idx, status)
+                self._agendar_status_rename(idx, status)
             
-            for idx, (_, row) in enumerate(dados_validos.iterrows()):
-                chave_acesso = str(row['Chave Acesso NF'])
-                novo_nome = str(row['Nome Arq. NF'])
-                
-                # Atualizar status para processando
-                self.dados_df.loc[self.dados_df['Chave Acesso NF'] == chave_acesso, 'Status'] = "Processando..."
-                
-                # Atualizar interface na thread principal
-                self.after(0, self.carregar_dados_na_tree)
-                self.after(0, lambda i=idx+1, t=total_arquivos: self.adicionar_log_rename(f"🔄 Processando {i}/{t}: {chave_acesso[:20]}..."))
-                
-                # Procurar arquivo com essa chave
-                arquivo_encontrado = None
-                for arquivo in arquivos_pasta:
-                    if chave_acesso in arquivo:
-                        arquivo_encontrado = arquivo
-                        break
-                
-                if not arquivo_encontrado:
-                    # Arquivo não encontrado
-                    self.dados_df.loc[self.dados_df['Chave Acesso NF'] == chave_acesso, 'Status'] = "Erro - Arquivo não encontrado"
-                    arquivos_nao_encontrados += 1
-                    self.after(0, lambda: self.adicionar_log_rename(f"❌ Arquivo não encontrado para chave: {chave_acesso[:20]}..."))
-                    continue
-                
-                try:
-                    # Construir caminhos
-                    arquivo_original = os.path.join(pasta, arquivo_encontrado)
-                    extensao = os.path.splitext(arquivo_encontrado)[1]
-                    
-                    # Limpar nome do arquivo (remover caracteres inválidos)
-                    nome_limpo = re.sub(r'[<>:"/\\|?*]', '', novo_nome)
-                    nome_limpo = nome_limpo.strip()
-                    
-                    if not nome_limpo:
-                        nome_limpo = f"NF_{chave_acesso}"
-                    
-                    arquivo_novo = os.path.join(pasta, f"{nome_limpo}{extensao}")
-                    
-                    # Verificar se arquivo de destino já existe
-                    contador = 1
-                    arquivo_final = arquivo_novo
-                    while os.path.exists(arquivo_final):
-                        nome_com_contador = f"{nome_limpo} ({contador})"
-                        arquivo_final = os.path.join(pasta, f"{nome_com_contador}{extensao}")
-                        contador += 1
-                    
-                    # Renomear arquivo
-                    shutil.move(arquivo_original, arquivo_final)
-                    
-                    # Atualizar status
-                    nome_final = os.path.basename(arquivo_final)
-                    self.dados_df.loc[self.dados_df['Chave Acesso NF'] == chave_acesso, 'Status'] = f"Sucesso - {nome_final}"
+            operacoes = plano.operacoes()
+            
+            # O plano vai para o disco antes da primeira renomeação
+            diario = DiarioRenomeacao(pasta)
+            if operacoes:
+                diario.gravar_plano(operacoes)
+                self._agendar_log_rename(f"📝 Plano gravado no diário: {len(operacoes)} renomeações")
+            
+            def ao_concluir(op, erro):
+                nonlocal arquivos_renomeados, erros
+                self._registrar_operacao_rename(op, erro, ids=[op["id"]])
+                if erro is None:
                     arquivos_renomeados += 1
-                    
-                    self.after(0, lambda nome=nome_final: self.adicionar_log_rename(f"✅ Renomeado: {nome}"))
-                    
-                except Exception as e:
-                    # Erro durante renomeação
-                    self.dados_df.loc[self.dados_df['Chave Acesso NF'] == chave_acesso, 'Status'] = f"Erro - {str(e)}"
+                else:
                     erros += 1
-                    self.after(0, lambda erro=str(e): self.adicionar_log_rename(f"❌ Erro: {erro}"))
-                
-                # Pequena pausa para não sobrecarregar
-                import time
-                time.sleep(0.1)
+            
+            if operacoes:
+                diario.executar(ao_concluir, executor=self._executor_rename())
             
             # Finalizar processo
             def finalizar_renomeacao():
                 # Reabilitar botões
-                if hasattr(self, 'renomear_btn'):
-                    self.renomear_btn.configure(state="normal", text="🔄 Renomear Tudo")
+                self.btn_renomear.configure(state="normal", text="🔄 Renomear Tudo")
+                self.btn_desfazer.configure(state="normal")
                 
-                # Recarregar dados
-                self.carregar_dados_na_tree()
+                # Aplicar as últimas atualizações pendentes
+                self._aplicar_atualizacoes_rename()
                 
                 # Log final
                 self.adicionar_log_rename("🎉 Processo de renomeação concluído!")
@@ -2593,14 +6538,92 @@ class NFeStudioPro(ctk.CTk):
             
         except Exception as e:
             def mostrar_erro():
-                if hasattr(self, 'renomear_btn'):
-                    self.renomear_btn.configure(state="normal", text="🔄 Renomear Tudo")
+                self.btn_renomear.configure(state="normal", text="🔄 Renomear Tudo")
+                self.btn_desfazer.configure(state="normal")
+                self._aplicar_atualizacoes_rename()
                 self.adicionar_log_rename(f"💥 Erro crítico: {str(e)}")
                 messagebox.showerror("Erro", f"Erro durante renomeação:\n{str(e)}")
             
             self.after(0, mostrar_erro)
 
 
+def _data_iso(texto: str) -> str:
+    """Aceitar datas DD/MM/AAAA ou AAAA-MM-DD e devolver AAAA-MM-DD"""
+    if not texto:
+        return texto
+    texto = texto.strip()
+    if '/' in texto:
+        return datetime.strptime(texto, '%d/%m/%Y').strftime('%Y-%m-%d')
+    return datetime.strptime(texto, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+def executar_cli(argumentos: List[str]) -> int:
+    """Linha de comando: python app_massa.py catalogo --emitente <CNPJ> --de 01/03/2025 --valor-min 10000
+    ou python app_massa.py mesclar <pasta com os relatórios das fatias>"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="app_massa.py", description="NFe Studio Pro - linha de comando")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    
+    consulta = subcomandos.add_parser("catalogo", help="Consultar o catálogo de notas processadas")
+    consulta.add_argument("--banco", default=CatalogoNFe.CAMINHO_PADRAO, help="Arquivo SQLite do catálogo")
+    consulta.add_argument("--chave", help="Chave de acesso")
+    consulta.add_argument("--emitente", help="CNPJ/CPF do emitente")
+    consulta.add_argument("--destinatario", help="CNPJ/CPF do destinatário")
+    consulta.add_argument("--de", dest="data_inicio", type=_data_iso, help="Emissão a partir de (DD/MM/AAAA)")
+    consulta.add_argument("--ate", dest="data_fim", type=_data_iso, help="Emissão até (DD/MM/AAAA)")
+    consulta.add_argument("--valor-min", type=float, help="Valor total mínimo (vNF)")
+    consulta.add_argument("--valor-max", type=float, help="Valor total máximo (vNF)")
+    consulta.add_argument("--numero", type=int, help="Número da NF")
+    consulta.add_argument("--limite", type=int, help="Quantidade máxima de notas")
+    consulta.add_argument("--csv", help="Gravar o resultado em CSV em vez de exibir")
+    
+    mesclagem = subcomandos.add_parser("mesclar", help="Combinar os relatórios das fatias i/N em um relatório único")
+    mesclagem.add_argument("pasta", help="Pasta com os relatórios Relatorio_Conversao_NFe_*_fatia_*.xlsx")
+    mesclagem.add_argument("--saida", help="Arquivo Excel de saída (padrão: novo relatório na mesma pasta)")
+    
+    args = parser.parse_args(argumentos)
+    
+    if args.comando == "mesclar":
+        try:
+            resultado = ProcessadorMassa.mesclar_relatorios(args.pasta, args.saida)
+        except (OSError, ValueError) as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        print(f"{resultado['arquivos']:,} arquivos de {len(resultado['fatias'])}/{resultado['total_fatias']} fatias")
+        print(f"Relatório: {resultado['excel_path']}")
+        if resultado['ausentes']:
+            print(f"Fatias ausentes: {', '.join(map(str, resultado['ausentes']))}", file=sys.stderr)
+            return 2
+        return 0
+    
+    if args.comando == "catalogo":
+        if not os.path.exists(args.banco):
+            print(f"Catálogo não encontrado: {args.banco}", file=sys.stderr)
+            return 1
+        catalogo = CatalogoNFe(args.banco)
+        try:
+            notas = catalogo.consultar(
+                chave=args.chave, emit_cnpj=args.emitente, dest_cnpj=args.destinatario,
+                data_inicio=args.data_inicio, data_fim=args.data_fim,
+                valor_minimo=args.valor_min, valor_maximo=args.valor_max,
+                numero=args.numero, limite=args.limite
+            )
+        finally:
+            catalogo.fechar()
+        
+        df = pd.DataFrame(notas, columns=list(CatalogoNFe.COLUNAS))
+        if args.csv:
+            df.to_csv(args.csv, sep=";", index=False, encoding="utf-8-sig")
+            print(f"{len(df)} notas gravadas em {args.csv}")
+        else:
+            colunas = ['chave', 'nNF', 'serie', 'data_emissao', 'emit_CNPJ', 'emit_xNome', 'dest_CNPJ', 'vNF', 'status']
+            print(df[colunas].to_string(index=False) if len(df) else "Nenhuma nota encontrada")
+            print(f"\n{len(df)} notas")
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(executar_cli(sys.argv[1:]))
     app = NFeStudioPro()
     app.mainloop()